@@ -20,12 +20,14 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # See https://docs.djangoproject.com/en/3.2/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-%hc+y-io7fi7np*8&om&v&l@e!39g#1r&swh$&pc80fo@-tc)7'
+SECRET_KEY = os.environ.get(
+    'DJANGO_SECRET_KEY', 'django-insecure-%hc+y-io7fi7np*8&om&v&l@e!39g#1r&swh$&pc80fo@-tc)7'
+)
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', '1') == '1'
 
-ALLOWED_HOSTS = ['localhost']
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost').split(',')
 
 
 # Application definition
@@ -43,11 +45,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Проверки балансировщика обслуживаются до проверки Host и сессий
+    'bookmarks.health.HealthCheckMiddleware',
+    # Server-Timing и /metrics; отрисовку шаблонов замеряет последней из middleware
+    'bookmarks.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'bookmarks.routers.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,17 +84,45 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Соединение переживает запрос (CONN_MAX_AGE) и проверяется перед повторным использованием.
+# Открытых соединений не больше WEB_CONCURRENCY × GUNICORN_THREADS на контейнер: под ASGI
+# Django 3.2 выполняет синхронный код процесса в одном потоке, соединение одно на процесс.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'fruktorum',
-        'USER': 'postgres',
-        'PASSWORD': 'mypassword',
-        'HOST': 'db',
-        'PORT': '5432'
+        'ENGINE': 'bookmarks.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'fruktorum'),
+        'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'db'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        'OPTIONS': {
+            'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+        },
     }
 }
 
+# DB_POOLER=pgbouncer: подключение через pgbouncer в режиме transaction
+DB_POOLER = os.environ.get('DB_POOLER', '')
+if DB_POOLER == 'pgbouncer':
+    # Серверный курсор (.iterator()) не переживает транзакцию, а соединение pgbouncer меняет между ними
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+# Реплики для чтения списков и поиска: POSTGRES_REPLICA_HOSTS=replica1,replica2:5433
+BOOKMARKS_READ_REPLICAS = []
+for index, address in enumerate(filter(None, os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(',')), start=1):
+    host, _, port = address.strip().partition(':')
+    alias = f'replica{index}'
+    DATABASES[alias] = dict(
+        DATABASES['default'], HOST=host, PORT=port or DATABASES['default']['PORT'], TEST={'MIRROR': 'default'}
+    )
+    BOOKMARKS_READ_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['bookmarks.routers.ReplicaRouter']
+# Сколько секунд после изменения данных пользователь читает с основной базы
+BOOKMARKS_REPLICA_PIN_SECONDS = int(os.environ.get('BOOKMARKS_REPLICA_PIN_SECONDS', 5))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -129,8 +165,142 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 STATICFILES_DIRS = []
+# Статику отдаёт WhiteNoise из collectstatic, при DEBUG — прямо из приложений
+STATICFILES_STORAGE = 'whitenoise.storage.CompressedStaticFilesStorage'
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+# LocMemCache живёт внутри процесса: каждый процесс кэширует ответы списков отдельно. Версии данных
+# пользователей, по которым кэш сбрасывается, хранятся в базе, поэтому устаревший ответ не отдаётся
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'bookmarks'),
+    },
+}
+if CACHES['default']['BACKEND'].endswith('LocMemCache'):
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': 10000}
+
+
+# Pagination
+
+BOOKMARKS_PAGE_SIZE = 100
+BOOKMARKS_MAX_PAGE_SIZE = 500
+
+
+# Search
+
+BOOKMARKS_SEARCH_INDEX_MAX_USERS = 100
+
+
+# Response cache for list pages
+
+BOOKMARKS_RESPONSE_CACHE_ALIAS = 'default'
+BOOKMARKS_RESPONSE_CACHE_TIMEOUT = 60 * 10
+
+
+# Bookmark metadata enrichment
+
+BOOKMARKS_METADATA_MAX_HEAD_BYTES = 512 * 1024
+BOOKMARKS_METADATA_CHUNK_SIZE = 16 * 1024
+BOOKMARKS_METADATA_JOB_BATCH_SIZE = 10
+BOOKMARKS_METADATA_JOB_MAX_ATTEMPTS = 3
+BOOKMARKS_METADATA_JOB_RETRY_DELAY = 120
+BOOKMARKS_METADATA_JOB_LOCK_TIMEOUT = 300
+BOOKMARKS_METADATA_WORKER_POLL_INTERVAL = 2
+# Выполненные и проваленные задачи удаляются через столько дней; воркер проверяет раз в интервал (секунды)
+BOOKMARKS_METADATA_JOB_RETENTION_DAYS = 7
+BOOKMARKS_METADATA_JOB_PRUNE_INTERVAL = 60 * 60
+
+BOOKMARKS_METADATA_CACHE_ALIAS = 'default'
+BOOKMARKS_METADATA_CACHE_TTL = 60 * 60 * 24
+BOOKMARKS_METADATA_CACHE_NEGATIVE_TTL = 120
+BOOKMARKS_METADATA_CACHE_MAX_ENTRIES = 100000
+# Доля записей в кэш, после которых проверяется его размер: между проверками он может превысить предел
+BOOKMARKS_METADATA_CACHE_CULL_SAMPLE_RATE = 0.01
+
+BOOKMARKS_METADATA_REFRESH_INTERVAL = 60 * 60 * 24 * 7
+BOOKMARKS_METADATA_REFRESH_BATCH_SIZE = 100
+BOOKMARKS_METADATA_REFRESH_MAX_WORKERS = 8
+BOOKMARKS_METADATA_REFRESH_HOST_INTERVAL = 1.0
+BOOKMARKS_METADATA_REFRESH_POLL_INTERVAL = 60
+
+BOOKMARKS_IMPORT_MAX_ITEMS = 10000
+# Экспорт браузера на несколько тысяч ссылок больше стандартных 2,5 МБ
+DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024
+BOOKMARKS_IMPORT_MAX_WORKERS = 16
+BOOKMARKS_IMPORT_BATCH_SIZE = 500
+BOOKMARKS_IMPORT_ASYNC_CONCURRENCY = 100
+# Строк, которые экспорт читает из курсора и отправляет клиенту за раз
+BOOKMARKS_EXPORT_CHUNK_SIZE = 2000
+
+# Сколько закладок можно удалить или переложить в коллекцию одним запросом
+BOOKMARKS_BATCH_MAX_IDS = 1000
+
+# Синхронизация клиентов: записей журнала за один ответ, сколько ждать фиксации
+# параллельных транзакций и сколько дней хранить журнал (prune_change_log)
+BOOKMARKS_SYNC_PAGE_SIZE = 1000
+BOOKMARKS_SYNC_SETTLE_SECONDS = 5
+BOOKMARKS_SYNC_RETENTION_DAYS = 90
+
+# Схема OpenAPI, сохранённая при сборке (generate_openapi_schema); без файла строится при первом запросе
+BOOKMARKS_OPENAPI_SCHEMA_FILE = os.environ.get('BOOKMARKS_OPENAPI_SCHEMA_FILE', '')
+
+
+# Preview thumbnails
+
+# Файлы адресуются хешем содержимого картинки и не меняются; хранилище — любой бэкенд Django
+BOOKMARKS_PREVIEW_STORAGE = 'django.core.files.storage.FileSystemStorage'
+BOOKMARKS_PREVIEW_STORAGE_OPTIONS = {
+    'location': os.environ.get('BOOKMARKS_PREVIEW_ROOT', os.path.join(BASE_DIR, 'previews')),
+}
+BOOKMARKS_PREVIEW_WIDTHS = (320, 640)
+BOOKMARKS_PREVIEW_QUALITY = 80
+BOOKMARKS_PREVIEW_MAX_BYTES = 5 * 1024 * 1024
+BOOKMARKS_PREVIEW_MAX_PIXELS = 40 * 1000 * 1000
+# Новые задачи не ставятся, пока очередь полна: превью догенерируется при следующем обновлении ссылки
+BOOKMARKS_PREVIEW_QUEUE_MAX_SIZE = 10000
+BOOKMARKS_PREVIEW_JOB_BATCH_SIZE = 20
+BOOKMARKS_PREVIEW_JOB_MAX_ATTEMPTS = 3
+BOOKMARKS_PREVIEW_JOB_RETRY_DELAY = 300
+BOOKMARKS_PREVIEW_JOB_LOCK_TIMEOUT = 300
+BOOKMARKS_PREVIEW_WORKER_POLL_INTERVAL = 5
+
+
+# Outbound HTTP client for metadata fetches
+
+BOOKMARKS_FETCH_CONNECT_TIMEOUT = 3.05
+BOOKMARKS_FETCH_READ_TIMEOUT = 10
+BOOKMARKS_FETCH_MAX_REDIRECTS = 5
+BOOKMARKS_FETCH_MAX_RESPONSE_BYTES = 5 * 1024 * 1024
+BOOKMARKS_FETCH_POOL_CONNECTIONS = 50
+BOOKMARKS_FETCH_POOL_MAXSIZE = 10
+BOOKMARKS_FETCH_ASYNC_MAX_CONNECTIONS = 500
+BOOKMARKS_FETCH_MAX_PER_HOST = 4
+BOOKMARKS_FETCH_HOST_WAIT_TIMEOUT = 30
+BOOKMARKS_FETCH_RETRIES = 2
+BOOKMARKS_FETCH_BACKOFF_FACTOR = 0.5
+BOOKMARKS_FETCH_DRAIN_BYTES = 64 * 1024
+BOOKMARKS_FETCH_USER_AGENT = 'Mozilla/5.0 (compatible; bookmark_manager/0.1)'
+
+# Сколько асинхронные API ждут загрузку страницы, прежде чем передать её воркеру
+BOOKMARKS_ASYNC_INLINE_FETCH_TIMEOUT = 5
+
+
+# Instrumentation
+
+# Заголовок Server-Timing с временем запросов к базе, загрузок страниц и отрисовки
+BOOKMARKS_SERVER_TIMING = os.environ.get('BOOKMARKS_SERVER_TIMING', '1') == '1'
+# Если задан, /metrics требует заголовок Authorization: Bearer <токен>
+BOOKMARKS_METRICS_TOKEN = os.environ.get('BOOKMARKS_METRICS_TOKEN', '')
+# Журнал медленных запросов с SQL: порог в секундах (0 — выключен) и доля запросов, для которых пишется SQL
+BOOKMARKS_SLOW_REQUEST_SECONDS = float(os.environ.get('BOOKMARKS_SLOW_REQUEST_SECONDS', 0))
+BOOKMARKS_SLOW_REQUEST_SAMPLE_RATE = float(os.environ.get('BOOKMARKS_SLOW_REQUEST_SAMPLE_RATE', 0.1))
+BOOKMARKS_SLOW_REQUEST_MAX_QUERIES = 200
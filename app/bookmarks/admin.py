@@ -1,6 +1,8 @@
 from django.contrib import admin
 
-from .models import Bookmark, Collection
+from .models import Bookmark, Collection, Link, MetadataJob
 
 admin.site.register(Bookmark)
 admin.site.register(Collection)
+admin.site.register(Link)
+admin.site.register(MetadataJob)
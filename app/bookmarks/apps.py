@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class BookmarksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bookmarks'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from .instrumentation import install_query_wrapper
+
+        connection_created.connect(install_query_wrapper, dispatch_uid='bookmarks_instrumentation')
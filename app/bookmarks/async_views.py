@@ -0,0 +1,156 @@
+"""Асинхронные версии API создания, изменения и импорта закладок.
+
+Под ASGI (uvicorn app.asgi:application) ожидание сторонних сайтов не занимает
+поток: один процесс держит сотни загрузок одновременно. В Django 3.2 асинхронными
+могут быть только функции-представления, а ORM синхронный, поэтому база и
+сериализаторы вызываются через sync_to_async.
+"""
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import JsonResponse
+from rest_framework import exceptions, status
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .importers import (
+    BookmarkImporter,
+    CSVRequestParser,
+    JSONLinesRequestParser,
+    NetscapeHTMLRequestParser,
+    normalize_items,
+    parse_netscape_html,
+    parse_upload,
+)
+from .metadata import MetadataResolver
+from .models import Bookmark
+from .serializers import BookmarkRequestSerializer, BookmarkSerializer
+
+
+def _authenticate(request):
+    # Обращение к user запускает аутентификацию DRF, включая проверку CSRF для сессии
+    if not request.user.is_authenticated:
+        raise exceptions.NotAuthenticated()
+
+
+def _error_response(request, exc):
+    # Как APIView.handle_exception: без заголовка WWW-Authenticate ошибка входа отдаётся как 403
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    status_code = exc.status_code
+    auth_header = None
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        auth_header = request.authenticators[0].authenticate_header(request) if request.authenticators else None
+        if not auth_header:
+            status_code = status.HTTP_403_FORBIDDEN
+    response = JsonResponse(data, status=status_code, safe=False)
+    if auth_header:
+        response['WWW-Authenticate'] = auth_header
+    return response
+
+
+def async_api_view(*methods, parsers=(JSONParser,)):
+    """Аналог APIView для асинхронной функции: аутентификация DRF и ошибки в формате DRF."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            request = Request(
+                request,
+                parsers=[parser() for parser in parsers],
+                authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+            )
+            try:
+                if request.method not in methods:
+                    raise exceptions.MethodNotAllowed(request.method)
+                await sync_to_async(_authenticate)(request)
+                return await view(request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                return _error_response(request, exc)
+
+        # csrf_exempt в Django 3.2 делает представление синхронным, CSRF проверяет SessionAuthentication
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+async def resolve_inline(resolver, url):
+    """Ждёт данные страницы не дольше BOOKMARKS_ASYNC_INLINE_FETCH_TIMEOUT, иначе их загрузит воркер."""
+    try:
+        await asyncio.wait_for(resolver.aprefetch([url], 1), settings.BOOKMARKS_ASYNC_INLINE_FETCH_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+
+
+# Работа с базой собрана в несколько синхронных функций: в Django 3.2 все вызовы sync_to_async
+# процесса идут через один поток, и каждый лишний переход удлиняет очередь к нему
+
+def _validate(serializer):
+    serializer.is_valid(raise_exception=True)
+    return serializer
+
+
+def _save(serializer, user):
+    return BookmarkSerializer(serializer.save(user=user)).data
+
+
+def _update_serializer(request, pk, resolver):
+    bookmark = Bookmark.objects.select_related('link').filter(pk=pk, user=request.user).first()
+    if bookmark is None:
+        raise exceptions.NotFound()
+    serializer = BookmarkRequestSerializer(
+        bookmark,
+        data=request.data,
+        partial=request.method == 'PATCH',
+        # Страница загружается в представлении, а не синхронно внутри serializer.save()
+        context={'request': request, 'metadata_resolver': resolver, 'fetch_metadata': False},
+    )
+    return _validate(serializer)
+
+
+@async_api_view('POST')
+async def bookmark_create(request):
+    resolver = MetadataResolver()
+    serializer = BookmarkRequestSerializer(
+        data=request.data, context={'request': request, 'metadata_resolver': resolver}
+    )
+    await sync_to_async(_validate)(serializer)
+    await resolve_inline(resolver, serializer.validated_data['url'])
+    data = await sync_to_async(_save)(serializer, request.user)
+    return JsonResponse(data, status=status.HTTP_201_CREATED)
+
+
+@async_api_view('PUT', 'PATCH')
+async def bookmark_update(request, pk):
+    resolver = MetadataResolver()
+    serializer = await sync_to_async(_update_serializer)(request, pk, resolver)
+    url = serializer.validated_data.get('url', serializer.instance.url)
+    if url != serializer.instance.url:
+        await resolve_inline(resolver, url)
+    return JsonResponse(await sync_to_async(_save)(serializer, request.user))
+
+
+def _import_items(request):
+    if isinstance(request.data, str):
+        return parse_netscape_html(request.data)
+    if 'file' in request.FILES:
+        return parse_upload(request.FILES['file'])
+    return normalize_items(request.data)
+
+
+@async_api_view(
+    'POST', parsers=(JSONParser, JSONLinesRequestParser, CSVRequestParser, NetscapeHTMLRequestParser, MultiPartParser)
+)
+async def bookmark_bulk_import(request):
+    importer = BookmarkImporter(request.user)
+    try:
+        results, accepted = await sync_to_async(importer.prepare)(await sync_to_async(_import_items)(request))
+        await importer.resolver.aprefetch(importer.fetch_urls(accepted), settings.BOOKMARKS_IMPORT_ASYNC_CONCURRENCY)
+        results = await sync_to_async(importer.finish)(results, accepted)
+    except DjangoValidationError as exc:
+        raise exceptions.ValidationError(exc.messages)
+
+    created = sum(1 for result in results if result['status'] == 'created')
+    return JsonResponse({'created': created, 'results': results}, status=status.HTTP_201_CREATED)
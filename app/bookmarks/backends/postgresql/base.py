@@ -0,0 +1,41 @@
+"""PostgreSQL с проверкой постоянных соединений, как CONN_HEALTH_CHECKS в Django 4.1.
+
+Соединение, оставшееся открытым после запроса (CONN_MAX_AGE), перед первым
+обращением в следующем запросе проверяется через SELECT 1. Если его разорвали
+база или pgbouncer, оно открывается заново вместо ошибки в запросе.
+"""
+from django.db.backends.postgresql import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    health_check_done = False
+
+    @property
+    def health_check_enabled(self):
+        return self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+
+    def connect(self):
+        # Новое соединение не проверяем; флаг ставится до set_autocommit() внутри connect()
+        self.health_check_done = True
+        super().connect()
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        # Вызывается в начале и в конце запроса: переиспользуемое соединение проверим заново
+        self.health_check_done = False
+
+    def close_if_health_check_failed(self):
+        if self.connection is None or not self.health_check_enabled or self.health_check_done:
+            return
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def set_autocommit(self, autocommit, force_begin_transaction_with_broken_autocommit=False):
+        # transaction.atomic() обращается к соединению раньше первого курсора
+        self.close_if_health_check_failed()
+        super().set_autocommit(autocommit, force_begin_transaction_with_broken_autocommit)
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
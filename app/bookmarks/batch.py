@@ -0,0 +1,55 @@
+"""Массовые операции над закладками пользователя.
+
+Каждая операция — постоянное число SQL-запросов независимо от числа закладок,
+в одной транзакции. Сигналы моделей при этом не отправляются, поэтому журнал
+изменений пишется, а кэш списков пользователя сбрасывается явно.
+"""
+from django.db import models, router, transaction
+
+from .caching import bump_user_version
+from .changes import record_selected
+from .models import Bookmark, BookmarkCollection, ChangeLog
+from .utils import delete_selected, insert_from_select
+
+
+def _user_bookmarks(user, ids):
+    return Bookmark.objects.filter(user=user, pk__in=ids)
+
+
+def delete_bookmarks(user, ids):
+    bookmarks = _user_bookmarks(user, ids)
+    using = router.db_for_write(Bookmark)
+    with transaction.atomic(using=using):
+        record_selected(bookmarks, ChangeLog.KIND_BOOKMARK, deleted=True)
+        # QuerySet.delete() из-за сигналов Bookmark загрузил бы каждую закладку
+        deleted = delete_selected(bookmarks)
+        if deleted:
+            bump_user_version(user.pk)
+    return deleted
+
+
+def add_to_collection(user, ids, collection):
+    """Добавляет закладки в коллекцию одним INSERT ... SELECT; уже добавленные пропускаются."""
+    bookmarks = _user_bookmarks(user, ids)
+    with transaction.atomic(using=router.db_for_write(BookmarkCollection)):
+        added = insert_from_select(BookmarkCollection, bookmarks, {
+            'bookmark': models.F('pk'),
+            'collection': models.Value(collection.pk, output_field=models.BigIntegerField()),
+        }, ignore_conflicts=True)
+        if added:
+            record_selected(bookmarks, ChangeLog.KIND_MEMBERSHIP, collection_id=collection.pk)
+            bump_user_version(user.pk)
+    return added
+
+
+def remove_from_collection(user, ids, collection):
+    memberships = BookmarkCollection.objects.filter(collection=collection, bookmark__in=_user_bookmarks(user, ids))
+    with transaction.atomic(using=router.db_for_write(BookmarkCollection)):
+        record_selected(
+            memberships, ChangeLog.KIND_MEMBERSHIP, deleted=True,
+            user='bookmark__user_id', object_id='bookmark_id', collection_id='collection_id',
+        )
+        removed, _ = memberships.delete()
+        if removed:
+            bump_user_version(user.pk)
+    return removed
@@ -0,0 +1,118 @@
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .instrumentation import render
+from .models import UserDataVersion
+
+RESPONSE_KEY = 'bookmarks:response:{}'
+
+
+def get_cache():
+    return caches[settings.BOOKMARKS_RESPONSE_CACHE_ALIAS]
+
+
+def get_user_version(user_id):
+    """Версия данных пользователя: время последнего изменения в миллисекундах, 0 — изменений не было."""
+    # Всегда с основной базы: по версии решается, можно ли читать с реплики
+    versions = UserDataVersion.objects.using(router.db_for_write(UserDataVersion))
+    return versions.filter(user_id=user_id).values_list('version', flat=True).first() or 0
+
+
+def bump_user_versions(user_ids):
+    """Новая версия данных для пользователей: два запроса при любом их числе."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    now = int(time.time() * 1000)
+    # Версия растёт, даже если изменения пришлись на одну миллисекунду
+    UserDataVersion.objects.filter(user_id__in=user_ids).update(version=Greatest(F('version') + 1, Value(now)))
+    UserDataVersion.objects.bulk_create(
+        [UserDataVersion(user_id=user_id, version=now) for user_id in user_ids], ignore_conflicts=True
+    )
+
+
+def bump_user_version(user_id):
+    bump_user_versions([user_id])
+
+
+class UserResponseCache:
+    """Ответ списка пользователя, привязанный к версии его данных."""
+
+    def __init__(self, request, *variants):
+        self.request = request
+        self.version = get_user_version(request.user.pk)
+        parts = [request.user.pk, self.version, request.get_full_path(), request.META.get('HTTP_ACCEPT', '')]
+        parts.extend(variants)
+        self.digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+        self.etag = f'"{self.digest}"'
+        self.last_modified = math.ceil(self.version / 1000)
+
+    def not_modified(self):
+        # Только по ETag: у Last-Modified точность в секунду, и два изменения за одну секунду
+        # дали бы устаревший 304 на If-Modified-Since
+        response = get_conditional_response(self.request, etag=self.etag)
+        return self.finalize(response) if response is not None else None
+
+    def get(self):
+        return get_cache().get(RESPONSE_KEY.format(self.digest))
+
+    def set(self, value):
+        get_cache().set(RESPONSE_KEY.format(self.digest), value, settings.BOOKMARKS_RESPONSE_CACHE_TIMEOUT)
+
+    def finalize(self, response):
+        response['ETag'] = self.etag
+        response['Last-Modified'] = http_date(self.last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie', 'Authorization'))
+        return response
+
+
+class CachedListMixin:
+    """Кэширует отрисованную HTML-страницу списка до следующего изменения данных пользователя."""
+
+    def get(self, request, *args, **kwargs):
+        # Страница содержит CSRF-токен, поэтому кэш привязан к CSRF-cookie
+        csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+        cached = UserResponseCache(request, csrf_cookie)
+        response = cached.not_modified()
+        if response is not None:
+            return response
+
+        content = cached.get() if csrf_cookie else None
+        if content is None:
+            response = super().get(request, *args, **kwargs)
+            render(response)
+            if csrf_cookie and response.status_code == 200:
+                cached.set(response.content)
+        else:
+            response = HttpResponse(content)
+        return cached.finalize(response)
+
+
+class CachedListAPIMixin:
+    """Кэширует сериализованные данные ответа API до следующего изменения данных пользователя."""
+
+    def list(self, request, *args, **kwargs):
+        cached = UserResponseCache(request)
+        response = cached.not_modified()
+        if response is not None:
+            return response
+
+        data = cached.get()
+        if data is None:
+            response = super().list(request, *args, **kwargs)
+            cached.set(response.data)
+        else:
+            response = Response(data)
+        return cached.finalize(response)
@@ -0,0 +1,153 @@
+"""Журнал изменений для синхронизации клиентов: GET /api/sync/?since=<токен>.
+
+Токен — id последней полученной записи журнала. Id выдаются при вставке, а
+транзакции фиксируются в другом порядке, поэтому клиент получает только записи
+старше BOOKMARKS_SYNC_SETTLE_SECONDS: к этому времени все записи с меньшим id
+уже видны.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+from .models import Bookmark, BookmarkCollection, ChangeLog, Collection
+from .utils import insert_from_select
+
+MODEL_KINDS = {Bookmark: ChangeLog.KIND_BOOKMARK, Collection: ChangeLog.KIND_COLLECTION}
+
+
+class TokenExpired(Exception):
+    """Записи после токена уже удалены из журнала: клиенту нужна полная загрузка."""
+
+
+def record_changes(user_id, kind, object_ids, deleted=False, collection_id=None):
+    now = timezone.now()
+    ChangeLog.objects.bulk_create(
+        [
+            ChangeLog(
+                user_id=user_id, kind=kind, object_id=pk, collection_id=collection_id, deleted=deleted, created_at=now
+            )
+            for pk in object_ids
+        ],
+        batch_size=settings.BOOKMARKS_IMPORT_BATCH_SIZE,
+    )
+
+
+def record_memberships(user_id, pairs, deleted=False):
+    """pairs — пары (id закладки, id коллекции)."""
+    now = timezone.now()
+    ChangeLog.objects.bulk_create(
+        [
+            ChangeLog(
+                user_id=user_id, kind=ChangeLog.KIND_MEMBERSHIP, object_id=bookmark_id,
+                collection_id=collection_id, deleted=deleted, created_at=now,
+            )
+            for bookmark_id, collection_id in pairs
+        ],
+        batch_size=settings.BOOKMARKS_IMPORT_BATCH_SIZE,
+    )
+
+
+def record_selected(queryset, kind, deleted=False, user='user_id', object_id='pk', collection_id=None):
+    """Записывает изменение каждой строки queryset одним INSERT ... SELECT.
+
+    user, object_id и collection_id — поля queryset; collection_id может быть и числом.
+    """
+    if isinstance(collection_id, str):
+        collection_id = models.F(collection_id)
+    else:
+        collection_id = models.Value(collection_id, output_field=models.BigIntegerField())
+    return insert_from_select(ChangeLog, queryset, {
+        'user': models.F(user),
+        'kind': models.Value(kind, output_field=models.CharField()),
+        'object_id': models.F(object_id),
+        'collection_id': collection_id,
+        'deleted': models.Value(deleted, output_field=models.BooleanField()),
+        'created_at': models.Value(timezone.now(), output_field=models.DateTimeField()),
+    })
+
+
+def current_token():
+    """Токен, с которого клиент начинает синхронизацию после полной загрузки списков."""
+    settled = timezone.now() - timedelta(seconds=settings.BOOKMARKS_SYNC_SETTLE_SECONDS)
+    return ChangeLog.objects.filter(created_at__lte=settled).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def changes_since(user, since, limit=None):
+    """Изменения пользователя после токена: актуальные объекты и удалённые id.
+
+    Несколько изменений одного объекта сворачиваются в одно, работа зависит от
+    числа изменений, а не от размера библиотеки.
+    """
+    limit = limit or settings.BOOKMARKS_SYNC_PAGE_SIZE
+    oldest = ChangeLog.objects.order_by('id').values_list('id', 'created_at').first()
+    if oldest is not None:
+        oldest_id, oldest_at = oldest
+        # Токен — id записи, которая была в журнале; 0 выдаётся, пока журнал пуст, и устаревает
+        # вместе с самой старой записью: id первых записей могут быть пропущены
+        if since and since < oldest_id - 1:
+            raise TokenExpired
+        if not since and oldest_at < timezone.now() - timedelta(days=settings.BOOKMARKS_SYNC_RETENTION_DAYS):
+            raise TokenExpired
+
+    settled = timezone.now() - timedelta(seconds=settings.BOOKMARKS_SYNC_SETTLE_SECONDS)
+    rows = list(
+        ChangeLog.objects.filter(user=user, id__gt=since, created_at__lte=settled)
+        .order_by('id')
+        .values_list('id', 'kind', 'object_id', 'collection_id', 'deleted')[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    latest = {}
+    for _, kind, object_id, collection_id, deleted in rows:
+        latest[kind, object_id, collection_id] = deleted
+    changed = {kind: set() for kind, _ in ChangeLog.KIND_CHOICES}
+    deleted = {kind: [] for kind, _ in ChangeLog.KIND_CHOICES}
+    for (kind, object_id, collection_id), is_deleted in latest.items():
+        key = (object_id, collection_id) if kind == ChangeLog.KIND_MEMBERSHIP else object_id
+        if is_deleted:
+            deleted[kind].append(key)
+        else:
+            changed[kind].add(key)
+
+    # Объект, удалённый после последней записи страницы, пропускаем: его удаление придёт следующим
+    memberships = changed[ChangeLog.KIND_MEMBERSHIP]
+    if memberships:
+        existing = BookmarkCollection.objects.filter(
+            bookmark__user=user,
+            bookmark_id__in={bookmark_id for bookmark_id, _ in memberships},
+            collection_id__in={collection_id for _, collection_id in memberships},
+        ).values_list('bookmark_id', 'collection_id')
+        memberships = [pair for pair in existing if pair in memberships]
+    return {
+        'token': rows[-1][0] if rows else since,
+        'has_more': has_more,
+        'bookmarks': Bookmark.objects.filter(user=user, pk__in=changed[ChangeLog.KIND_BOOKMARK]).for_list(),
+        'collections': Collection.objects.filter(user=user, pk__in=changed[ChangeLog.KIND_COLLECTION]).for_list(),
+        'memberships': _memberships(memberships),
+        'deleted': {
+            'bookmarks': deleted[ChangeLog.KIND_BOOKMARK],
+            'collections': deleted[ChangeLog.KIND_COLLECTION],
+            'memberships': _memberships(deleted[ChangeLog.KIND_MEMBERSHIP]),
+        },
+    }
+
+
+def _memberships(pairs):
+    return [{'bookmark': bookmark_id, 'collection': collection_id} for bookmark_id, collection_id in pairs]
+
+
+def prune_change_log(days=None):
+    """Удаляет записи старше срока хранения; клиенты с более старым токеном получат 410."""
+    if days is None:
+        days = settings.BOOKMARKS_SYNC_RETENTION_DAYS
+    cutoff = timezone.now() - timedelta(days=days)
+    # Id растут вместе со временем: ищем первую сохраняемую запись по первичному ключу
+    first_kept = ChangeLog.objects.filter(created_at__gte=cutoff).order_by('id').values_list('id', flat=True).first()
+    if first_kept is None:
+        # Последняя запись остаётся всегда: по ней видно, какие токены устарели
+        first_kept = ChangeLog.objects.order_by('-id').values_list('id', flat=True).first()
+    deleted, _ = ChangeLog.objects.filter(id__lt=first_kept).delete() if first_kept else (0, None)
+    return deleted
@@ -0,0 +1,173 @@
+import csv
+import io
+import json
+from abc import ABCMeta, abstractmethod
+from html import escape
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+from .models import Bookmark, BookmarkCollection, Collection
+
+EXPORT_FIELDS = ['url', 'title', 'description', 'preview_image', 'bookmark_type', 'collections', 'created_at']
+# Названия коллекций в одной ячейке CSV
+CSV_COLLECTION_SEPARATOR = '\n'
+
+ROW_FIELDS = (
+    'id', 'url', 'title', 'created_at',
+    'link__title', 'link__description', 'link__image', 'link__bookmark_type',
+)
+
+
+def _values(queryset, prefix='', extra=()):
+    return queryset.values_list(*extra, *(prefix + field for field in ROW_FIELDS))
+
+
+def _row(values, collections=()):
+    pk, url, title, created_at, link_title, description, image, bookmark_type = values
+    return {
+        # Заголовок нужен импорту, чтобы не загружать страницу заново
+        'url': url,
+        'title': title or link_title or url,
+        'description': description,
+        'preview_image': image,
+        'bookmark_type': bookmark_type,
+        'collections': list(collections),
+        'created_at': created_at,
+    }
+
+
+def export_rows(user, using=None, chunk_size=None):
+    """Закладки пользователя с названиями коллекций, от новых к старым.
+
+    Закладки и их связи с коллекциями читаются двумя курсорами в одном порядке
+    и сливаются: коллекции не запрашиваются для каждой строки и не копятся в памяти.
+    """
+    chunk_size = chunk_size or settings.BOOKMARKS_EXPORT_CHUNK_SIZE
+    titles = dict(Collection.objects.using(using).filter(user=user).values_list('id', 'title'))
+    bookmarks = _values(Bookmark.objects.using(using).filter(user=user).order_by('-created_at', '-id'))
+    memberships = (
+        BookmarkCollection.objects.using(using)
+        .filter(bookmark__user=user)
+        .order_by('-bookmark__created_at', '-bookmark_id')
+        .values_list('bookmark__created_at', 'bookmark_id', 'collection_id')
+        .iterator(chunk_size)
+    )
+
+    membership = next(memberships, None)
+    for values in bookmarks.iterator(chunk_size):
+        position = (values[3], values[0])
+        # Связи закладок, удалённых между запросами, пропускаем
+        while membership is not None and membership[:2] > position:
+            membership = next(memberships, None)
+        collections = []
+        while membership is not None and membership[:2] == position:
+            if membership[2] in titles:
+                collections.append(titles[membership[2]])
+            membership = next(memberships, None)
+        yield _row(values, collections)
+
+
+def _batched(lines, size):
+    # Строки отправляем пачками: запись каждой строки отдельно нагружает сервер
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+class BookmarkExportRenderer(BaseRenderer, metaclass=ABCMeta):
+    """Формат выгрузки закладок: тело ответа отдаёт stream() по частям."""
+
+    charset = 'utf-8'
+
+    def stream(self, user, using=None):
+        chunk_size = settings.BOOKMARKS_EXPORT_CHUNK_SIZE
+        return _batched(self.lines(user, using, chunk_size), chunk_size)
+
+    @abstractmethod
+    def lines(self, user, using, chunk_size):
+        """Строки выгрузки по порядку."""
+
+
+class JSONLinesExportRenderer(BookmarkExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+
+    def lines(self, user, using, chunk_size):
+        for row in export_rows(user, using, chunk_size):
+            row['created_at'] = row['created_at'].isoformat()
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+class CSVExportRenderer(BookmarkExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def lines(self, user, using, chunk_size):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, EXPORT_FIELDS)
+        writer.writeheader()
+        for row in export_rows(user, using, chunk_size):
+            row['collections'] = CSV_COLLECTION_SEPARATOR.join(row['collections'])
+            row['created_at'] = row['created_at'].isoformat()
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+
+class NetscapeHTMLExportRenderer(BookmarkExportRenderer):
+    """Формат экспорта браузеров: коллекции становятся папками, закладка из нескольких коллекций повторяется."""
+
+    media_type = 'text/html'
+    format = 'html'
+
+    HEADER = (
+        '<!DOCTYPE NETSCAPE-Bookmark-file-1>\n'
+        '<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">\n'
+        '<TITLE>Bookmarks</TITLE>\n'
+        '<H1>Bookmarks</H1>\n'
+        '<DL><p>\n'
+    )
+
+    def lines(self, user, using, chunk_size):
+        yield self.HEADER
+        titles = dict(Collection.objects.using(using).filter(user=user).values_list('id', 'title'))
+        memberships = _values(
+            BookmarkCollection.objects.using(using)
+            .filter(bookmark__user=user)
+            .order_by('collection_id', '-bookmark__created_at', '-bookmark_id'),
+            prefix='bookmark__',
+            extra=('collection_id',),
+        )
+        folder = None
+        for collection_id, *values in memberships.iterator(chunk_size):
+            if collection_id not in titles:
+                continue
+            if collection_id != folder:
+                if folder is not None:
+                    yield '    </DL><p>\n'
+                yield f'    <DT><H3>{escape(titles[collection_id])}</H3>\n    <DL><p>\n'
+                folder = collection_id
+            yield self.item(_row(values), '        ')
+        if folder is not None:
+            yield '    </DL><p>\n'
+
+        unfiled = Bookmark.objects.using(using).filter(user=user, collections__isnull=True)
+        for values in _values(unfiled.order_by('-created_at', '-id')).iterator(chunk_size):
+            yield self.item(_row(values), '    ')
+        yield '</DL><p>\n'
+
+    def item(self, row, indent):
+        line = (
+            f'{indent}<DT><A HREF="{escape(row["url"])}" ADD_DATE="{int(row["created_at"].timestamp())}">'
+            f'{escape(row["title"])}</A>\n'
+        )
+        if row['description']:
+            line += f'{indent}<DD>{escape(row["description"])}\n'
+        return line
@@ -2,7 +2,7 @@ from django import forms
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.contrib.auth.models import User
 
-from .models import Bookmark, Collection
+from .models import BOOKMARK_TYPES, Bookmark, Collection
 
 
 class AddBookmarkForm(forms.ModelForm):
@@ -20,7 +20,27 @@ class AddBookmarkForm(forms.ModelForm):
 
     class Meta:
         model = Bookmark
-        fields = ['url', 'collections']
+        fields = ['url', 'title', 'collections']
+
+
+class BookmarkSearchForm(forms.Form):
+    q = forms.CharField(label='Запрос', max_length=200, required=False)
+    bookmark_type = forms.ChoiceField(
+        label='Тип ссылки',
+        choices=[('', 'Любой')] + [(bookmark_type, bookmark_type) for bookmark_type in BOOKMARK_TYPES],
+        required=False
+    )
+    collection = forms.ModelChoiceField(
+        label='Коллекция',
+        queryset=Collection.objects.none(),
+        empty_label='Любая',
+        required=False
+    )
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if user:
+            self.fields['collection'].queryset = Collection.objects.filter(user=user)
 
 
 class AddCollectionForm(forms.ModelForm):
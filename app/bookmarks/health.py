@@ -0,0 +1,42 @@
+import logging
+
+from django.db import DatabaseError, connections
+from django.http import JsonResponse
+
+logger = logging.getLogger(__name__)
+
+LIVENESS_PATH = '/healthz'
+READINESS_PATH = '/readyz'
+
+
+def check_database(alias='default'):
+    with connections[alias].cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+
+
+class HealthCheckMiddleware:
+    """Отвечает на проверки балансировщика раньше остальных middleware.
+
+    Проверки приходят с адресом контейнера в Host, поэтому ALLOWED_HOSTS, сессии
+    и CSRF в них не участвуют. /healthz — процесс жив, /readyz — воркер загружен
+    и база отвечает.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.path == LIVENESS_PATH:
+            return JsonResponse({'status': 'ok'})
+        if request.path == READINESS_PATH:
+            return self.readiness()
+        return self.get_response(request)
+
+    def readiness(self):
+        try:
+            check_database()
+        except DatabaseError as exc:
+            logger.warning('Readiness check failed: %s', exc)
+            return JsonResponse({'status': 'unavailable'}, status=503)
+        return JsonResponse({'status': 'ok'})
@@ -0,0 +1,220 @@
+import asyncio
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError
+from urllib3.util.retry import Retry
+
+from .instrumentation import record_fetch
+
+
+class HostBusy(requests.RequestException):
+    """К хосту уже открыто максимальное число одновременных запросов."""
+
+
+class ResponseTooLarge(requests.RequestException):
+    """Ответ больше BOOKMARKS_FETCH_MAX_RESPONSE_BYTES."""
+
+
+class AsyncFetchError(requests.RequestException):
+    """Ошибка httpx, приведённая к исключениям requests, которые обрабатывает остальной код."""
+
+
+class FetchClient:
+    """Общий для процесса HTTP-клиент: пул соединений, таймауты, повторы и лимит на хост."""
+
+    def __init__(self):
+        self._session = None
+        self._lock = threading.Lock()
+        self._host_semaphores = weakref.WeakValueDictionary()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def _build_session(self):
+        retry = Retry(
+            total=settings.BOOKMARKS_FETCH_RETRIES,
+            backoff_factor=settings.BOOKMARKS_FETCH_BACKOFF_FACTOR,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=settings.BOOKMARKS_FETCH_POOL_CONNECTIONS,
+            pool_maxsize=settings.BOOKMARKS_FETCH_POOL_MAXSIZE,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.max_redirects = settings.BOOKMARKS_FETCH_MAX_REDIRECTS
+        session.headers['User-Agent'] = settings.BOOKMARKS_FETCH_USER_AGENT
+        return session
+
+    def _host_semaphore(self, host):
+        with self._lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(settings.BOOKMARKS_FETCH_MAX_PER_HOST)
+                self._host_semaphores[host] = semaphore
+            return semaphore
+
+    @contextmanager
+    def get(self, url, headers=None):
+        started = time.perf_counter()
+        semaphore = self._host_semaphore(urlsplit(url).hostname)
+        if not semaphore.acquire(timeout=settings.BOOKMARKS_FETCH_HOST_WAIT_TIMEOUT):
+            record_fetch(time.perf_counter() - started)
+            raise HostBusy(f'Too many concurrent requests to {url}')
+        try:
+            response = self.session.get(
+                url,
+                headers=headers,
+                stream=True,
+                timeout=(settings.BOOKMARKS_FETCH_CONNECT_TIMEOUT, settings.BOOKMARKS_FETCH_READ_TIMEOUT),
+            )
+            try:
+                content_length = response.headers.get('Content-Length', '')
+                if content_length.isdigit() and int(content_length) > settings.BOOKMARKS_FETCH_MAX_RESPONSE_BYTES:
+                    raise ResponseTooLarge(f'{url} is {content_length} bytes')
+                yield response
+            finally:
+                self._release(response)
+        finally:
+            semaphore.release()
+            # Время загрузки вместе с ожиданием очереди к хосту и чтением тела
+            record_fetch(time.perf_counter() - started)
+
+    def iter_content(self, response, chunk_size):
+        received = 0
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            received += len(chunk)
+            if received > settings.BOOKMARKS_FETCH_MAX_RESPONSE_BYTES:
+                raise ResponseTooLarge(f'{response.url} exceeds the response size limit')
+            yield chunk
+
+    def _release(self, response):
+        # Небольшой недочитанный остаток дочитываем, чтобы вернуть соединение в пул
+        raw = getattr(response, 'raw', None)
+        content_length = response.headers.get('Content-Length', '')
+        if raw is not None and content_length.isdigit():
+            remaining = int(content_length) - raw.tell()
+            if 0 < remaining <= settings.BOOKMARKS_FETCH_DRAIN_BYTES:
+                try:
+                    raw.drain_conn()
+                except (OSError, HTTPError):
+                    pass
+        response.close()
+
+
+class HostRateLimiter:
+    """Разносит запросы к одному хосту не меньше чем на interval секунд."""
+
+    MAX_HOSTS = 10000
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlsplit(url).hostname
+        with self._lock:
+            now = time.monotonic()
+            if len(self._next_slot) > self.MAX_HOSTS:
+                self._next_slot = {key: slot for key, slot in self._next_slot.items() if slot > now}
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class AsyncFetchClient:
+    """Асинхронный HTTP-клиент для ASGI-представлений: свой пул соединений на каждый цикл событий."""
+
+    transport = None
+
+    def __init__(self):
+        self._clients = weakref.WeakKeyDictionary()
+        self._host_semaphores = weakref.WeakKeyDictionary()
+
+    def client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(
+                    settings.BOOKMARKS_FETCH_READ_TIMEOUT, connect=settings.BOOKMARKS_FETCH_CONNECT_TIMEOUT
+                ),
+                limits=httpx.Limits(
+                    max_connections=settings.BOOKMARKS_FETCH_ASYNC_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.BOOKMARKS_FETCH_POOL_CONNECTIONS,
+                ),
+                transport=self.transport or httpx.AsyncHTTPTransport(retries=settings.BOOKMARKS_FETCH_RETRIES),
+                follow_redirects=True,
+                max_redirects=settings.BOOKMARKS_FETCH_MAX_REDIRECTS,
+                headers={'User-Agent': settings.BOOKMARKS_FETCH_USER_AGENT},
+            )
+            self._clients[loop] = client
+        return client
+
+    def _host_semaphore(self, host):
+        semaphores = self._host_semaphores.setdefault(asyncio.get_running_loop(), weakref.WeakValueDictionary())
+        semaphore = semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(settings.BOOKMARKS_FETCH_MAX_PER_HOST)
+            semaphores[host] = semaphore
+        return semaphore
+
+    @asynccontextmanager
+    async def get(self, url):
+        started = time.perf_counter()
+        semaphore = self._host_semaphore(urlsplit(url).hostname)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), settings.BOOKMARKS_FETCH_HOST_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            record_fetch(time.perf_counter() - started)
+            raise HostBusy(f'Too many concurrent requests to {url}')
+        try:
+            client = self.client()
+            try:
+                response = await client.send(client.build_request('GET', url), stream=True)
+            except (httpx.HTTPError, httpx.InvalidURL) as exc:
+                raise AsyncFetchError(str(exc) or exc.__class__.__name__) from exc
+            try:
+                content_length = response.headers.get('Content-Length', '')
+                if content_length.isdigit() and int(content_length) > settings.BOOKMARKS_FETCH_MAX_RESPONSE_BYTES:
+                    raise ResponseTooLarge(f'{url} is {content_length} bytes')
+                yield response
+            finally:
+                await response.aclose()
+        finally:
+            semaphore.release()
+            record_fetch(time.perf_counter() - started)
+
+    async def aiter_content(self, response, chunk_size):
+        received = 0
+        try:
+            async for chunk in response.aiter_bytes(chunk_size):
+                received += len(chunk)
+                if received > settings.BOOKMARKS_FETCH_MAX_RESPONSE_BYTES:
+                    raise ResponseTooLarge(f'{response.url} exceeds the response size limit')
+                yield chunk
+        except httpx.HTTPError as exc:
+            raise AsyncFetchError(str(exc) or exc.__class__.__name__) from exc
+
+
+http_client = FetchClient()
+async_http_client = AsyncFetchClient()
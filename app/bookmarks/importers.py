@@ -0,0 +1,336 @@
+import csv
+import json
+from html.parser import HTMLParser
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from rest_framework.parsers import BaseParser
+
+from .caching import bump_user_version
+from .changes import record_changes, record_memberships
+from .exporters import CSV_COLLECTION_SEPARATOR
+from .metadata import MetadataResolver, apply_open_graph_data, check_og_type
+from .models import BOOKMARK_TYPES, Bookmark, ChangeLog, Collection, Link, MetadataJob
+from .serializers import BookmarkImportItemSerializer
+from .utils import normalize_url, url_hash
+
+
+class NetscapeBookmarkParser(HTMLParser):
+    """Разбирает экспорт закладок браузера: папки становятся коллекциями."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.items = []
+        self._folders = []
+        self._folder_title = None
+        self._text = None
+        self._link = None
+        self._last_item = None
+        self._description = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('dt', 'dl'):
+            self._description = None
+        if tag == 'h3':
+            self._text = ''
+            self._last_item = None
+        elif tag == 'dl':
+            self._last_item = None
+            self._folders.append(self._folder_title)
+            self._folder_title = None
+        elif tag == 'a':
+            href = dict(attrs).get('href') or ''
+            folders = [folder for folder in self._folders if folder]
+            self._link = {'url': href, 'title': '', 'collections': folders[-1:]}
+            self._text = ''
+        elif tag == 'dd':
+            self._description = self._last_item
+
+    def handle_endtag(self, tag):
+        if tag == 'h3' and self._text is not None:
+            self._folder_title = self._text.strip()
+            self._text = None
+        elif tag == 'dl' and self._folders:
+            self._folders.pop()
+        elif tag == 'a' and self._link is not None:
+            self._link['title'] = self._text.strip()
+            self.items.append(self._link)
+            self._last_item = self._link
+            self._link = None
+            self._text = None
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text += data
+        elif self._description is not None and data.strip():
+            self._description['description'] = (self._description.get('description', '') + data).strip()
+
+
+def parse_netscape_html(html):
+    parser = NetscapeBookmarkParser()
+    parser.feed(html)
+    parser.close()
+    return parser.items
+
+
+class NetscapeHTMLRequestParser(BaseParser):
+    media_type = 'text/html'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        return stream.read().decode(encoding, errors='replace')
+
+
+class JSONLinesRequestParser(BaseParser):
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return parse_json_lines(stream.read().decode(settings.DEFAULT_CHARSET, errors='replace'))
+
+
+class CSVRequestParser(BaseParser):
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        return parse_csv(stream.read().decode(encoding, errors='replace'))
+
+
+def parse_upload(upload):
+    content = upload.read().decode('utf-8-sig', errors='replace')
+    stripped = content.lstrip()
+    if stripped.startswith(('[', '{')):
+        try:
+            data = json.loads(content)
+        except ValueError:
+            if stripped.startswith('{'):
+                return parse_json_lines(content)
+            raise ValidationError('Некорректный JSON')
+        if isinstance(data, dict) and 'bookmarks' not in data:
+            # JSON Lines из одной закладки
+            data = [data]
+        return normalize_items(data)
+    if upload.name.lower().endswith('.csv'):
+        return parse_csv(content)
+    return parse_netscape_html(content)
+
+
+def parse_json_lines(content):
+    """Разбирает JSON Lines: по закладке в строке, как в экспорте format=jsonl."""
+    data = []
+    for number, line in enumerate(content.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            data.append(json.loads(line))
+        except ValueError:
+            raise ValidationError(f'Некорректный JSON в строке {number}')
+    return normalize_items(data)
+
+
+def parse_csv(content):
+    """Разбирает CSV с заголовком, как в экспорте format=csv; обязательна только колонка url."""
+    reader = csv.DictReader(content.splitlines(keepends=True))
+    if 'url' not in (reader.fieldnames or []):
+        raise ValidationError('В CSV нет колонки url')
+    items = []
+    for row in reader:
+        item = {key: value for key, value in row.items() if key and value}
+        item['collections'] = [
+            title.strip() for title in (row.get('collections') or '').split(CSV_COLLECTION_SEPARATOR) if title.strip()
+        ]
+        items.append(item)
+    return items
+
+
+def normalize_items(data):
+    """Приводит JSON-импорт к списку словарей с ключом url."""
+    if isinstance(data, dict):
+        data = data.get('bookmarks')
+    if not isinstance(data, list):
+        raise ValidationError('Ожидается список закладок')
+
+    items = []
+    for item in data:
+        if isinstance(item, str):
+            item = {'url': item}
+        elif not isinstance(item, dict):
+            item = {'url': ''}
+        items.append(item)
+    return items
+
+
+def has_metadata(item):
+    # Полная запись (например, из нашего экспорта) не требует загрузки страницы
+    return bool(item.get('title') and item.get('bookmark_type'))
+
+
+class BookmarkImporter:
+    def __init__(self, user):
+        self.user = user
+        self.resolver = MetadataResolver()
+        self.seeded_links = []
+
+    def run(self, items):
+        results, accepted = self.prepare(items)
+        self.resolver.prefetch(self.fetch_urls(accepted), settings.BOOKMARKS_IMPORT_MAX_WORKERS)
+        return self.finish(results, accepted)
+
+    def prepare(self, items):
+        """Проверяет и дедуплицирует записи; загрузку страниц вызывающий код выполняет сам."""
+        if len(items) > settings.BOOKMARKS_IMPORT_MAX_ITEMS:
+            raise ValidationError(f'Не больше {settings.BOOKMARKS_IMPORT_MAX_ITEMS} закладок за один импорт')
+        return self._dedupe(items)
+
+    def fetch_urls(self, accepted):
+        return [item['url'] for item in accepted if not has_metadata(item)]
+
+    def finish(self, results, accepted):
+        bookmarks = [self._build_bookmark(item) for item in accepted]
+        with transaction.atomic():
+            self._save(accepted, bookmarks)
+            # bulk_create не отправляет сигналы, кэш списков сбрасываем сами
+            bump_user_version(self.user.pk)
+
+        for item, bookmark in zip(accepted, bookmarks):
+            results[item['index']].update({
+                'status': 'created',
+                'id': bookmark.pk,
+                'enrichment_status': bookmark.enrichment_status,
+            })
+        return results
+
+    def _dedupe(self, items):
+        results = []
+        accepted = {}
+        for index, item in enumerate(items):
+            result = {'url': str(item.get('url') or '').strip(), 'status': 'invalid'}
+            results.append(result)
+            serializer = BookmarkImportItemSerializer(data=item)
+            if not serializer.is_valid():
+                result['error'] = error_text(serializer.errors)
+                continue
+            item = serializer.validated_data
+
+            key = normalize_url(item['url'])
+            collections = list(item.get('collections', []))
+            if key in accepted:
+                # Одна ссылка в нескольких папках: объединяем коллекции
+                accepted[key]['collections'] += collections
+                result['status'] = 'duplicate'
+                continue
+            accepted[key] = dict(item, index=index, collections=collections)
+
+        links = Link.objects.for_urls([item['url'] for item in accepted.values()])
+        for item in accepted.values():
+            item['link'] = links[url_hash(item['url'])]
+        existing = set(
+            Bookmark.objects.filter(user=self.user, link__in=list(links.values())).values_list('link_id', flat=True)
+        )
+        for key, item in list(accepted.items()):
+            if item['link'].pk in existing:
+                results[accepted.pop(key)['index']]['status'] = 'exists'
+        return results, list(accepted.values())
+
+    def _build_bookmark(self, item):
+        bookmark = Bookmark(
+            user=self.user,
+            url=item['url'],
+            link=item['link'],
+            title=str(item.get('title') or '')[:200],
+            enrichment_status=Bookmark.ENRICHMENT_DONE,
+        )
+        if has_metadata(item):
+            link = item['link']
+            if link.fetched_at is None:
+                # Данные из файла только заполняют ещё не загруженную ссылку, загрузка их перезапишет
+                link.description = str(item.get('description') or '')
+                link.image = str(item.get('preview_image') or '')
+                bookmark_type = item.get('bookmark_type') or ''
+                link.bookmark_type = bookmark_type if bookmark_type in BOOKMARK_TYPES else check_og_type(bookmark_type)
+                self.seeded_links.append(link)
+            return bookmark
+
+        try:
+            og_data = self.resolver.resolve(item['url'])
+        except requests.RequestException:
+            # Сайт не ответил: закладку сохраняем, данные догрузит воркер
+            bookmark.enrichment_status = Bookmark.ENRICHMENT_PENDING
+            return bookmark
+
+        if og_data is None:
+            bookmark.enrichment_status = Bookmark.ENRICHMENT_FAILED
+        else:
+            apply_open_graph_data(bookmark, og_data)
+        return bookmark
+
+    def _save(self, items, bookmarks):
+        Link.objects.bulk_update(
+            self.seeded_links, ['description', 'image', 'bookmark_type'],
+            batch_size=settings.BOOKMARKS_IMPORT_BATCH_SIZE,
+        )
+        Bookmark.objects.bulk_create(bookmarks, batch_size=settings.BOOKMARKS_IMPORT_BATCH_SIZE)
+        if not connection.features.can_return_rows_from_bulk_insert:
+            ids = dict(
+                Bookmark.objects.filter(user=self.user, link__in=[bookmark.link_id for bookmark in bookmarks])
+                .values_list('link_id', 'id')
+            )
+            for bookmark in bookmarks:
+                bookmark.pk = ids[bookmark.link_id]
+
+        collection_ids = self._collection_ids(items)
+        memberships = [
+            (bookmark.pk, collection_id)
+            for item, bookmark in zip(items, bookmarks)
+            for collection_id in {collection_ids[ref] for ref in item['collections'] if ref in collection_ids}
+        ]
+        through = Bookmark.collections.through
+        through.objects.bulk_create(
+            [through(bookmark_id=bookmark_id, collection_id=collection_id) for bookmark_id, collection_id in memberships],
+            batch_size=settings.BOOKMARKS_IMPORT_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+        MetadataJob.objects.bulk_create(
+            [
+                MetadataJob(bookmark_id=bookmark.pk)
+                for bookmark in bookmarks
+                if bookmark.enrichment_status == Bookmark.ENRICHMENT_PENDING
+            ],
+            batch_size=settings.BOOKMARKS_IMPORT_BATCH_SIZE,
+        )
+        # bulk_create не отправляет сигналы: журнал синхронизации пополняем сами
+        record_changes(self.user.pk, ChangeLog.KIND_BOOKMARK, [bookmark.pk for bookmark in bookmarks])
+        record_memberships(self.user.pk, memberships)
+
+    def _collection_ids(self, items):
+        """Сопоставляет ссылки на коллекции (id или название) с id коллекций пользователя."""
+        refs = {ref for item in items for ref in item['collections']}
+        titles = {ref for ref in refs if isinstance(ref, str)}
+        ids = refs - titles
+
+        collections = Collection.objects.filter(user=self.user)
+        by_title = dict(collections.filter(title__in=titles).values_list('title', 'id'))
+        missing = titles - by_title.keys()
+        if missing:
+            Collection.objects.bulk_create(
+                [Collection(user=self.user, title=title, description='') for title in missing]
+            )
+            created = dict(collections.filter(title__in=missing).values_list('title', 'id'))
+            record_changes(self.user.pk, ChangeLog.KIND_COLLECTION, created.values())
+            by_title.update(created)
+
+        mapping = {ref: ref for ref in collections.filter(id__in=ids).values_list('id', flat=True)}
+        mapping.update(by_title)
+        return mapping
+
+
+def error_text(errors):
+    """Ошибки сериализатора одной строкой: «поле: сообщение»."""
+    if isinstance(errors, dict):
+        return ' '.join(f'{field}: {error_text(messages)}' for field, messages in errors.items())
+    if isinstance(errors, list):
+        return ' '.join(error_text(message) for message in errors)
+    return str(errors)
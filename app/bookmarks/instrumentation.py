@@ -0,0 +1,166 @@
+import logging
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+logger = logging.getLogger(__name__)
+
+METRICS_PATH = '/metrics'
+UNRESOLVED_VIEW = '<unresolved>'
+
+_current = ContextVar('bookmarks_request_timings', default=None)
+
+REQUESTS = Counter(
+    'bookmarks_http_requests_total', 'Обработанные запросы', ['view', 'method', 'status'],
+)
+REQUEST_DURATION = Histogram(
+    'bookmarks_http_request_duration_seconds', 'Время обработки запроса', ['view'],
+)
+DB_QUERIES = Counter('bookmarks_db_queries_total', 'Запросы к базе', ['view'])
+DB_DURATION = Histogram('bookmarks_db_duration_seconds', 'Время запросов к базе за один запрос', ['view'])
+QUERIES_PER_REQUEST = Histogram(
+    'bookmarks_db_queries_per_request', 'Число запросов к базе за один запрос', ['view'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+FETCHES = Counter('bookmarks_fetch_requests_total', 'Загрузки сторонних страниц внутри запроса', ['view'])
+FETCH_DURATION = Histogram('bookmarks_fetch_duration_seconds', 'Время загрузки сторонних страниц за один запрос', ['view'])
+RENDER_DURATION = Histogram('bookmarks_render_duration_seconds', 'Время отрисовки ответа', ['view'])
+
+
+class RequestTimings:
+    """Счётчики одного запроса; sql заполняется, только если запрос попал в выборку журнала медленных."""
+
+    def __init__(self, record_sql=False):
+        self.started = time.perf_counter()
+        self.db_count = 0
+        self.db_time = 0.0
+        self.fetch_count = 0
+        self.fetch_time = 0.0
+        self.render_time = 0.0
+        self.sql = [] if record_sql else None
+        # Страницы импорта загружаются параллельно в нескольких потоках
+        self.fetch_lock = threading.Lock()
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.db_count} queries"',
+            f'fetch;dur={self.fetch_time * 1000:.1f};desc="{self.fetch_count} requests"',
+            f'render;dur={self.render_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+def record_query(execute, sql, params, many, context):
+    """Обёртка выполнения запросов, установленная на все соединения: вне запроса ничего не делает."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        timings.db_count += 1
+        timings.db_time += duration
+        # Параметры не сохраняем: в них могут быть данные пользователя
+        if timings.sql is not None and len(timings.sql) < settings.BOOKMARKS_SLOW_REQUEST_MAX_QUERIES:
+            timings.sql.append((duration, sql))
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_fetch(duration):
+    timings = _current.get()
+    if timings is not None:
+        with timings.fetch_lock:
+            timings.fetch_count += 1
+            timings.fetch_time += duration
+
+
+def render(response):
+    """Отрисовывает TemplateResponse и учитывает время отрисовки в текущем запросе."""
+    started = time.perf_counter()
+    response.render()
+    timings = _current.get()
+    if timings is not None:
+        timings.render_time += time.perf_counter() - started
+    return response
+
+
+def metrics_registry():
+    # Под gunicorn с несколькими процессами метрики собираются из файлов всех воркеров
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+class InstrumentationMiddleware:
+    """Время запросов к базе, загрузок страниц и отрисовки для каждого запроса.
+
+    Итоги уходят в заголовок Server-Timing и в метрики Prometheus (GET /metrics),
+    медленные запросы из выборки пишутся в журнал вместе с SQL.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.path == METRICS_PATH:
+            return self.metrics(request)
+        sample_rate = settings.BOOKMARKS_SLOW_REQUEST_SAMPLE_RATE
+        record_sql = bool(settings.BOOKMARKS_SLOW_REQUEST_SECONDS) and random.random() < sample_rate
+        timings = RequestTimings(record_sql)
+        token = _current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - timings.started
+        if settings.BOOKMARKS_SERVER_TIMING:
+            response['Server-Timing'] = timings.server_timing(total)
+        self.observe(request, response, timings, total)
+        return response
+
+    def process_template_response(self, request, response):
+        # Метод вызывается последним из middleware: отрисовку после него Django уже не повторит
+        return render(response)
+
+    def observe(self, request, response, timings, total):
+        match = request.resolver_match
+        view = (match.view_name if match else '') or UNRESOLVED_VIEW
+        REQUESTS.labels(view, request.method, response.status_code).inc()
+        REQUEST_DURATION.labels(view).observe(total)
+        DB_QUERIES.labels(view).inc(timings.db_count)
+        DB_DURATION.labels(view).observe(timings.db_time)
+        QUERIES_PER_REQUEST.labels(view).observe(timings.db_count)
+        if timings.fetch_count:
+            FETCHES.labels(view).inc(timings.fetch_count)
+            FETCH_DURATION.labels(view).observe(timings.fetch_time)
+        RENDER_DURATION.labels(view).observe(timings.render_time)
+
+        if timings.sql is not None and total >= settings.BOOKMARKS_SLOW_REQUEST_SECONDS:
+            logger.warning(
+                'Slow request %s %s (%s): %.0f ms, db %d queries %.0f ms, fetch %d %.0f ms, render %.0f ms\n%s',
+                request.method, request.path, view, total * 1000,
+                timings.db_count, timings.db_time * 1000, timings.fetch_count, timings.fetch_time * 1000,
+                timings.render_time * 1000,
+                '\n'.join(f'{duration * 1000:8.1f} ms  {sql}' for duration, sql in timings.sql),
+            )
+
+    def metrics(self, request):
+        token = settings.BOOKMARKS_METRICS_TOKEN
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponseForbidden()
+        return HttpResponse(generate_latest(metrics_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,108 @@
+import logging
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .metadata import MetadataResolver, apply_open_graph_data
+from .models import Bookmark, MetadataJob
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_metadata_job(bookmark):
+    """Ставит загрузку данных сохранённой закладки в очередь после фиксации транзакции.
+
+    Статус ENRICHMENT_PENDING вызывающий код выставляет до сохранения: иначе воркер
+    мог бы загрузить прежнюю ссылку, а сохранение — перезаписать его результат.
+    """
+    transaction.on_commit(
+        lambda: MetadataJob.objects.create(bookmark=bookmark), using=router.db_for_write(MetadataJob)
+    )
+
+
+def release_stale_jobs():
+    """Возвращает в очередь задачи, захваченные упавшим воркером."""
+    deadline = timezone.now() - timedelta(seconds=settings.BOOKMARKS_METADATA_JOB_LOCK_TIMEOUT)
+    return MetadataJob.objects.filter(
+        status=MetadataJob.STATUS_RUNNING, locked_at__lt=deadline
+    ).update(status=MetadataJob.STATUS_QUEUED, locked_at=None)
+
+
+def prune_finished_jobs(days=None):
+    """Удаляет выполненные и проваленные задачи старше срока хранения: очередь не растёт бесконечно."""
+    if days is None:
+        days = settings.BOOKMARKS_METADATA_JOB_RETENTION_DAYS
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = MetadataJob.objects.filter(
+        status__in=(MetadataJob.STATUS_DONE, MetadataJob.STATUS_FAILED), updated_at__lt=cutoff
+    ).delete()
+    return deleted
+
+
+def claim_jobs(limit):
+    now = timezone.now()
+    with transaction.atomic():
+        job_ids = list(
+            MetadataJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=MetadataJob.STATUS_QUEUED, run_after__lte=now)
+            .order_by('run_after', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        MetadataJob.objects.filter(id__in=job_ids).update(
+            status=MetadataJob.STATUS_RUNNING, locked_at=now, attempts=F('attempts') + 1
+        )
+    return list(MetadataJob.objects.filter(id__in=job_ids).select_related('bookmark__link'))
+
+
+def _finish(job, job_status, bookmark_status, error=''):
+    bookmark = job.bookmark
+    bookmark.enrichment_status = bookmark_status
+    bookmark.save(update_fields=['enrichment_status', 'updated_at'])
+    job.status = job_status
+    job.last_error = error
+    job.locked_at = None
+    job.save(update_fields=['status', 'last_error', 'locked_at', 'updated_at'])
+
+
+def _retry_or_fail(job, error):
+    if job.attempts >= settings.BOOKMARKS_METADATA_JOB_MAX_ATTEMPTS:
+        _finish(job, MetadataJob.STATUS_FAILED, Bookmark.ENRICHMENT_FAILED, error)
+        return
+    delay = settings.BOOKMARKS_METADATA_JOB_RETRY_DELAY * job.attempts
+    job.status = MetadataJob.STATUS_QUEUED
+    job.last_error = error
+    job.locked_at = None
+    job.run_after = timezone.now() + timedelta(seconds=delay)
+    job.save(update_fields=['status', 'last_error', 'locked_at', 'run_after', 'updated_at'])
+
+
+def process_job(job, resolver=None):
+    bookmark = job.bookmark
+    resolver = resolver or MetadataResolver()
+    try:
+        og_data = resolver.resolve(bookmark.url)
+    except requests.RequestException as exc:
+        logger.warning('Metadata fetch for %s failed: %s', bookmark.url, exc)
+        _retry_or_fail(job, str(exc))
+        return
+
+    if og_data is None:
+        _finish(job, MetadataJob.STATUS_DONE, Bookmark.ENRICHMENT_FAILED, 'Non-200 response')
+        return
+
+    apply_open_graph_data(bookmark, og_data)
+    _finish(job, MetadataJob.STATUS_DONE, Bookmark.ENRICHMENT_DONE)
+
+
+def process_pending_jobs(limit=None):
+    release_stale_jobs()
+    jobs = claim_jobs(limit or settings.BOOKMARKS_METADATA_JOB_BATCH_SIZE)
+    resolver = MetadataResolver()
+    for job in jobs:
+        process_job(job, resolver)
+    return len(jobs)
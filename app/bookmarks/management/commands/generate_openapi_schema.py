@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from bookmarks.schema import generate_schema
+
+
+class Command(BaseCommand):
+    help = 'Сохраняет схему OpenAPI в файл, из которого её отдаёт /swagger/?format=openapi'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.BOOKMARKS_OPENAPI_SCHEMA_FILE)
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('Укажите --output или BOOKMARKS_OPENAPI_SCHEMA_FILE')
+        content = generate_schema()
+        with open(options['output'], 'wb') as file:
+            file.write(content)
+        self.stdout.write(f'Схема сохранена в {options["output"]} ({len(content)} байт)')
@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+
+from bookmarks.jobs import process_pending_jobs, prune_finished_jobs
+from bookmarks.management.worker import WorkerCommand
+
+
+class Command(WorkerCommand):
+    help = 'Загружает Open Graph данные для закладок из очереди задач'
+    batch_size_setting = 'BOOKMARKS_METADATA_JOB_BATCH_SIZE'
+    poll_interval_setting = 'BOOKMARKS_METADATA_WORKER_POLL_INTERVAL'
+
+    def handle(self, *args, **options):
+        self.pruned_at = None
+        super().handle(*args, **options)
+
+    def process_batch(self, options):
+        if self.pruned_at is None or time.monotonic() - self.pruned_at >= settings.BOOKMARKS_METADATA_JOB_PRUNE_INTERVAL:
+            pruned = prune_finished_jobs()
+            if pruned:
+                self.stdout.write(f'Удалено завершённых задач: {pruned}')
+            self.pruned_at = time.monotonic()
+        processed = process_pending_jobs(options['batch_size'])
+        if processed:
+            self.stdout.write(f'Обработано задач: {processed}')
+        return processed
@@ -0,0 +1,42 @@
+from django.db.models import F
+
+from bookmarks.management.worker import WorkerCommand
+from bookmarks.models import Link
+from bookmarks.previews import enqueue_preview, process_preview_jobs
+
+
+class Command(WorkerCommand):
+    help = 'Создаёт миниатюры картинок Open Graph из очереди задач'
+    batch_size_setting = 'BOOKMARKS_PREVIEW_JOB_BATCH_SIZE'
+    poll_interval_setting = 'BOOKMARKS_PREVIEW_WORKER_POLL_INTERVAL'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--enqueue-missing', action='store_true',
+            help='Поставить в очередь ссылки с картинкой без миниатюр (до заполнения очереди)',
+        )
+
+    def handle(self, *args, **options):
+        if options['enqueue_missing']:
+            self.enqueue_missing()
+        super().handle(*args, **options)
+
+    def process_batch(self, options):
+        processed = process_preview_jobs(options['batch_size'])
+        if processed:
+            self.stdout.write(f'Обработано задач: {processed}')
+        return processed
+
+    def enqueue_missing(self):
+        links = (
+            Link.objects.filter(bookmarks__isnull=False, preview_job__isnull=True)
+            .exclude(image='').exclude(image=F('preview_source'))
+            .distinct().only('id', 'url', 'image', 'preview_source')
+        )
+        queued = 0
+        for link in links.iterator():
+            if enqueue_preview(link) is None:
+                break
+            queued += 1
+        self.stdout.write(f'Поставлено в очередь: {queued}')
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from bookmarks.changes import prune_change_log
+
+
+class Command(BaseCommand):
+    help = 'Удаляет из журнала синхронизации записи старше срока хранения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.BOOKMARKS_SYNC_RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        deleted = prune_change_log(options['days'])
+        self.stdout.write(f'Удалено записей журнала: {deleted}')
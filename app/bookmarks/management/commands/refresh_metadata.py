@@ -0,0 +1,31 @@
+from django.conf import settings
+
+from bookmarks.management.worker import WorkerCommand
+from bookmarks.refresh import MetadataRefresher, refresh_stale_links
+
+
+class Command(WorkerCommand):
+    help = 'Обновляет данные Open Graph у давно не обновлявшихся ссылок условными запросами'
+    batch_size_setting = 'BOOKMARKS_METADATA_REFRESH_BATCH_SIZE'
+    poll_interval_setting = 'BOOKMARKS_METADATA_REFRESH_POLL_INTERVAL'
+    once_help = 'Обработать одну пачку ссылок и выйти'
+    stop_message = 'Обновление остановлено'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--workers', type=int, default=settings.BOOKMARKS_METADATA_REFRESH_MAX_WORKERS)
+
+    def handle(self, *args, **options):
+        # Один ограничитель на всё время работы: паузы между запросами к хосту держатся и между пачками
+        self.refresher = MetadataRefresher(max_workers=options['workers'])
+        super().handle(*args, **options)
+
+    def process_batch(self, options):
+        stats = refresh_stale_links(options['batch_size'], self.refresher)
+        processed = sum(stats.values())
+        if processed:
+            self.stdout.write(
+                'Обновлено ссылок: {updated}, без изменений: {unchanged}, '
+                '304: {not_modified}, ошибок: {failed}'.format(**stats)
+            )
+        return processed
@@ -0,0 +1,39 @@
+import time
+from abc import ABCMeta, abstractmethod
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+class WorkerCommand(BaseCommand, metaclass=ABCMeta):
+    """Общий цикл воркеров: пачка за пачкой, пауза, когда работы нет.
+
+    Подкласс задаёт имена настроек по умолчанию и process_batch().
+    """
+    batch_size_setting = None
+    poll_interval_setting = None
+    once_help = 'Обработать одну пачку задач и выйти'
+    stop_message = 'Воркер остановлен'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help=self.once_help)
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, self.batch_size_setting))
+        parser.add_argument('--sleep', type=float, default=getattr(settings, self.poll_interval_setting))
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                # Как между запросами: закрываем соединение старше CONN_MAX_AGE и проверяем его перед пачкой
+                close_old_connections()
+                processed = self.process_batch(options)
+                if options['once']:
+                    break
+                if not processed:
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.stop_message)
+
+    @abstractmethod
+    def process_batch(self, options):
+        """Обрабатывает одну пачку и возвращает число обработанных записей."""
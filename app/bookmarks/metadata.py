@@ -0,0 +1,429 @@
+import asyncio
+import codecs
+import random
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from datetime import timedelta
+from html.parser import HTMLParser
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .http import async_http_client, http_client
+from .models import Link
+from .previews import enqueue_preview
+from .utils import normalize_url, url_hash
+
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+# Поля ссылки, которые видят владельцы закладок
+DISPLAY_FIELDS = ('title', 'description', 'image', 'bookmark_type')
+
+
+class MetadataUnavailable(requests.RequestException):
+    """Страница недавно не ответила, повторный запрос отложен до истечения кэша."""
+
+
+def check_og_type(og_type):
+    if 'article' in og_type:
+        return 'article'
+    elif 'book' in og_type:
+        return 'book'
+    elif 'music' in og_type:
+        return 'music'
+    elif 'video' in og_type:
+        return 'video'
+    else:
+        return 'website'
+
+
+class OpenGraphParser(HTMLParser):
+    """Собирает meta-теги и <title> за один проход, останавливается на </head>."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.properties = {}
+        self.names = {}
+        self.title = ''
+        self.done = False
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'meta':
+            attrs = dict(attrs)
+            content = attrs.get('content') or ''
+            if attrs.get('property'):
+                self.properties.setdefault(attrs['property'].lower(), content)
+            if attrs.get('name'):
+                self.names.setdefault(attrs['name'].lower(), content)
+        elif tag == 'title':
+            self._in_title = True
+        elif tag == 'body':
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == 'title':
+            self._in_title = False
+        elif tag == 'head':
+            self.done = True
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+
+    def find(self, og_name):
+        key = f'og:{og_name}'
+        if key in self.properties:
+            return self.properties[key]
+        if key in self.names:
+            return self.names[key]
+        if og_name == 'title':
+            return self.title.strip()
+        if og_name == 'description':
+            return self.names.get('description', '')
+        return ''
+
+    def get_og_data(self):
+        return {og_name: self.find(og_name) for og_name in ('title', 'description', 'image', 'type')}
+
+
+def is_html(content_type):
+    return not content_type or content_type.split(';')[0].strip().lower() in HTML_CONTENT_TYPES
+
+
+def sniff_encoding(content_type, head):
+    declared = requests.utils.get_encoding_from_headers({'content-type': content_type})
+    if 'charset' in content_type.lower() and declared:
+        return declared
+    match = META_CHARSET_RE.search(head)
+    if match:
+        return match.group(1).decode('ascii')
+    return 'utf-8'
+
+
+class HeadStreamParser:
+    """Разбирает начало страницы по частям; общий для синхронной и асинхронной загрузки."""
+
+    def __init__(self, content_type):
+        self.content_type = content_type
+        self.parser = OpenGraphParser()
+        self.decoder = None
+        self.received = 0
+        self.max_bytes = settings.BOOKMARKS_METADATA_MAX_HEAD_BYTES
+
+    def feed(self, chunk):
+        """Возвращает True, когда дальше читать не нужно."""
+        if self.decoder is None:
+            try:
+                self.decoder = codecs.getincrementaldecoder(sniff_encoding(self.content_type, chunk))(errors='replace')
+            except LookupError:
+                self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        chunk = chunk[:self.max_bytes - self.received]
+        self.received += len(chunk)
+        self.parser.feed(self.decoder.decode(chunk))
+        return self.parser.done or self.received >= self.max_bytes
+
+    def get_og_data(self):
+        return self.parser.get_og_data()
+
+
+def parse_open_graph_stream(response):
+    parser = HeadStreamParser(response.headers.get('Content-Type', ''))
+    for chunk in http_client.iter_content(response, settings.BOOKMARKS_METADATA_CHUNK_SIZE):
+        if parser.feed(chunk):
+            break
+    return parser.get_og_data()
+
+
+async def aparse_open_graph_stream(response):
+    parser = HeadStreamParser(response.headers.get('Content-Type', ''))
+    async for chunk in async_http_client.aiter_content(response, settings.BOOKMARKS_METADATA_CHUNK_SIZE):
+        if parser.feed(chunk):
+            break
+    return parser.get_og_data()
+
+
+FetchResult = namedtuple('FetchResult', ['og_data', 'not_modified', 'etag', 'last_modified'])
+
+
+def fetch_open_graph_data(url, etag='', last_modified=''):
+    """Загружает данные страницы; с сохранёнными валидаторами запрос условный и 304 не читается."""
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    with http_client.get(url, headers=headers or None) as response:
+        new_etag = response.headers.get('ETag', '')[:255]
+        new_last_modified = response.headers.get('Last-Modified', '')[:64]
+        if response.status_code == 304:
+            return FetchResult(None, True, new_etag or etag, new_last_modified or last_modified)
+        if response.status_code != 200:
+            return FetchResult(None, False, '', '')
+
+        content_type = response.headers.get('Content-Type', '')
+        if not is_html(content_type):
+            # Тело не читаем: тип ссылки определяем по заголовку (например, video/mp4)
+            og_data = {'title': '', 'description': '', 'image': '', 'type': content_type}
+        else:
+            og_data = parse_open_graph_stream(response)
+        return FetchResult(og_data, False, new_etag, new_last_modified)
+
+
+def get_open_graph_data(url):
+    return fetch_open_graph_data(url).og_data
+
+
+async def aget_open_graph_data(url):
+    """Асинхронный вариант get_open_graph_data для ASGI-представлений."""
+    async with async_http_client.get(url) as response:
+        if response.status_code != 200:
+            return None
+        content_type = response.headers.get('Content-Type', '')
+        if not is_html(content_type):
+            return {'title': '', 'description': '', 'image': '', 'type': content_type}
+        return await aparse_open_graph_stream(response)
+
+
+class MetadataCache:
+    """Двухуровневый кэш данных Open Graph: кэш Django и таблица links."""
+
+    KEY_PREFIX = 'bookmarks:metadata:'
+    HITS_KEY = KEY_PREFIX + 'hits'
+    MISSES_KEY = KEY_PREFIX + 'misses'
+    TOUCH_INTERVAL = timedelta(minutes=10)
+
+    @property
+    def cache(self):
+        return caches[settings.BOOKMARKS_METADATA_CACHE_ALIAS]
+
+    def get(self, url):
+        digest = url_hash(url)
+        entry = self.cache.get(self.KEY_PREFIX + digest)
+        if entry is None:
+            entry = self._get_from_db(digest)
+        self._incr(self.MISSES_KEY if entry is None else self.HITS_KEY)
+        return entry
+
+    def set(self, url, og_data, error='', etag=None, last_modified=None):
+        if og_data is None:
+            ttl = settings.BOOKMARKS_METADATA_CACHE_NEGATIVE_TTL
+        else:
+            ttl = settings.BOOKMARKS_METADATA_CACHE_TTL
+        digest = url_hash(url)
+        now = timezone.now()
+        defaults = {
+            'url': normalize_url(url),
+            'is_available': bool(og_data),
+            'error': error,
+            'fetched_at': now,
+            'expires_at': now + timedelta(seconds=ttl),
+            'last_accessed_at': now,
+        }
+        if etag is not None:
+            # Валидаторы знает только условная загрузка, остальные пути их не трогают
+            defaults.update({'etag': etag, 'last_modified': last_modified or ''})
+        if og_data:
+            # При ошибке загрузки прежние данные страницы остаются у закладок
+            defaults.update({
+                'title': og_data.get('title') or '',
+                'description': og_data.get('description') or '',
+                'image': og_data.get('image') or '',
+                'og_type': (og_data.get('type') or '')[:100],
+                'bookmark_type': check_og_type(og_data.get('type') or ''),
+            })
+        link, created = Link.objects.get_or_create(url_hash=digest, defaults=defaults)
+        if not created:
+            if any(getattr(link, field) != defaults[field] for field in DISPLAY_FIELDS if field in defaults):
+                # Сохранение модели сбрасывает списки и пишет журнал у всех владельцев ссылки
+                for field, value in defaults.items():
+                    setattr(link, field, value)
+                link.save()
+            else:
+                Link.objects.filter(pk=link.pk).update(**defaults)
+        if og_data:
+            enqueue_preview(link)
+        entry = {'data': og_data or None, 'error': error}
+        self.cache.set(self.KEY_PREFIX + digest, entry, ttl)
+        # Подсчёт ссылок без закладок — полный проход по таблицам: проверяем размер на выборке записей
+        if random.random() < settings.BOOKMARKS_METADATA_CACHE_CULL_SAMPLE_RATE:
+            self._cull()
+        return entry
+
+    def stats(self):
+        return {
+            'hits': self.cache.get(self.HITS_KEY, 0),
+            'misses': self.cache.get(self.MISSES_KEY, 0),
+        }
+
+    def clear(self):
+        # Ссылки с закладками не удаляем, а помечаем устаревшими
+        Link.objects.filter(bookmarks__isnull=True).delete()
+        Link.objects.update(expires_at=timezone.now())
+        self.cache.clear()
+
+    def _get_from_db(self, digest):
+        now = timezone.now()
+        row = Link.objects.filter(url_hash=digest, expires_at__gt=now).first()
+        if row is None:
+            return None
+
+        entry = {'data': None, 'error': row.error}
+        if row.is_available:
+            entry['data'] = {
+                'title': row.title,
+                'description': row.description,
+                'image': row.image,
+                'type': row.og_type,
+            }
+        self.cache.set(self.KEY_PREFIX + digest, entry, (row.expires_at - now).total_seconds())
+        if row.last_accessed_at < now - self.TOUCH_INTERVAL:
+            Link.objects.filter(pk=row.pk).update(last_accessed_at=now)
+        return entry
+
+    def _cull(self):
+        # Вытесняются только ссылки без закладок: остальные — данные, а не кэш
+        max_entries = settings.BOOKMARKS_METADATA_CACHE_MAX_ENTRIES
+        orphans = Link.objects.filter(bookmarks__isnull=True)
+        count = orphans.count()
+        if count <= max_entries:
+            return
+
+        expired = orphans.filter(expires_at__lte=timezone.now())
+        count -= self._delete(expired)
+        if count > max_entries:
+            # Вытесняем записи, к которым дольше всего не обращались
+            self._delete(orphans.order_by('last_accessed_at')[:count - max_entries])
+
+    def _delete(self, links):
+        rows = list(links.values_list('id', 'url_hash'))
+        Link.objects.filter(id__in=[pk for pk, _ in rows]).delete()
+        self.cache.delete_many([self.KEY_PREFIX + digest for _, digest in rows])
+        return len(rows)
+
+    def _incr(self, key):
+        self.cache.add(key, 0, None)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            pass
+
+
+metadata_cache = MetadataCache()
+
+
+def get_cached_open_graph_data(url):
+    entry = metadata_cache.get(url)
+    if entry is None:
+        try:
+            og_data = get_open_graph_data(url)
+        except requests.RequestException as exc:
+            metadata_cache.set(url, None, error=str(exc) or exc.__class__.__name__)
+            raise
+        entry = metadata_cache.set(url, og_data)
+    elif entry['error']:
+        raise MetadataUnavailable(entry['error'])
+    return entry['data']
+
+
+class MetadataResolver:
+    """Загружает данные Open Graph не более одного раза на URL в рамках запроса."""
+
+    def __init__(self):
+        self._results = {}
+        self.fetch_count = 0
+
+    def resolve(self, url):
+        if url not in self._results:
+            self.fetch_count += 1
+            try:
+                self._results[url] = (get_cached_open_graph_data(url), None)
+            except requests.RequestException as exc:
+                self._results[url] = (None, exc)
+
+        og_data, error = self._results[url]
+        if error is not None:
+            raise error
+        return og_data
+
+    def is_resolved(self, url):
+        return url in self._results
+
+    def prefetch(self, urls, max_workers):
+        """Заранее загружает данные для списка URL, промахи кэша параллельно."""
+        misses = self._lookup(urls)
+        if misses:
+            # В потоках только HTTP-запросы, кэш и база остаются в текущем потоке
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                # Загрузки в потоках учитываются в счётчиках текущего запроса
+                futures = {pool.submit(copy_context().run, get_open_graph_data, url): url for url in misses}
+                for future in as_completed(futures):
+                    url = futures[future]
+                    try:
+                        self._store(url, future.result())
+                    except requests.RequestException as exc:
+                        self._store(url, None, exc)
+
+    async def aprefetch(self, urls, max_concurrency):
+        """Как prefetch, но промахи кэша загружаются в цикле событий, без потоков."""
+        misses = await sync_to_async(self._lookup)(urls)
+        if not misses:
+            return
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def fetch(url):
+            async with semaphore:
+                try:
+                    return url, await aget_open_graph_data(url), None
+                except requests.RequestException as exc:
+                    return url, None, exc
+
+        results = await asyncio.gather(*(fetch(url) for url in misses))
+        await sync_to_async(self._store_many)(results)
+
+    async def aresolve(self, url):
+        await self.aprefetch([url], 1)
+        return self.resolve(url)
+
+    def _lookup(self, urls):
+        """Заполняет результаты из кэша и возвращает URL, которые нужно загрузить."""
+        misses = []
+        for url in dict.fromkeys(urls):
+            if url in self._results:
+                continue
+            self.fetch_count += 1
+            entry = metadata_cache.get(url)
+            if entry is None:
+                misses.append(url)
+            elif entry['error']:
+                self._results[url] = (None, MetadataUnavailable(entry['error']))
+            else:
+                self._results[url] = (entry['data'], None)
+        return misses
+
+    def _store(self, url, og_data, exc=None):
+        if exc is not None:
+            metadata_cache.set(url, None, error=str(exc) or exc.__class__.__name__)
+        else:
+            metadata_cache.set(url, og_data)
+        self._results[url] = (og_data, exc)
+
+    def _store_many(self, results):
+        for url, og_data, exc in results:
+            self._store(url, og_data, exc)
+
+
+def apply_open_graph_data(bookmark, og_data):
+    """Обновляет загруженную запись Link закладки: в базе данные уже сохранил metadata_cache."""
+    link = bookmark.link
+    link.title = og_data.get('title') or ''
+    link.description = og_data.get('description') or ''
+    link.image = og_data.get('image') or ''
+    link.og_type = (og_data.get('type') or '')[:100]
+    link.bookmark_type = check_og_type(og_data.get('type') or '')
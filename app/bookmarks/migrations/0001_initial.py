@@ -0,0 +1,53 @@
+# Generated by Django 3.2 on 2026-10-18 02:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Collection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200, verbose_name='Название')),
+                ('description', models.TextField(verbose_name='Описание')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Время изменения')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Коллекция',
+                'verbose_name_plural': 'Коллекции',
+                'db_table': 'collections',
+            },
+        ),
+        migrations.CreateModel(
+            name='Bookmark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200, verbose_name='Заголовок')),
+                ('description', models.TextField(verbose_name='Описание')),
+                ('url', models.URLField(verbose_name='Ссылка на страницу')),
+                ('bookmark_type', models.CharField(default='website', max_length=20, verbose_name='Тип ссылки')),
+                ('preview_image', models.URLField(verbose_name='Превью')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Время изменения')),
+                ('collections', models.ManyToManyField(related_name='bookmarks', to='bookmarks.Collection', verbose_name='Коллекция')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Закладка',
+                'verbose_name_plural': 'Закладки',
+                'db_table': 'bookmarks',
+            },
+        ),
+    ]
@@ -0,0 +1,112 @@
+# Generated by Django 3.2 on 2026-10-18 02:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+# Изменения после исходной схемы 0001_initial: статус загрузки данных закладки,
+# кэш данных ссылок, очередь задач и явная промежуточная модель коллекций
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookmarks', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bookmark',
+            name='description',
+            field=models.TextField(blank=True, verbose_name='Описание'),
+        ),
+        migrations.AlterField(
+            model_name='bookmark',
+            name='preview_image',
+            field=models.URLField(blank=True, verbose_name='Превью'),
+        ),
+        # Данные существующих закладок уже загружены при создании
+        migrations.AddField(
+            model_name='bookmark',
+            name='enrichment_status',
+            field=models.CharField(choices=[('pending', 'Ожидает загрузки'), ('done', 'Загружено'), ('failed', 'Ошибка загрузки')], default='done', max_length=10, verbose_name='Статус загрузки данных'),
+        ),
+        migrations.AlterField(
+            model_name='bookmark',
+            name='enrichment_status',
+            field=models.CharField(choices=[('pending', 'Ожидает загрузки'), ('done', 'Загружено'), ('failed', 'Ошибка загрузки')], default='pending', max_length=10, verbose_name='Статус загрузки данных'),
+        ),
+        migrations.CreateModel(
+            name='UrlMetadata',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_hash', models.CharField(max_length=64, unique=True, verbose_name='Хеш ссылки')),
+                ('url', models.TextField(verbose_name='Ссылка на страницу')),
+                ('title', models.TextField(blank=True, verbose_name='Заголовок')),
+                ('description', models.TextField(blank=True, verbose_name='Описание')),
+                ('image', models.TextField(blank=True, verbose_name='Превью')),
+                ('og_type', models.CharField(blank=True, max_length=100, verbose_name='Тип Open Graph')),
+                ('is_available', models.BooleanField(default=True, verbose_name='Страница доступна')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка загрузки')),
+                ('fetched_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время загрузки')),
+                ('expires_at', models.DateTimeField(verbose_name='Действует до')),
+                ('last_accessed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Последнее обращение')),
+            ],
+            options={
+                'verbose_name': 'Данные ссылки',
+                'verbose_name_plural': 'Данные ссылок',
+                'db_table': 'url_metadata',
+            },
+        ),
+        migrations.CreateModel(
+            name='MetadataJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Выполнено'), ('failed', 'Ошибка')], default='queued', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попытки')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Запуск не раньше')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='Время захвата')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Время изменения')),
+                ('bookmark', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metadata_jobs', to='bookmarks.bookmark', verbose_name='Закладка')),
+            ],
+            options={
+                'verbose_name': 'Задача загрузки данных',
+                'verbose_name_plural': 'Задачи загрузки данных',
+                'db_table': 'metadata_jobs',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='metadatajob',
+            index=models.Index(fields=['status', 'run_after'], name='metadata_jobs_status_run_idx'),
+        ),
+        # Таблица bookmarks_collections уже создана автоматической промежуточной моделью
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='BookmarkCollection',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('bookmark', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bookmarks.bookmark', verbose_name='Закладка')),
+                        ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bookmarks.collection', verbose_name='Коллекция')),
+                    ],
+                    options={
+                        'verbose_name': 'Закладка в коллекции',
+                        'verbose_name_plural': 'Закладки в коллекциях',
+                        'db_table': 'bookmarks_collections',
+                        'unique_together': {('bookmark', 'collection')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='bookmark',
+                    name='collections',
+                    field=models.ManyToManyField(related_name='bookmarks', through='bookmarks.BookmarkCollection', to='bookmarks.Collection', verbose_name='Коллекция'),
+                ),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='bookmarkcollection',
+            name='id',
+            field=models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2 on 2026-10-18 02:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bookmarks', '0002_metadata_enrichment'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookmark',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='bookmarks_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookmark',
+            index=models.Index(fields=['user', 'url'], name='bookmarks_user_url_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookmarkcollection',
+            index=models.Index(fields=['collection', 'bookmark'], name='bookmarks_coll_bookmark_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='collection',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='collections_user_created_idx'),
+        ),
+        migrations.AlterField(
+            model_name='bookmark',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.AlterField(
+            model_name='bookmarkcollection',
+            name='bookmark',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='bookmarks.bookmark', verbose_name='Закладка'),
+        ),
+        migrations.AlterField(
+            model_name='bookmarkcollection',
+            name='collection',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='bookmarks.collection', verbose_name='Коллекция'),
+        ),
+        migrations.AlterField(
+            model_name='collection',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.2 on 2026-10-18 02:41
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Вектор строится триггером, поэтому его заполняют и bulk_create, и QuerySet.update
+CREATE_TRIGGER = """
+CREATE FUNCTION bookmarks_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(NEW.url, '')), 'B') ||
+        setweight(to_tsvector('russian', coalesce(NEW.description, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER bookmarks_search_vector_trigger
+BEFORE INSERT OR UPDATE OF title, description, url ON bookmarks
+FOR EACH ROW EXECUTE PROCEDURE bookmarks_search_vector_update();
+
+UPDATE bookmarks SET title = title;
+
+CREATE INDEX bookmarks_search_vector_idx ON bookmarks USING gin (search_vector);
+"""
+
+DROP_TRIGGER = """
+DROP INDEX IF EXISTS bookmarks_search_vector_idx;
+DROP TRIGGER IF EXISTS bookmarks_search_vector_trigger ON bookmarks;
+DROP FUNCTION IF EXISTS bookmarks_search_vector_update();
+"""
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_TRIGGER)
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_TRIGGER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookmarks', '0003_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookmark',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_trigger, drop_trigger),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 3.2 on 2026-10-18 09:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+# Триггер читает удаляемые поля закладки, новый создаёт миграция 0006. GIN-индекс остаётся.
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS bookmarks_search_vector_trigger ON bookmarks;
+DROP FUNCTION IF EXISTS bookmarks_search_vector_update();
+"""
+
+CREATE_TRIGGER = """
+CREATE FUNCTION bookmarks_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(NEW.url, '')), 'B') ||
+        setweight(to_tsvector('russian', coalesce(NEW.description, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER bookmarks_search_vector_trigger
+BEFORE INSERT OR UPDATE OF title, description, url ON bookmarks
+FOR EACH ROW EXECUTE PROCEDURE bookmarks_search_vector_update();
+
+UPDATE bookmarks SET title = title;
+"""
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_TRIGGER)
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_TRIGGER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookmarks', '0004_bookmark_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_trigger, create_trigger),
+        migrations.RenameModel('UrlMetadata', 'Link'),
+        migrations.AlterModelTable('link', 'links'),
+        migrations.AlterModelOptions(
+            name='link',
+            options={'verbose_name': 'Ссылка', 'verbose_name_plural': 'Ссылки'},
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='bookmark_type',
+            field=models.CharField(default='website', max_length=20, verbose_name='Тип ссылки'),
+        ),
+        migrations.AlterField(
+            model_name='link',
+            name='fetched_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Время загрузки'),
+        ),
+        migrations.AlterField(
+            model_name='link',
+            name='expires_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Действует до'),
+        ),
+        migrations.AddField(
+            model_name='bookmark',
+            name='link',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='bookmarks', to='bookmarks.link', verbose_name='Ссылка'),
+        ),
+        migrations.AlterField(
+            model_name='bookmark',
+            name='title',
+            field=models.CharField(blank=True, help_text='Пустой — заголовок страницы', max_length=200, verbose_name='Заголовок'),
+        ),
+    ]
@@ -0,0 +1,114 @@
+# Generated by Django 3.2 on 2026-10-18 09:12
+
+import hashlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.db import migrations
+from django.utils import timezone
+
+BATCH_SIZE = 500
+
+# Копии bookmarks.utils и bookmarks.metadata на момент миграции: её результат
+# не должен зависеть от того, как эти функции изменятся потом
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+TRACKING_PARAMS = frozenset(['fbclid', 'gclid', 'yclid', 'mc_cid', 'mc_eid', '_openstat'])
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name.startswith('utm_') or name in TRACKING_PARAMS
+
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{parts.port}'
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not is_tracking_param(name)
+    )
+    return urlunsplit((scheme, host, parts.path or '/', urlencode(query), ''))
+
+
+def url_hash(url):
+    return hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
+
+
+def check_og_type(og_type):
+    for bookmark_type in ('article', 'book', 'music', 'video'):
+        if bookmark_type in og_type:
+            return bookmark_type
+    return 'website'
+
+
+def link_bookmarks(apps, schema_editor):
+    Bookmark = apps.get_model('bookmarks', 'Bookmark')
+    Link = apps.get_model('bookmarks', 'Link')
+    db = schema_editor.connection.alias
+
+    # Записи кэша, хеш которых изменила новая нормализация, проще загрузить заново
+    stale = [link.pk for link in Link.objects.db_manager(db).only('url', 'url_hash').iterator() if url_hash(link.url) != link.url_hash]
+    Link.objects.db_manager(db).filter(pk__in=stale).delete()
+    for og_type in Link.objects.db_manager(db).exclude(og_type='').values_list('og_type', flat=True).distinct():
+        Link.objects.db_manager(db).filter(og_type=og_type).update(bookmark_type=check_og_type(og_type))
+
+    links = dict(Link.objects.db_manager(db).values_list('url_hash', 'id'))
+    titles = dict(Link.objects.db_manager(db).values_list('id', 'title'))
+    now = timezone.now()
+    batch = []
+    # Самая свежая закладка задаёт данные ссылки, которой ещё нет в кэше
+    for bookmark in Bookmark.objects.db_manager(db).order_by('-updated_at').iterator():
+        digest = url_hash(bookmark.url)
+        if digest not in links:
+            link = Link.objects.db_manager(db).create(
+                url_hash=digest,
+                url=normalize_url(bookmark.url),
+                title='' if bookmark.title == bookmark.url else bookmark.title,
+                description=bookmark.description,
+                image=bookmark.preview_image,
+                bookmark_type=bookmark.bookmark_type,
+                fetched_at=bookmark.updated_at,
+                expires_at=now,
+            )
+            links[digest] = link.pk
+            titles[link.pk] = link.title
+
+        bookmark.link_id = links[digest]
+        # Заголовок, совпадающий с заголовком страницы или ссылкой, своим не считаем
+        if bookmark.title in (titles[bookmark.link_id], bookmark.url):
+            bookmark.title = ''
+        batch.append(bookmark)
+        if len(batch) >= BATCH_SIZE:
+            Bookmark.objects.db_manager(db).bulk_update(batch, ['link', 'title'])
+            batch = []
+    Bookmark.objects.db_manager(db).bulk_update(batch, ['link', 'title'])
+
+
+def unlink_bookmarks(apps, schema_editor):
+    Bookmark = apps.get_model('bookmarks', 'Bookmark')
+    db = schema_editor.connection.alias
+    batch = []
+    for bookmark in Bookmark.objects.db_manager(db).select_related('link').iterator():
+        link = bookmark.link
+        bookmark.title = (bookmark.title or link.title or bookmark.url)[:200]
+        bookmark.description = link.description
+        bookmark.preview_image = link.image if len(link.image) <= 200 else ''
+        bookmark.bookmark_type = link.bookmark_type
+        batch.append(bookmark)
+        if len(batch) >= BATCH_SIZE:
+            Bookmark.objects.db_manager(db).bulk_update(batch, ['title', 'description', 'preview_image', 'bookmark_type'])
+            batch = []
+    Bookmark.objects.db_manager(db).bulk_update(batch, ['title', 'description', 'preview_image', 'bookmark_type'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookmarks', '0005_link'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_bookmarks, unlink_bookmarks),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 3.2 on 2026-10-18 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Заголовок берётся из закладки, а если он пуст — из ссылки; описание — из ссылки.
+# Обновление ссылки пересчитывает векторы всех её закладок.
+CREATE_TRIGGER = """
+CREATE FUNCTION bookmarks_search_vector_update() RETURNS trigger AS $$
+DECLARE
+    link_title text;
+    link_description text;
+BEGIN
+    SELECT title, description INTO link_title, link_description FROM links WHERE id = NEW.link_id;
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(nullif(NEW.title, ''), link_title, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(NEW.url, '')), 'B') ||
+        setweight(to_tsvector('russian', coalesce(link_description, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER bookmarks_search_vector_trigger
+BEFORE INSERT OR UPDATE OF title, url, link_id ON bookmarks
+FOR EACH ROW EXECUTE PROCEDURE bookmarks_search_vector_update();
+
+CREATE FUNCTION links_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    UPDATE bookmarks SET link_id = link_id WHERE link_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER links_search_vector_trigger
+AFTER UPDATE OF title, description ON links
+FOR EACH ROW
+WHEN (OLD.title IS DISTINCT FROM NEW.title OR OLD.description IS DISTINCT FROM NEW.description)
+EXECUTE PROCEDURE links_search_vector_update();
+
+UPDATE bookmarks SET link_id = link_id;
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS links_search_vector_trigger ON links;
+DROP FUNCTION IF EXISTS links_search_vector_update();
+DROP TRIGGER IF EXISTS bookmarks_search_vector_trigger ON bookmarks;
+DROP FUNCTION IF EXISTS bookmarks_search_vector_update();
+"""
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_TRIGGER)
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_TRIGGER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookmarks', '0006_link_data'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bookmark',
+            name='link',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='bookmarks', to='bookmarks.link', verbose_name='Ссылка'),
+        ),
+        migrations.RemoveIndex(
+            model_name='bookmark',
+            name='bookmarks_user_url_idx',
+        ),
+        migrations.RemoveField(
+            model_name='bookmark',
+            name='bookmark_type',
+        ),
+        migrations.RemoveField(
+            model_name='bookmark',
+            name='description',
+        ),
+        migrations.RemoveField(
+            model_name='bookmark',
+            name='preview_image',
+        ),
+        migrations.RunPython(create_trigger, drop_trigger),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2 on 2026-10-18 02:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookmarks', '0007_link_required'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='link',
+            name='etag',
+            field=models.CharField(blank=True, max_length=255, verbose_name='ETag'),
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Last-Modified'),
+        ),
+        migrations.AddIndex(
+            model_name='link',
+            index=models.Index(fields=['fetched_at'], name='links_fetched_idx'),
+        ),
+    ]
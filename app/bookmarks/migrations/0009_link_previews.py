@@ -0,0 +1,46 @@
+# Generated by Django 3.2 on 2026-10-18 03:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookmarks', '0008_link_validators'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='link',
+            name='preview_hash',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Хеш превью'),
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='preview_source',
+            field=models.TextField(blank=True, verbose_name='Источник превью'),
+        ),
+        migrations.CreateModel(
+            name='PreviewJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попытки')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Запуск не раньше')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='Время захвата')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время создания')),
+                ('link', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='preview_job', to='bookmarks.link', verbose_name='Ссылка')),
+            ],
+            options={
+                'verbose_name': 'Задача создания превью',
+                'verbose_name_plural': 'Задачи создания превью',
+                'db_table': 'preview_jobs',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='previewjob',
+            index=models.Index(fields=['run_after'], name='preview_jobs_run_after_idx'),
+        ),
+    ]
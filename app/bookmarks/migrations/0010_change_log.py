@@ -0,0 +1,38 @@
+# Generated by Django 3.2 on 2026-10-18 03:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bookmarks', '0009_link_previews'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('bookmark', 'Закладка'), ('collection', 'Коллекция'), ('membership', 'Закладка в коллекции')], max_length=10, verbose_name='Объект')),
+                ('object_id', models.BigIntegerField(verbose_name='Id объекта')),
+                ('collection_id', models.BigIntegerField(blank=True, null=True, verbose_name='Id коллекции')),
+                ('deleted', models.BooleanField(default=False, verbose_name='Удалён')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время изменения')),
+                ('user', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Изменение',
+                'verbose_name_plural': 'Изменения',
+                'db_table': 'change_log',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['user', 'id'], name='change_log_user_id_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2 on 2026-10-18 03:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bookmarks', '0010_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDataVersion',
+            fields=[
+                ('user', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('version', models.BigIntegerField(default=0, verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия данных пользователя',
+                'verbose_name_plural': 'Версии данных пользователей',
+                'db_table': 'user_data_versions',
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+# Заголовок ссылки нужен только закладкам без своего заголовка,
+# поэтому его изменение пересчитывает векторы лишь у них.
+UPDATE_FUNCTION = """
+CREATE OR REPLACE FUNCTION links_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    IF OLD.description IS DISTINCT FROM NEW.description THEN
+        UPDATE bookmarks SET link_id = link_id WHERE link_id = NEW.id;
+    ELSE
+        UPDATE bookmarks SET link_id = link_id WHERE link_id = NEW.id AND title = '';
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+RESTORE_FUNCTION = """
+CREATE OR REPLACE FUNCTION links_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    UPDATE bookmarks SET link_id = link_id WHERE link_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+
+def update_function(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(UPDATE_FUNCTION)
+
+
+def restore_function(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(RESTORE_FUNCTION)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookmarks', '0011_user_data_versions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookmark',
+            index=models.Index(fields=['user', 'link'], name='bookmarks_user_link_idx'),
+        ),
+        migrations.RunPython(update_function, restore_function),
+    ]
@@ -1,41 +1,143 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Coalesce, Greatest
 from django.urls import reverse
+from django.utils import timezone
+
+from .utils import normalize_url, url_hash
 
 User = get_user_model()
 
+BOOKMARK_TYPES = ('website', 'article', 'book', 'music', 'video')
+
+
+class BookmarkQuerySet(models.QuerySet):
+    LIST_FIELDS = (
+        'id', 'user_id', 'title', 'url', 'enrichment_status', 'created_at',
+        'link__title', 'link__description', 'link__image', 'link__bookmark_type', 'link__preview_hash',
+    )
+
+    def for_list(self):
+        """Поля, данные ссылки и коллекции, которые нужны спискам закладок, без запроса на каждую строку."""
+        return self.select_related('link').only(*self.LIST_FIELDS).prefetch_related(
+            models.Prefetch('collections', queryset=Collection.objects.only('id', 'title'))
+        ).order_by('-created_at', '-id')
+
+
+class CollectionQuerySet(models.QuerySet):
+    def with_stats(self):
+        """Число закладок и время последнего изменения коллекции или её закладок.
+
+        Подзапросы выполняются только для строк страницы, а не для всех коллекций пользователя.
+        """
+        links = BookmarkCollection.objects.filter(collection=models.OuterRef('pk')).order_by()
+        count = links.values('collection').annotate(count=models.Count('id')).values('count')
+        last_bookmark_update = links.order_by('-bookmark__updated_at').values('bookmark__updated_at')[:1]
+        return self.annotate(
+            bookmarks_count=Coalesce(models.Subquery(count), 0),
+            # Greatest в SQLite возвращает NULL, если NULL хотя бы один аргумент
+            last_updated=Greatest('updated_at', Coalesce(models.Subquery(last_bookmark_update), 'updated_at')),
+        )
+
+    def for_list(self):
+        return self.only('id', 'user_id', 'title', 'description', 'created_at').with_stats().order_by(
+            '-created_at', '-id'
+        )
+
 
 class Bookmark(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Пользователь')
-    title = models.CharField(max_length=200, verbose_name='Заголовок')
-    description = models.TextField(verbose_name='Описание')
+    ENRICHMENT_PENDING = 'pending'
+    ENRICHMENT_DONE = 'done'
+    ENRICHMENT_FAILED = 'failed'
+    ENRICHMENT_CHOICES = [
+        (ENRICHMENT_PENDING, 'Ожидает загрузки'),
+        (ENRICHMENT_DONE, 'Загружено'),
+        (ENRICHMENT_FAILED, 'Ошибка загрузки'),
+    ]
+
+    # Отдельный индекс по user не нужен: его покрывают составные индексы из Meta
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False, verbose_name='Пользователь')
+    # Данные страницы общие для всех пользователей и хранятся в Link, здесь только свой заголовок
+    link = models.ForeignKey('Link', on_delete=models.PROTECT, related_name='bookmarks', verbose_name='Ссылка')
+    title = models.CharField(
+        max_length=200, blank=True, verbose_name='Заголовок', help_text='Пустой — заголовок страницы'
+    )
     url = models.URLField(verbose_name='Ссылка на страницу')
-    bookmark_type = models.CharField(max_length=20, default='website', verbose_name='Тип ссылки')
-    preview_image = models.URLField(verbose_name='Превью')
+    enrichment_status = models.CharField(
+        max_length=10,
+        choices=ENRICHMENT_CHOICES,
+        default=ENRICHMENT_PENDING,
+        verbose_name='Статус загрузки данных'
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Время создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Время изменения')
-    collections = models.ManyToManyField('Collection', related_name='bookmarks', verbose_name='Коллекция')
+    # Заполняется триггером в PostgreSQL, на других СУБД остаётся пустым
+    search_vector = SearchVectorField(null=True, editable=False, verbose_name='Поисковый вектор')
+    collections = models.ManyToManyField(
+        'Collection', through='BookmarkCollection', related_name='bookmarks', verbose_name='Коллекция'
+    )
+
+    objects = BookmarkQuerySet.as_manager()
 
     def __str__(self):
-        return self.title
+        return self.display_title
 
     def get_absolute_url(self):
         return reverse('bookmark', kwargs={'bookmark_id': self.pk})
 
+    def set_url(self, url):
+        self.url = url
+        self.link = Link.objects.for_url(url)
+
+    @property
+    def display_title(self):
+        return self.title or self.link.title or self.url
+
+    @property
+    def description(self):
+        return self.link.description
+
+    @property
+    def preview_image(self):
+        return self.link.image
+
+    @property
+    def bookmark_type(self):
+        return self.link.bookmark_type
+
+    @property
+    def preview_thumbnails(self):
+        """Пары (ширина, адрес) миниатюр превью; пусто, пока миниатюры не готовы."""
+        digest = self.link.preview_hash
+        if not digest:
+            return []
+        return [
+            (width, reverse('preview_image', kwargs={'digest': digest, 'width': width}))
+            for width in settings.BOOKMARKS_PREVIEW_WIDTHS
+        ]
+
     class Meta:
         app_label = 'bookmarks'
         db_table = 'bookmarks'
         verbose_name = 'Закладка'
         verbose_name_plural = 'Закладки'
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='bookmarks_user_created_idx'),
+            models.Index(fields=['user', 'link'], name='bookmarks_user_link_idx'),
+        ]
 
 
 class Collection(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Пользователь')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False, verbose_name='Пользователь')
     title = models.CharField(max_length=200, verbose_name='Название')
     description = models.TextField(verbose_name='Описание')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Время создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Время изменения')
 
+    objects = CollectionQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
@@ -47,3 +149,203 @@ class Collection(models.Model):
         db_table = 'collections'
         verbose_name = 'Коллекция'
         verbose_name_plural = 'Коллекции'
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='collections_user_created_idx'),
+        ]
+
+
+class BookmarkCollection(models.Model):
+    # Поиск по bookmark покрывает уникальный индекс, по collection — составной индекс из Meta
+    bookmark = models.ForeignKey(Bookmark, on_delete=models.CASCADE, db_index=False, verbose_name='Закладка')
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE, db_index=False, verbose_name='Коллекция')
+
+    class Meta:
+        app_label = 'bookmarks'
+        db_table = 'bookmarks_collections'
+        verbose_name = 'Закладка в коллекции'
+        verbose_name_plural = 'Закладки в коллекциях'
+        unique_together = [('bookmark', 'collection')]
+        indexes = [
+            models.Index(fields=['collection', 'bookmark'], name='bookmarks_coll_bookmark_idx'),
+        ]
+
+
+class MetadataJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Выполнено'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    bookmark = models.ForeignKey(
+        Bookmark, on_delete=models.CASCADE, related_name='metadata_jobs', verbose_name='Закладка'
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED, verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попытки')
+    run_after = models.DateTimeField(default=timezone.now, verbose_name='Запуск не раньше')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='Время захвата')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Время создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Время изменения')
+
+    def __str__(self):
+        return f'{self.bookmark_id}: {self.status}'
+
+    class Meta:
+        app_label = 'bookmarks'
+        db_table = 'metadata_jobs'
+        verbose_name = 'Задача загрузки данных'
+        verbose_name_plural = 'Задачи загрузки данных'
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='metadata_jobs_status_run_idx'),
+        ]
+
+
+class LinkQuerySet(models.QuerySet):
+    def for_url(self, url):
+        link, _ = self.get_or_create(url_hash=url_hash(url), defaults={'url': normalize_url(url)})
+        return link
+
+    def for_urls(self, urls):
+        """Записи Link для списка ссылок по хешу; недостающие создаются одним запросом."""
+        normalized = {url_hash(url): normalize_url(url) for url in urls}
+        links = self.in_bulk(list(normalized), field_name='url_hash')
+        missing = normalized.keys() - links.keys()
+        if missing:
+            self.bulk_create(
+                [self.model(url_hash=digest, url=normalized[digest]) for digest in missing], ignore_conflicts=True
+            )
+            links.update(self.in_bulk(list(missing), field_name='url_hash'))
+        return links
+
+
+class Link(models.Model):
+    """Данные страницы, общие для всех закладок с одинаковой нормализованной ссылкой."""
+
+    url_hash = models.CharField(max_length=64, unique=True, verbose_name='Хеш ссылки')
+    url = models.TextField(verbose_name='Ссылка на страницу')
+    title = models.TextField(blank=True, verbose_name='Заголовок')
+    description = models.TextField(blank=True, verbose_name='Описание')
+    image = models.TextField(blank=True, verbose_name='Превью')
+    og_type = models.CharField(max_length=100, blank=True, verbose_name='Тип Open Graph')
+    bookmark_type = models.CharField(max_length=20, default='website', verbose_name='Тип ссылки')
+    is_available = models.BooleanField(default=True, verbose_name='Страница доступна')
+    error = models.TextField(blank=True, verbose_name='Ошибка загрузки')
+    fetched_at = models.DateTimeField(null=True, blank=True, verbose_name='Время загрузки')
+    # Валидаторы ответа для условного запроса при обновлении данных
+    etag = models.CharField(max_length=255, blank=True, verbose_name='ETag')
+    last_modified = models.CharField(max_length=64, blank=True, verbose_name='Last-Modified')
+    # Новая запись сразу считается устаревшей: данные ещё не загружены
+    expires_at = models.DateTimeField(default=timezone.now, verbose_name='Действует до')
+    last_accessed_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name='Последнее обращение')
+    # Миниатюры картинки Open Graph: хеш содержимого скачанной картинки и её адрес на момент обработки
+    preview_hash = models.CharField(max_length=64, blank=True, verbose_name='Хеш превью')
+    preview_source = models.TextField(blank=True, verbose_name='Источник превью')
+
+    objects = LinkQuerySet.as_manager()
+
+    def __str__(self):
+        return self.url
+
+    class Meta:
+        app_label = 'bookmarks'
+        db_table = 'links'
+        verbose_name = 'Ссылка'
+        verbose_name_plural = 'Ссылки'
+        indexes = [
+            models.Index(fields=['fetched_at'], name='links_fetched_idx'),
+        ]
+
+
+class PreviewJob(models.Model):
+    """Задача на миниатюры превью ссылки; запись удаляется после обработки."""
+
+    link = models.OneToOneField(Link, on_delete=models.CASCADE, related_name='preview_job', verbose_name='Ссылка')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попытки')
+    run_after = models.DateTimeField(default=timezone.now, verbose_name='Запуск не раньше')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='Время захвата')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Время создания')
+
+    def __str__(self):
+        return f'{self.link_id}: {self.attempts}'
+
+    class Meta:
+        app_label = 'bookmarks'
+        db_table = 'preview_jobs'
+        verbose_name = 'Задача создания превью'
+        verbose_name_plural = 'Задачи создания превью'
+        indexes = [
+            models.Index(fields=['run_after'], name='preview_jobs_run_after_idx'),
+        ]
+
+
+class ChangeLog(models.Model):
+    """Изменение данных пользователя для синхронизации клиентов; id — токен синхронизации.
+
+    object_id — id закладки или коллекции; у связи закладки с коллекцией это id
+    закладки, а collection_id — id коллекции. Удаление закладки или коллекции
+    означает и удаление её связей: отдельные записи для них не пишутся.
+    """
+
+    KIND_BOOKMARK = 'bookmark'
+    KIND_COLLECTION = 'collection'
+    KIND_MEMBERSHIP = 'membership'
+    KIND_CHOICES = [
+        (KIND_BOOKMARK, 'Закладка'),
+        (KIND_COLLECTION, 'Коллекция'),
+        (KIND_MEMBERSHIP, 'Закладка в коллекции'),
+    ]
+
+    # Удаление пользователя удаляет его закладки, и сигналы пишут сюда записи об этом: ссылка без
+    # ограничения в базе, записи удалённого пользователя удаляет prune_change_log
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, verbose_name='Пользователь'
+    )
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, verbose_name='Объект')
+    object_id = models.BigIntegerField(verbose_name='Id объекта')
+    collection_id = models.BigIntegerField(null=True, blank=True, verbose_name='Id коллекции')
+    deleted = models.BooleanField(default=False, verbose_name='Удалён')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='Время изменения')
+
+    def __str__(self):
+        return f'{self.pk}: {self.kind} {self.object_id}'
+
+    class Meta:
+        app_label = 'bookmarks'
+        db_table = 'change_log'
+        verbose_name = 'Изменение'
+        verbose_name_plural = 'Изменения'
+        indexes = [
+            # Изменения пользователя после токена читаются диапазоном по индексу
+            models.Index(fields=['user', 'id'], name='change_log_user_id_idx'),
+        ]
+
+
+class UserDataVersion(models.Model):
+    """Версия данных пользователя — время последнего изменения в миллисекундах.
+
+    Хранится в базе, а не в кэше процесса: изменения из воркеров и других процессов
+    gunicorn видны всем, а новая версия фиксируется в той же транзакции, что и данные.
+    """
+
+    # Как в ChangeLog: сигналы удаления закладок пользователя пишут сюда новую версию
+    user = models.OneToOneField(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, primary_key=True, related_name='+',
+        verbose_name='Пользователь',
+    )
+    version = models.BigIntegerField(default=0, verbose_name='Версия')
+
+    def __str__(self):
+        return f'{self.user_id}: {self.version}'
+
+    class Meta:
+        app_label = 'bookmarks'
+        db_table = 'user_data_versions'
+        verbose_name = 'Версия данных пользователя'
+        verbose_name_plural = 'Версии данных пользователей'
@@ -0,0 +1,126 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(direction, obj):
+    payload = json.dumps([direction, obj.created_at.isoformat(), obj.pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, created_at, pk = json.loads(payload)
+        created_at = parse_datetime(created_at)
+    except (ValueError, TypeError, binascii.Error):
+        raise InvalidCursor(cursor)
+    if direction not in (NEXT, PREVIOUS) or created_at is None or not isinstance(pk, int):
+        raise InvalidCursor(cursor)
+    return direction, created_at, pk
+
+
+def get_page_size(query_params, default=None):
+    page_size = default or settings.BOOKMARKS_PAGE_SIZE
+    try:
+        page_size = int(query_params.get('page_size', page_size))
+    except (TypeError, ValueError):
+        pass
+    return min(max(page_size, 1), settings.BOOKMARKS_MAX_PAGE_SIZE)
+
+
+class KeysetPage:
+    """Страница по ключу (created_at, id): глубина листания не влияет на стоимость запроса."""
+
+    def __init__(self, queryset, page_size, cursor=None):
+        position = decode_cursor(cursor) if cursor else None
+        backwards = position is not None and position[0] == PREVIOUS
+
+        if position is None:
+            queryset = queryset.order_by('-created_at', '-id')
+        elif backwards:
+            _, created_at, pk = position
+            queryset = queryset.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+            ).order_by('created_at', 'id')
+        else:
+            _, created_at, pk = position
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            ).order_by('-created_at', '-id')
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if backwards:
+            rows.reverse()
+
+        has_next = True if backwards else has_more
+        has_previous = has_more if backwards else position is not None
+        self.object_list = rows
+        self.next_cursor = encode_cursor(NEXT, rows[-1]) if rows and has_next else None
+        self.previous_cursor = encode_cursor(PREVIOUS, rows[0]) if rows and has_previous else None
+
+    def has_other_pages(self):
+        return bool(self.next_cursor or self.previous_cursor)
+
+
+class KeysetPaginationMixin:
+    """Замена постраничного вывода ListView на курсоры для HTML-списков."""
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            page = KeysetPage(
+                queryset, get_page_size(self.request.GET, page_size), self.request.GET.get('cursor')
+            )
+        except InvalidCursor:
+            raise Http404('Некорректный курсор')
+        return None, page, page.object_list, page.has_other_pages()
+
+
+class KeysetPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+    page_size = settings.BOOKMARKS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.BOOKMARKS_MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        try:
+            self.page = KeysetPage(
+                queryset, self.get_page_size(request), request.query_params.get(self.cursor_query_param)
+            )
+        except InvalidCursor:
+            raise NotFound(self.invalid_cursor_message)
+        self.display_page_controls = self.page.has_other_pages()
+        return self.page.object_list
+
+    def get_page_size(self, request):
+        return get_page_size(request.query_params)
+
+    def get_next_link(self):
+        return self._get_link(self.page.next_cursor)
+
+    def get_previous_link(self):
+        return self._get_link(self.page.previous_cursor)
+
+    def _get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
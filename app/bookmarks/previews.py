@@ -0,0 +1,169 @@
+import hashlib
+import io
+import logging
+from datetime import timedelta
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import get_storage_class
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.functional import LazyObject
+from PIL import Image, ImageOps
+
+from .http import ResponseTooLarge, http_client
+from .models import Link, PreviewJob
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidPreview(Exception):
+    """Картинку нельзя превратить в миниатюру: повторная попытка не поможет."""
+
+
+class PreviewStorage(LazyObject):
+    def _setup(self):
+        self._wrapped = get_storage_class(settings.BOOKMARKS_PREVIEW_STORAGE)(
+            **settings.BOOKMARKS_PREVIEW_STORAGE_OPTIONS
+        )
+
+
+preview_storage = PreviewStorage()
+
+
+def thumbnail_name(digest, width):
+    return f'{digest[:2]}/{digest}/{width}.webp'
+
+
+def enqueue_preview(link):
+    """Ставит задачу, если картинка ссылки изменилась с последней обработки и очередь не заполнена."""
+    if not link.image or link.image == link.preview_source:
+        return None
+    if PreviewJob.objects.count() >= settings.BOOKMARKS_PREVIEW_QUEUE_MAX_SIZE:
+        logger.info('Preview queue is full, skipping %s', link.url)
+        return None
+    try:
+        with transaction.atomic():
+            return PreviewJob.objects.create(link=link)
+    except IntegrityError:
+        # Задача для ссылки уже в очереди
+        return None
+
+
+def claim_preview_jobs(limit):
+    now = timezone.now()
+    deadline = now - timedelta(seconds=settings.BOOKMARKS_PREVIEW_JOB_LOCK_TIMEOUT)
+    with transaction.atomic():
+        job_ids = list(
+            PreviewJob.objects
+            .select_for_update(skip_locked=True)
+            # Задачи, захваченные упавшим воркером, снова доступны после таймаута
+            .filter(Q(locked_at__isnull=True) | Q(locked_at__lt=deadline), run_after__lte=now)
+            .order_by('run_after', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        PreviewJob.objects.filter(id__in=job_ids).update(locked_at=now, attempts=F('attempts') + 1)
+    return list(PreviewJob.objects.filter(id__in=job_ids).select_related('link'))
+
+
+def download_image(url):
+    if urlsplit(url).scheme not in ('http', 'https'):
+        raise InvalidPreview(f'Unsupported image URL {url}')
+    max_bytes = settings.BOOKMARKS_PREVIEW_MAX_BYTES
+    with http_client.get(url) as response:
+        if response.status_code != 200:
+            raise InvalidPreview(f'{url} returned {response.status_code}')
+        if not response.headers.get('Content-Type', '').startswith('image/'):
+            raise InvalidPreview(f'{url} is not an image')
+        content_length = response.headers.get('Content-Length', '')
+        if content_length.isdigit() and int(content_length) > max_bytes:
+            raise ResponseTooLarge(f'{url} is {content_length} bytes')
+        data = bytearray()
+        for chunk in http_client.iter_content(response, settings.BOOKMARKS_METADATA_CHUNK_SIZE):
+            data += chunk
+            if len(data) > max_bytes:
+                raise ResponseTooLarge(f'{url} exceeds the preview size limit')
+    return bytes(data)
+
+
+def make_thumbnails(data):
+    """Миниатюры WebP для каждой ширины из BOOKMARKS_PREVIEW_WIDTHS; маленькие картинки не увеличиваются."""
+    widths = settings.BOOKMARKS_PREVIEW_WIDTHS
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Размер известен из заголовка файла: огромную картинку не распаковываем
+            if image.width * image.height > settings.BOOKMARKS_PREVIEW_MAX_PIXELS:
+                raise InvalidPreview(f'Image is {image.width}x{image.height} pixels')
+            # JPEG сразу декодируется в уменьшенном масштабе
+            image.draft('RGB', (max(widths), max(widths) * 2))
+            image = ImageOps.exif_transpose(image)
+            has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as exc:
+        raise InvalidPreview(str(exc) or exc.__class__.__name__)
+
+    thumbnails = {}
+    for width in widths:
+        thumbnail = image.copy()
+        thumbnail.thumbnail((width, width * 2), Image.LANCZOS)
+        output = io.BytesIO()
+        thumbnail.save(output, 'WEBP', quality=settings.BOOKMARKS_PREVIEW_QUALITY, method=4)
+        thumbnails[width] = output.getvalue()
+    return thumbnails
+
+
+def store_thumbnails(data):
+    digest = hashlib.sha256(data).hexdigest()
+    names = {width: thumbnail_name(digest, width) for width in settings.BOOKMARKS_PREVIEW_WIDTHS}
+    missing = {width: name for width, name in names.items() if not preview_storage.exists(name)}
+    if missing:
+        # Одна и та же картинка у разных ссылок обрабатывается один раз
+        thumbnails = make_thumbnails(data)
+        for width, name in missing.items():
+            preview_storage.save(name, ContentFile(thumbnails[width]))
+    return digest
+
+
+def _finish(job, image, digest=''):
+    updated = Link.objects.filter(pk=job.link_id, image=image).update(preview_hash=digest, preview_source=image)
+    if updated:
+        job.delete()
+    else:
+        # Картинка ссылки сменилась во время обработки: задача нужна для новой
+        PreviewJob.objects.filter(pk=job.pk).update(locked_at=None, attempts=0, last_error='')
+
+
+def _retry_or_fail(job, image, error):
+    if job.attempts >= settings.BOOKMARKS_PREVIEW_JOB_MAX_ATTEMPTS:
+        _finish(job, image)
+        return
+    delay = settings.BOOKMARKS_PREVIEW_JOB_RETRY_DELAY * job.attempts
+    PreviewJob.objects.filter(pk=job.pk).update(
+        locked_at=None, last_error=error, run_after=timezone.now() + timedelta(seconds=delay)
+    )
+
+
+def process_preview_job(job):
+    link = job.link
+    image = link.image
+    try:
+        digest = store_thumbnails(download_image(urljoin(link.url, image)))
+    except (InvalidPreview, ResponseTooLarge) as exc:
+        # Ссылка остаётся без миниатюры, пока у неё не сменится картинка
+        logger.info('Preview for %s skipped: %s', link.url, exc)
+        _finish(job, image)
+    except requests.RequestException as exc:
+        logger.warning('Preview download for %s failed: %s', link.url, exc)
+        _retry_or_fail(job, image, str(exc) or exc.__class__.__name__)
+    else:
+        _finish(job, image, digest)
+
+
+def process_preview_jobs(limit=None):
+    jobs = claim_preview_jobs(limit or settings.BOOKMARKS_PREVIEW_JOB_BATCH_SIZE)
+    for job in jobs:
+        process_preview_job(job)
+    return len(jobs)
@@ -0,0 +1,95 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .http import HostRateLimiter
+from .metadata import fetch_open_graph_data, metadata_cache
+from .models import Bookmark, Link
+
+logger = logging.getLogger(__name__)
+
+REFRESH_FIELDS = ('id', 'url', 'title', 'description', 'image', 'og_type', 'etag', 'last_modified', 'fetched_at')
+
+
+def stale_links(limit):
+    """Ссылки с закладками, которые давно не обновлялись; сначала ни разу не загруженные."""
+    threshold = timezone.now() - timedelta(seconds=settings.BOOKMARKS_METADATA_REFRESH_INTERVAL)
+    links = Link.objects.filter(Exists(Bookmark.objects.filter(link=OuterRef('pk')))).only(*REFRESH_FIELDS)
+    batch = list(links.filter(fetched_at__isnull=True).order_by('id')[:limit])
+    if len(batch) < limit:
+        batch += links.filter(fetched_at__lt=threshold).order_by('fetched_at', 'id')[:limit - len(batch)]
+    return batch
+
+
+def is_unchanged(link, og_data):
+    return (
+        link.title == (og_data.get('title') or '')
+        and link.description == (og_data.get('description') or '')
+        and link.image == (og_data.get('image') or '')
+        and link.og_type == (og_data.get('type') or '')[:100]
+    )
+
+
+class MetadataRefresher:
+    """Обновляет данные устаревших ссылок условными запросами с ограничением нагрузки на хосты."""
+
+    def __init__(self, max_workers=None, host_interval=None):
+        self.max_workers = max_workers or settings.BOOKMARKS_METADATA_REFRESH_MAX_WORKERS
+        if host_interval is None:
+            host_interval = settings.BOOKMARKS_METADATA_REFRESH_HOST_INTERVAL
+        self.rate_limiter = HostRateLimiter(host_interval)
+
+    def refresh(self, links):
+        stats = {'not_modified': 0, 'unchanged': 0, 'updated': 0, 'failed': 0}
+        if not links:
+            return stats
+
+        # В потоках только HTTP-запросы, запись в базу остаётся в текущем потоке
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self._fetch, link): link for link in links}
+            for future in as_completed(futures):
+                link = futures[future]
+                try:
+                    result = future.result()
+                except requests.RequestException as exc:
+                    logger.warning('Metadata refresh for %s failed: %s', link.url, exc)
+                    metadata_cache.set(link.url, None, error=str(exc) or exc.__class__.__name__)
+                    stats['failed'] += 1
+                    continue
+                stats[self._apply(link, result)] += 1
+        return stats
+
+    def _fetch(self, link):
+        self.rate_limiter.wait(link.url)
+        return fetch_open_graph_data(link.url, link.etag, link.last_modified)
+
+    def _apply(self, link, result):
+        if result.og_data is None and not result.not_modified:
+            metadata_cache.set(link.url, None, error='Non-200 response', etag='', last_modified='')
+            return 'failed'
+
+        if result.not_modified or is_unchanged(link, result.og_data):
+            # Данные те же: продлеваем срок без сохранения модели, списки пользователей не сбрасываются
+            now = timezone.now()
+            Link.objects.filter(pk=link.pk).update(
+                fetched_at=now,
+                expires_at=now + timedelta(seconds=settings.BOOKMARKS_METADATA_CACHE_TTL),
+                is_available=True,
+                error='',
+                etag=result.etag,
+                last_modified=result.last_modified,
+            )
+            return 'not_modified' if result.not_modified else 'unchanged'
+
+        metadata_cache.set(link.url, result.og_data, etag=result.etag, last_modified=result.last_modified)
+        return 'updated'
+
+
+def refresh_stale_links(limit=None, refresher=None):
+    links = stale_links(limit or settings.BOOKMARKS_METADATA_REFRESH_BATCH_SIZE)
+    return (refresher or MetadataRefresher()).refresh(links)
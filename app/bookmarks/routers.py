@@ -0,0 +1,119 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.template.response import SimpleTemplateResponse
+
+from .caching import get_user_version
+from .instrumentation import render
+
+PIN_COOKIE = 'bookmarks_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_read_state = ContextVar('bookmarks_read_state', default=None)
+
+
+def is_pinned(request):
+    """Пользователь недавно менял данные: реплика могла их ещё не получить."""
+    pin_seconds = settings.BOOKMARKS_REPLICA_PIN_SECONDS
+    try:
+        if int(request.COOKIES.get(PIN_COOKIE, 0)) > time.time():
+            return True
+    except ValueError:
+        pass
+    # Версия данных пользователя — время последнего изменения, в том числе из другого клиента или воркера
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return False
+    return get_user_version(user.pk) > (time.time() - pin_seconds) * 1000
+
+
+class ReadState:
+    """Выбор базы для чтения в рамках запроса: решение принимается при первом запросе к данным закладок."""
+
+    def __init__(self, request):
+        self.request = request
+        self._alias = None
+        self._resolved = False
+
+    @property
+    def alias(self):
+        if not self._resolved:
+            # К этому моменту DRF уже аутентифицировал пользователя
+            replicas = settings.BOOKMARKS_READ_REPLICAS
+            if replicas and not is_pinned(self.request):
+                self._alias = random.choice(replicas)
+            self._resolved = True
+        return self._alias
+
+
+@contextmanager
+def replica_reads(request):
+    token = _read_state.set(ReadState(request))
+    try:
+        yield
+    finally:
+        _read_state.reset(token)
+
+
+class ReplicaRouter:
+    """Чтение данных закладок в представлениях с ReplicaReadMixin идёт на реплику, запись — в default."""
+
+    app_label = 'bookmarks'
+
+    def db_for_read(self, model, **hints):
+        state = _read_state.get()
+        if state is None or model._meta.app_label != self.app_label:
+            # Сессии и пользователи читаются с основной базы: сразу после входа реплика может их не знать
+            return None
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        # Объект, прочитанный с реплики, сохраняется в основную базу
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in settings.BOOKMARKS_READ_REPLICAS:
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.BOOKMARKS_READ_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    """Разрешает представлению читать списки с реплики в безопасных запросах."""
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in SAFE_METHODS or not settings.BOOKMARKS_READ_REPLICAS:
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads(request):
+            response = super().dispatch(request, *args, **kwargs)
+            # Ленивые queryset в шаблоне должны выполниться, пока выбрана реплика
+            if isinstance(response, SimpleTemplateResponse) and not response.is_rendered:
+                render(response)
+        return response
+
+
+class ReplicaPinMiddleware:
+    """После успешного изменения данных браузер клиента какое-то время читает с основной базы."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            settings.BOOKMARKS_READ_REPLICAS
+            and request.method not in SAFE_METHODS
+            and response.status_code < 400
+        ):
+            pin_seconds = settings.BOOKMARKS_REPLICA_PIN_SECONDS
+            response.set_cookie(
+                PIN_COOKIE, str(int(time.time()) + pin_seconds), max_age=pin_seconds, httponly=True, samesite='Lax'
+            )
+        return response
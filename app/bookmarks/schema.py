@@ -0,0 +1,116 @@
+"""Схема OpenAPI: строится один раз на процесс, а не на каждый запрос к /swagger/.
+
+При сборке образа схема сохраняется в файл (generate_openapi_schema) и читается
+из BOOKMARKS_OPENAPI_SCHEMA_FILE; без файла она строится при первом запросе.
+В схеме нет host и schemes: клиенты берут адрес, с которого её получили.
+Страница Swagger UI схему не строит: она загружает её отдельным запросом.
+"""
+import hashlib
+import json
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_safe
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson, yaml_sane_dump
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.renderers import SwaggerUIRenderer
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions
+
+API_VERSION = 'v.0.1'
+
+API_INFO = openapi.Info(
+    title="API for Bookmarks",
+    default_version=API_VERSION,
+    description="API for Bookmarks for test Fruktorum",
+    terms_of_service="https://t.me/mikholand",
+    contact=openapi.Contact(email="mikholand@gmail.com"),
+    license=openapi.License(name="Oleg Mikhno"),
+)
+# Формат, который запрашивает Swagger UI: /swagger/?format=openapi
+SCHEMA_FORMAT = 'openapi'
+JSON_FORMATS = (SCHEMA_FORMAT, '.json')
+YAML_FORMAT = '.yaml'
+UI_FORMAT = 'swagger'
+
+schema_view = get_schema_view(API_INFO, public=True, permission_classes=(permissions.AllowAny,))
+
+
+def generate_schema():
+    schema = OpenAPISchemaGenerator(API_INFO).get_schema(request=None, public=True)
+    return OpenAPICodecJson(validators=[]).encode(schema)
+
+
+def content_etag(content):
+    return f'"{hashlib.sha256(content).hexdigest()}"'
+
+
+@lru_cache(maxsize=None)
+def cached_schema():
+    """Содержимое схемы и её ETag."""
+    path = settings.BOOKMARKS_OPENAPI_SCHEMA_FILE
+    try:
+        with open(path, 'rb') as file:
+            content = file.read()
+    except (FileNotFoundError, IsADirectoryError):
+        content = generate_schema()
+    return content, content_etag(content)
+
+
+@lru_cache(maxsize=None)
+def cached_yaml_schema():
+    """Та же схема в YAML, из кэшированного JSON."""
+    content, _ = cached_schema()
+    content = yaml_sane_dump(json.loads(content, object_pairs_hook=OrderedDict), binary=True)
+    return content, content_etag(content)
+
+
+def schema_response(request, content, etag, content_type):
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type=content_type)
+    response['ETag'] = etag
+    # Схема меняется с выкладкой: клиенты каждый раз сверяют ETag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+class CachedSpecSwaggerUIRenderer(SwaggerUIRenderer):
+    def get_swagger_ui_settings(self):
+        data = super().get_swagger_ui_settings()
+        data.setdefault('url', f"{reverse('schema-swagger-ui')}?format={SCHEMA_FORMAT}")
+        return data
+
+
+def swagger_ui(request):
+    renderer = CachedSpecSwaggerUIRenderer()
+    context = {'request': request}
+    renderer.set_context(context)
+    context.update(title=API_INFO.title, version=API_VERSION)
+    return HttpResponse(render_to_string(renderer.template, context, request))
+
+
+@require_safe
+def swagger(request):
+    format = request.GET.get('format')
+    if format is None:
+        # Как согласование содержимого drf_yasg: браузеру страница, остальным схема
+        if request.accepts('text/html'):
+            format = UI_FORMAT
+        elif request.accepts('application/yaml'):
+            format = YAML_FORMAT
+        else:
+            format = SCHEMA_FORMAT
+    if format == UI_FORMAT:
+        return swagger_ui(request)
+    if format in JSON_FORMATS:
+        return schema_response(request, *cached_schema(), 'application/json')
+    if format == YAML_FORMAT:
+        return schema_response(request, *cached_yaml_schema(), 'application/yaml')
+    raise Http404
@@ -0,0 +1,105 @@
+import re
+import threading
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Count, F, Max
+
+from .models import Bookmark
+
+# Должен совпадать с конфигурацией в триггере из миграции 0006
+SEARCH_CONFIG = 'russian'
+FIELD_WEIGHTS = (('title', 3), ('url', 2), ('description', 1))
+TOKEN_RE = re.compile(r'\w+')
+MAX_CANDIDATES = 1000
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class InvertedIndex:
+    """Индекс закладок одного пользователя в памяти процесса для СУБД без полнотекстового поиска."""
+
+    def __init__(self, rows):
+        self.postings = defaultdict(dict)
+        for row in rows:
+            row = {
+                'id': row['id'],
+                'title': row['title'] or row['link__title'],
+                'url': row['url'],
+                'description': row['link__description'],
+            }
+            for field, weight in FIELD_WEIGHTS:
+                for token in tokenize(row[field] or ''):
+                    scores = self.postings[token]
+                    scores[row['id']] = scores.get(row['id'], 0) + weight
+
+    def search(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        postings = sorted((self.postings.get(token, {}) for token in set(tokens)), key=len)
+        scores = dict(postings[0])
+        for token_scores in postings[1:]:
+            scores = {pk: score + token_scores[pk] for pk, score in scores.items() if pk in token_scores}
+        return sorted(scores, key=lambda pk: (-scores[pk], -pk))
+
+
+class InvertedIndexCache:
+    def __init__(self):
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user):
+        # Отпечаток меняется при добавлении, удалении и изменении закладок пользователя и их ссылок
+        stamp = tuple(
+            Bookmark.objects.filter(user=user)
+            .aggregate(Count('id'), Max('updated_at'), Max('link__fetched_at'))
+            .values()
+        )
+        with self._lock:
+            cached = self._indexes.get(user.pk)
+            if cached and cached[0] == stamp:
+                self._indexes.move_to_end(user.pk)
+                return cached[1]
+
+        rows = (
+            Bookmark.objects.filter(user=user)
+            .values('id', 'title', 'url', 'link__title', 'link__description')
+            .iterator()
+        )
+        index = InvertedIndex(rows)
+        with self._lock:
+            self._indexes[user.pk] = (stamp, index)
+            while len(self._indexes) > settings.BOOKMARKS_SEARCH_INDEX_MAX_USERS:
+                self._indexes.popitem(last=False)
+        return index
+
+
+inverted_indexes = InvertedIndexCache()
+
+
+def search_bookmarks(user, query, bookmark_type=None, collection_id=None, limit=None):
+    limit = limit or settings.BOOKMARKS_PAGE_SIZE
+    queryset = Bookmark.objects.filter(user=user)
+    if bookmark_type:
+        queryset = queryset.filter(link__bookmark_type=bookmark_type)
+    if collection_id:
+        queryset = queryset.filter(collections__id=collection_id)
+
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        return list(
+            queryset.filter(search_vector=search_query)
+            .for_list()
+            .annotate(rank=SearchRank(F('search_vector'), search_query))
+            .order_by('-rank', '-created_at', '-id')[:limit]
+        )
+
+    candidates = inverted_indexes.get(user).search(query)[:MAX_CANDIDATES]
+    bookmarks = queryset.filter(id__in=candidates).for_list().in_bulk()
+    return [bookmarks[pk] for pk in candidates if pk in bookmarks][:limit]
@@ -1,18 +1,28 @@
+import requests
+from django.conf import settings
 from rest_framework import serializers
 
+from .jobs import enqueue_metadata_job
+from .metadata import MetadataResolver, apply_open_graph_data
 from .models import Bookmark, Collection
 
 
 class BookmarkSerializer(serializers.ModelSerializer):
+    title = serializers.CharField(source='display_title', read_only=True)
+
     class Meta:
         model = Bookmark
-        fields = ['id', 'title', 'description', 'url', 'bookmark_type', 'collections']
+        fields = ['id', 'title', 'description', 'url', 'bookmark_type', 'enrichment_status', 'collections']
 
 
 class CollectionSerializer(serializers.ModelSerializer):
+    # Заполняются аннотациями Collection.objects.with_stats()
+    bookmarks_count = serializers.IntegerField(read_only=True)
+    last_updated = serializers.DateTimeField(read_only=True)
+
     class Meta:
         model = Collection
-        fields = ['id', 'title', 'description']
+        fields = ['id', 'title', 'description', 'bookmarks_count', 'last_updated']
 
 
 class BookmarkRequestSerializer(serializers.ModelSerializer):
@@ -20,26 +30,56 @@ class BookmarkRequestSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Bookmark
-        fields = ['url', 'collections']
+        fields = ['url', 'title', 'collections']
 
     def create(self, validated_data):
-        from .views import check_og_type, get_open_graph_data
-        url = validated_data.get('url')
-        collections = validated_data.get('collections', [])
-        og_data = get_open_graph_data(url)
-
-        if og_data:
-            validated_data['title'] = og_data.get('title', '')
-            validated_data['description'] = og_data.get('description', '')
-            validated_data['preview_image'] = og_data.get('image', '')
-            validated_data['bookmark_type'] = check_og_type(og_data.get('type', ''))
-            validated_data['url'] = url
-
         collections = validated_data.pop('collections', [])  # Удаляем 'collections' из validated_data
-        bookmark = Bookmark.objects.create(**validated_data)
+        bookmark = Bookmark(**validated_data)
+        bookmark.set_url(bookmark.url)
+        # Данные, не загруженные заранее, загружает воркер, пока вместо заголовка показываем ссылку
+        resolved = self.apply_metadata(bookmark, fetch=False)
+        bookmark.save()
         bookmark.collections.set(collections)
+        if not resolved:
+            enqueue_metadata_job(bookmark)
         return bookmark
 
+    def update(self, instance, validated_data):
+        url = validated_data.pop('url', instance.url)
+        if url == instance.url:
+            # Ссылка не менялась: данные страницы не загружаем, их обновляет refresh_metadata
+            return super().update(instance, validated_data)
+
+        instance.set_url(url)
+        resolved = self.apply_metadata(instance, fetch=self.context.get('fetch_metadata', True))
+        if not resolved:
+            # Сайт недоступен: сохраняем изменения, а данные догрузит воркер
+            instance.enrichment_status = Bookmark.ENRICHMENT_PENDING
+        instance = super().update(instance, validated_data)
+        if not resolved:
+            enqueue_metadata_job(instance)
+        return instance
+
+    def apply_metadata(self, bookmark, fetch=True):
+        """Переносит данные страницы на закладку; без fetch только уже загруженные резолвером."""
+        resolver = self.get_metadata_resolver()
+        if not fetch and not resolver.is_resolved(bookmark.url):
+            return False
+        try:
+            og_data = resolver.resolve(bookmark.url)
+        except requests.RequestException:
+            return False
+
+        if og_data:
+            apply_open_graph_data(bookmark, og_data)
+            bookmark.enrichment_status = Bookmark.ENRICHMENT_DONE
+        else:
+            bookmark.enrichment_status = Bookmark.ENRICHMENT_FAILED
+        return True
+
+    def get_metadata_resolver(self):
+        return self.context.setdefault('metadata_resolver', MetadataResolver())
+
 
 class CollectionRequestSerializer(serializers.ModelSerializer):
     class Meta:
@@ -49,3 +89,88 @@ class CollectionRequestSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         collection = Collection.objects.create(**validated_data)
         return collection
+
+
+class CollectionRefField(serializers.Field):
+    """Коллекция в записи импорта: id (число) или название (строка)."""
+
+    default_error_messages = {'invalid': 'Ожидается id или название коллекции.'}
+    MAX_ID = 2 ** 63 - 1
+
+    def to_internal_value(self, data):
+        if isinstance(data, int) and not isinstance(data, bool) and 0 < data <= self.MAX_ID:
+            return data
+        if isinstance(data, str) and data.strip():
+            return data.strip()[:Collection._meta.get_field('title').max_length]
+        self.fail('invalid')
+
+    def to_representation(self, value):
+        return value
+
+
+class BookmarkImportItemSerializer(serializers.Serializer):
+    url = serializers.URLField(max_length=Bookmark._meta.get_field('url').max_length)
+    title = serializers.CharField(required=False, allow_blank=True)
+    description = serializers.CharField(required=False, allow_blank=True)
+    preview_image = serializers.CharField(required=False, allow_blank=True)
+    bookmark_type = serializers.CharField(required=False, allow_blank=True)
+    collections = serializers.ListField(
+        child=CollectionRefField(), required=False, help_text='id или названия коллекций'
+    )
+
+
+class BookmarkImportResultSerializer(serializers.Serializer):
+    url = serializers.CharField()
+    status = serializers.ChoiceField(choices=['created', 'duplicate', 'exists', 'invalid'])
+    id = serializers.IntegerField(required=False)
+    enrichment_status = serializers.CharField(required=False)
+    error = serializers.CharField(required=False)
+
+
+class BookmarkImportResponseSerializer(serializers.Serializer):
+    created = serializers.IntegerField()
+    results = BookmarkImportResultSerializer(many=True)
+
+
+class BookmarkBatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False)
+
+    def validate_ids(self, ids):
+        if len(ids) > settings.BOOKMARKS_BATCH_MAX_IDS:
+            raise serializers.ValidationError(f'Не больше {settings.BOOKMARKS_BATCH_MAX_IDS} закладок за один запрос')
+        return list(dict.fromkeys(ids))
+
+
+class BookmarkCollectionBatchSerializer(BookmarkBatchSerializer):
+    collection = serializers.PrimaryKeyRelatedField(queryset=Collection.objects.all())
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Чужая коллекция считается несуществующей
+        request = self.context.get('request')
+        if request is not None:
+            self.fields['collection'].queryset = Collection.objects.filter(user=request.user)
+
+
+class BookmarkBatchResponseSerializer(serializers.Serializer):
+    count = serializers.IntegerField(help_text='Число удалённых, добавленных или убранных из коллекции закладок')
+
+
+class MembershipSerializer(serializers.Serializer):
+    bookmark = serializers.IntegerField()
+    collection = serializers.IntegerField()
+
+
+class SyncDeletedSerializer(serializers.Serializer):
+    bookmarks = serializers.ListField(child=serializers.IntegerField())
+    collections = serializers.ListField(child=serializers.IntegerField())
+    memberships = MembershipSerializer(many=True)
+
+
+class SyncResponseSerializer(serializers.Serializer):
+    token = serializers.CharField(help_text='Передаётся в since следующего запроса')
+    has_more = serializers.BooleanField(help_text='Есть ещё изменения: повторить запрос с новым токеном')
+    bookmarks = BookmarkSerializer(many=True)
+    collections = CollectionSerializer(many=True)
+    memberships = MembershipSerializer(many=True)
+    deleted = SyncDeletedSerializer()
@@ -0,0 +1,57 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import bump_user_version, bump_user_versions
+from .changes import MODEL_KINDS, record_changes, record_memberships, record_selected
+from .models import Bookmark, BookmarkCollection, ChangeLog, Collection, Link
+
+
+@receiver(post_save, sender=Bookmark)
+@receiver(post_delete, sender=Bookmark)
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def invalidate_user_lists(sender, instance, **kwargs):
+    bump_user_version(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Bookmark.collections.through)
+def invalidate_on_collections_change(sender, instance, action, **kwargs):
+    # instance — закладка или коллекция, в зависимости от стороны связи
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_user_version(instance.user_id)
+
+
+@receiver(post_save, sender=Link)
+def invalidate_on_link_change(sender, instance, created, **kwargs):
+    # Данные ссылки общие: сбрасываем списки всех пользователей, у которых она сохранена
+    if created:
+        return
+    bump_user_versions(Bookmark.objects.filter(link=instance).values_list('user_id', flat=True).distinct())
+    # Данные страницы входят в закладку, которую получают клиенты синхронизации
+    record_selected(Bookmark.objects.filter(link=instance), ChangeLog.KIND_BOOKMARK)
+
+
+@receiver(post_save, sender=Bookmark)
+@receiver(post_save, sender=Collection)
+def log_save(sender, instance, **kwargs):
+    record_changes(instance.user_id, MODEL_KINDS[sender], [instance.pk])
+
+
+@receiver(post_delete, sender=Bookmark)
+@receiver(post_delete, sender=Collection)
+def log_delete(sender, instance, **kwargs):
+    record_changes(instance.user_id, MODEL_KINDS[sender], [instance.pk], deleted=True)
+
+
+@receiver(m2m_changed, sender=Bookmark.collections.through)
+def log_collections_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # Какие связи удалит clear(), известно только до удаления
+        memberships = BookmarkCollection.objects.filter(**{'collection' if reverse else 'bookmark': instance})
+        record_selected(
+            memberships, ChangeLog.KIND_MEMBERSHIP, deleted=True,
+            user='bookmark__user_id', object_id='bookmark_id', collection_id='collection_id',
+        )
+    elif action in ('post_add', 'post_remove') and pk_set:
+        pairs = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+        record_memberships(instance.user_id, pairs, deleted=action == 'post_remove')
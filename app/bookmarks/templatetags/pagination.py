@@ -0,0 +1,11 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def cursor_url(context, cursor):
+    """Адрес той же страницы с другим курсором: размер страницы и фильтры сохраняются."""
+    query = context['request'].GET.copy()
+    query['cursor'] = cursor
+    return f'?{query.urlencode()}'
@@ -1,3 +1,1565 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import httpx
+import requests
+from asgiref.sync import async_to_sync
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import escape
+from drf_yasg.codecs import yaml_sane_load
+from drf_yasg.generators import OpenAPISchemaGenerator
+from PIL import Image
+from rest_framework import serializers
+
+from .caching import bump_user_version, get_cache, get_user_version
+from .changes import prune_change_log
+from .http import AsyncFetchClient, AsyncFetchError, FetchClient, HostBusy, ResponseTooLarge, async_http_client
+from .jobs import claim_jobs, process_pending_jobs, prune_finished_jobs, release_stale_jobs
+from .metadata import (
+    MetadataResolver,
+    MetadataUnavailable,
+    aget_open_graph_data,
+    get_open_graph_data,
+    metadata_cache,
+)
+from .models import Bookmark, Collection, Link, MetadataJob, PreviewJob, UserDataVersion
+from .previews import preview_storage, process_preview_jobs, thumbnail_name
+from .refresh import MetadataRefresher, refresh_stale_links, stale_links
+from .routers import PIN_COOKIE, ReplicaPinMiddleware, ReplicaRouter, replica_reads
+from .schema import cached_schema, cached_yaml_schema, generate_schema, schema_view
+from .utils import normalize_url, url_hash
+
+User = get_user_model()
+
+OG_DATA = {
+    'title': 'Example',
+    'description': 'Example page',
+    'image': 'https://example.com/image.png',
+    'type': 'article',
+}
+
+
+class BookmarkTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com', password='password')
+        self.client.force_login(self.user)
+        patcher = mock.patch('bookmarks.metadata.get_open_graph_data', return_value=OG_DATA)
+        self.fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+        metadata_cache.cache.clear()
+
+    def create_bookmark(self, url='https://example.com/', **kwargs):
+        link = Link.objects.for_url(url)
+        link_fields = {field: kwargs.pop(field) for field in ('description', 'bookmark_type') if field in kwargs}
+        if link_fields:
+            Link.objects.filter(pk=link.pk).update(**link_fields)
+            link.refresh_from_db()
+        return Bookmark.objects.create(user=self.user, url=url, link=link, **kwargs)
+
+
+class MetadataFetchCountTests(BookmarkTestCase):
+    def test_api_create_defers_fetch_to_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('api_add_bookmark'), {'url': 'https://example.com/'})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.fetch.call_count, 0)
+        bookmark = Bookmark.objects.get()
+        self.assertEqual(bookmark.enrichment_status, Bookmark.ENRICHMENT_PENDING)
+
+        process_pending_jobs()
+
+        self.assertEqual(self.fetch.call_count, 1)
+        bookmark.refresh_from_db()
+        self.assertEqual(bookmark.display_title, 'Example')
+        self.assertEqual(bookmark.bookmark_type, 'article')
+        self.assertEqual(bookmark.enrichment_status, Bookmark.ENRICHMENT_DONE)
+
+    def test_api_update_fetches_once(self):
+        bookmark = self.create_bookmark()
+
+        response = self.client.put(
+            reverse('api_update_bookmark', kwargs={'pk': bookmark.pk}),
+            {'url': 'https://example.org/'},
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.fetch.assert_called_once_with('https://example.org/')
+        bookmark.refresh_from_db()
+        self.assertEqual(bookmark.link.url, 'https://example.org/')
+        self.assertEqual(bookmark.display_title, 'Example')
+
+    def test_api_update_enqueues_after_save(self):
+        bookmark = self.create_bookmark(enrichment_status=Bookmark.ENRICHMENT_DONE)
+        self.fetch.side_effect = requests.ConnectionError('refused')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.put(
+                reverse('api_update_bookmark', kwargs={'pk': bookmark.pk}),
+                {'url': 'https://example.org/'},
+                content_type='application/json',
+            )
+        # До фиксации задачи нет, а закладка уже сохранена с новой ссылкой
+        self.assertFalse(MetadataJob.objects.exists())
+        bookmark.refresh_from_db()
+        self.assertEqual(bookmark.url, 'https://example.org/')
+        self.assertEqual(bookmark.enrichment_status, Bookmark.ENRICHMENT_PENDING)
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(MetadataJob.objects.get().bookmark_id, bookmark.pk)
+
+    def test_worker_fetches_each_url_once_per_batch(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                self.client.post(reverse('api_add_bookmark'), {'url': 'https://example.com/'})
+
+        process_pending_jobs()
+
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertFalse(Bookmark.objects.exclude(enrichment_status=Bookmark.ENRICHMENT_DONE).exists())
+
+
+class MetadataJobTests(BookmarkTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bookmark = self.create_bookmark(enrichment_status=Bookmark.ENRICHMENT_PENDING)
+        self.job = MetadataJob.objects.create(bookmark=self.bookmark)
+
+    def test_claim_locks_due_jobs(self):
+        later = MetadataJob.objects.create(bookmark=self.bookmark, run_after=timezone.now() + timedelta(hours=1))
+
+        self.assertEqual([job.pk for job in claim_jobs(10)], [self.job.pk])
+        self.assertEqual(claim_jobs(10), [])
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, MetadataJob.STATUS_RUNNING)
+        self.assertEqual(self.job.attempts, 1)
+        self.assertIsNotNone(self.job.locked_at)
+        later.refresh_from_db()
+        self.assertEqual(later.status, MetadataJob.STATUS_QUEUED)
+
+    def test_release_stale_jobs(self):
+        claim_jobs(10)
+        MetadataJob.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(release_stale_jobs(), 1)
+        self.assertEqual([job.pk for job in claim_jobs(10)], [self.job.pk])
+
+    def test_fetch_error_retries_then_fails(self):
+        self.fetch.side_effect = requests.ConnectionError('refused')
+
+        process_pending_jobs()
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, MetadataJob.STATUS_QUEUED)
+        self.assertEqual(self.job.last_error, 'refused')
+        self.assertGreater(self.job.run_after, timezone.now())
+        self.assertEqual(claim_jobs(10), [])
+
+        with self.settings(BOOKMARKS_METADATA_JOB_MAX_ATTEMPTS=2):
+            MetadataJob.objects.update(run_after=timezone.now())
+            process_pending_jobs()
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, MetadataJob.STATUS_FAILED)
+        self.assertEqual(self.job.attempts, 2)
+        self.bookmark.refresh_from_db()
+        self.assertEqual(self.bookmark.enrichment_status, Bookmark.ENRICHMENT_FAILED)
+
+    def test_prune_finished_jobs(self):
+        process_pending_jobs()
+        queued = MetadataJob.objects.create(bookmark=self.bookmark)
+        MetadataJob.objects.update(updated_at=timezone.now() - timedelta(days=8))
+
+        self.assertEqual(prune_finished_jobs(7), 1)
+        self.assertEqual(list(MetadataJob.objects.values_list('pk', flat=True)), [queued.pk])
+
+    def test_worker_command_processes_one_batch(self):
+        out = io.StringIO()
+        # Соединение теста живёт внутри транзакции TestCase, закрывать его нельзя
+        with mock.patch('bookmarks.management.worker.close_old_connections'):
+            call_command('process_metadata_jobs', once=True, stdout=out)
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, MetadataJob.STATUS_DONE)
+        self.assertIn('Обработано задач: 1', out.getvalue())
+
+
+class AsyncAPITests(BookmarkTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('bookmarks.metadata.aget_open_graph_data', new_callable=mock.AsyncMock, return_value=OG_DATA)
+        self.afetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_create_fetches_inline(self):
+        response = self.client.post(
+            reverse('api_async_add_bookmark'), {'url': 'https://example.com/'}, content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['title'], 'Example')
+        self.afetch.assert_awaited_once_with('https://example.com/')
+        self.assertEqual(self.fetch.call_count, 0)
+        self.assertEqual(Bookmark.objects.get().enrichment_status, Bookmark.ENRICHMENT_DONE)
+        self.assertFalse(MetadataJob.objects.exists())
+
+    def test_create_defers_slow_site_to_worker(self):
+        async def slow_fetch(url):
+            await asyncio.sleep(1)
+            return OG_DATA
+
+        self.afetch.side_effect = slow_fetch
+        with self.settings(BOOKMARKS_ASYNC_INLINE_FETCH_TIMEOUT=0.01), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('api_async_add_bookmark'), {'url': 'https://example.com/'}, content_type='application/json'
+            )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['enrichment_status'], Bookmark.ENRICHMENT_PENDING)
+        self.assertTrue(MetadataJob.objects.filter(bookmark_id=response.json()['id']).exists())
+
+    def test_update_fetches_only_changed_url(self):
+        bookmark = self.create_bookmark()
+        url = reverse('api_async_update_bookmark', kwargs={'pk': bookmark.pk})
+
+        response = self.client.patch(url, {'title': 'Своё'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.afetch.await_count, 0)
+
+        response = self.client.put(url, {'url': 'https://example.org/'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.afetch.assert_awaited_once_with('https://example.org/')
+        bookmark.refresh_from_db()
+        self.assertEqual(bookmark.link.title, 'Example')
+        self.assertEqual(bookmark.display_title, 'Своё')
+
+    def test_bulk_import(self):
+        response = self.client.post(
+            reverse('api_async_bulk_bookmarks'),
+            ['https://example.com/a', 'https://example.com/b', 'https://example.com/a'],
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual(self.afetch.await_count, 2)
+        self.assertEqual(self.fetch.call_count, 0)
+
+    def test_requires_authentication(self):
+        self.client.logout()
+
+        response = self.client.post(
+            reverse('api_async_add_bookmark'), {'url': 'https://example.com/'}, content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Bookmark.objects.exists())
+
+
+class MetadataCacheTests(BookmarkTestCase):
+    def test_cache_is_shared_between_requests(self):
+        MetadataResolver().resolve('https://Example.com/page#intro')
+        og_data = MetadataResolver().resolve('https://example.com:443/page')
+
+        self.assertEqual(og_data, OG_DATA)
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertEqual(metadata_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_database_fallback(self):
+        MetadataResolver().resolve('https://example.com/')
+        metadata_cache.cache.clear()
+
+        self.assertEqual(MetadataResolver().resolve('https://example.com/'), OG_DATA)
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_failures_are_cached(self):
+        self.fetch.return_value = None
+        self.assertIsNone(MetadataResolver().resolve('https://example.com/missing'))
+        self.assertIsNone(MetadataResolver().resolve('https://example.com/missing'))
+
+        self.fetch.side_effect = requests.Timeout('timed out')
+        with self.assertRaises(requests.Timeout):
+            MetadataResolver().resolve('https://slow.example.com/')
+        with self.assertRaises(MetadataUnavailable):
+            MetadataResolver().resolve('https://slow.example.com/')
+
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_size_bound_evicts_least_recently_used(self):
+        with self.settings(BOOKMARKS_METADATA_CACHE_MAX_ENTRIES=2, BOOKMARKS_METADATA_CACHE_CULL_SAMPLE_RATE=1):
+            for path in ('a', 'b', 'c'):
+                MetadataResolver().resolve(f'https://example.com/{path}')
+
+        self.assertEqual(
+            sorted(Link.objects.values_list('url', flat=True)),
+            ['https://example.com/b', 'https://example.com/c'],
+        )
+
+    def test_size_is_checked_on_a_sample_of_stores(self):
+        with self.settings(BOOKMARKS_METADATA_CACHE_MAX_ENTRIES=1, BOOKMARKS_METADATA_CACHE_CULL_SAMPLE_RATE=0):
+            for path in ('a', 'b'):
+                MetadataResolver().resolve(f'https://example.com/{path}')
+
+        self.assertEqual(Link.objects.count(), 2)
+
+    def test_only_changed_data_invalidates_owners(self):
+        bookmark = self.create_bookmark()
+        metadata_cache.set(bookmark.url, OG_DATA)
+        version = get_user_version(self.user.pk)
+
+        metadata_cache.set(bookmark.url, OG_DATA)
+        metadata_cache.set(bookmark.url, None, error='refused')
+
+        self.assertEqual(get_user_version(self.user.pk), version)
+        link = Link.objects.get()
+        self.assertEqual((link.title, link.error), (OG_DATA['title'], 'refused'))
+
+        metadata_cache.set(bookmark.url, dict(OG_DATA, title='Changed'))
+        self.assertGreater(get_user_version(self.user.pk), version)
+
+
+class FakeResponse:
+    def __init__(self, body=b'', content_type='text/html', status_code=200):
+        self.status_code = status_code
+        self.headers = {'Content-Type': content_type}
+        self.encoding = 'utf-8'
+        self.body = body
+        self.bytes_read = 0
+
+    def close(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            self.bytes_read += len(self.body[start:start + chunk_size])
+            yield self.body[start:start + chunk_size]
+
+
+class OpenGraphParserTests(TestCase):
+    def fetch(self, response):
+        with mock.patch('requests.Session.get', return_value=response):
+            return get_open_graph_data('https://example.com/')
+
+    def test_stops_reading_after_head(self):
+        head = (
+            '<html><head><meta charset="windows-1251"><title> Страница </title>'
+            '<meta property="og:type" content="video.movie">'
+            '<meta name="description" content="Описание"></head>'
+        ).encode('windows-1251')
+        response = FakeResponse(head + b'<body>' + b'x' * 1024 * 1024, content_type='text/html')
+
+        with self.settings(BOOKMARKS_METADATA_CHUNK_SIZE=64):
+            og_data = self.fetch(response)
+
+        self.assertEqual(og_data, {'title': 'Страница', 'description': 'Описание', 'image': '', 'type': 'video.movie'})
+        self.assertLess(response.bytes_read, len(head) + 64)
+
+    def test_skips_non_html_body(self):
+        response = FakeResponse(b'\x00' * 1024, content_type='video/mp4')
+
+        og_data = self.fetch(response)
+
+        self.assertEqual(og_data['type'], 'video/mp4')
+        self.assertEqual(response.bytes_read, 0)
+
+    def test_async_fetch_uses_declared_charset(self):
+        body = '<html><head><title>Страница</title></head><body>'.encode('windows-1251') + b'x' * 1024
+        transport = httpx.MockTransport(lambda request: httpx.Response(
+            200, headers={'Content-Type': 'text/html; charset=windows-1251'}, content=body
+        ))
+
+        with mock.patch.object(async_http_client, 'transport', transport):
+            og_data = async_to_sync(aget_open_graph_data)('https://example.com/')
+
+        self.assertEqual(og_data['title'], 'Страница')
+
+
+class FetchHandler(BaseHTTPRequestHandler):
+    """Страницы для проверки ограничений клиента; hits — число запросов к каждому пути."""
+
+    hits = Counter()
+
+    def do_GET(self):
+        self.hits[self.path] += 1
+        if self.path == '/loop':
+            self.send_response(302)
+            self.send_header('Location', '/loop')
+            self.end_headers()
+        elif self.path == '/flaky' and self.hits[self.path] < 3:
+            self.send_error(503)
+        elif self.path == '/big':
+            self.send_response(200)
+            self.send_header('Content-Length', '2048')
+            self.end_headers()
+            self.wfile.write(b'x' * 2048)
+        elif self.path == '/stream':
+            # Без Content-Length: тело заканчивается закрытием соединения
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b'x' * 2048)
+        else:
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'ok')
+
+    def log_message(self, format, *args):
+        pass
+
+
+@override_settings(
+    BOOKMARKS_FETCH_MAX_RESPONSE_BYTES=1024, BOOKMARKS_FETCH_MAX_REDIRECTS=3, BOOKMARKS_FETCH_RETRIES=2,
+    BOOKMARKS_FETCH_BACKOFF_FACTOR=0, BOOKMARKS_FETCH_MAX_PER_HOST=1, BOOKMARKS_FETCH_HOST_WAIT_TIMEOUT=0.01,
+)
+class FetchClientTests(TestCase):
+    def setUp(self):
+        FetchHandler.hits = Counter()
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FetchHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        self.client = FetchClient()
+
+    def fetch(self, path):
+        with self.client.get(self.base_url + path) as response:
+            return b''.join(self.client.iter_content(response, 256))
+
+    def test_rejects_large_responses(self):
+        # Семафоры хранятся по слабым ссылкам: держим свой, чтобы проверить его освобождение
+        semaphore = self.client._host_semaphore('127.0.0.1')
+        with self.assertRaises(ResponseTooLarge):
+            # По Content-Length, ещё до чтения тела
+            with self.client.get(self.base_url + '/big'):
+                pass
+        with self.assertRaises(ResponseTooLarge):
+            self.fetch('/stream')
+        self.assertTrue(semaphore.acquire(blocking=False))
+        semaphore.release()
+
+    def test_redirect_limit(self):
+        with self.assertRaises(requests.TooManyRedirects):
+            self.fetch('/loop')
+        self.assertEqual(FetchHandler.hits['/loop'], 4)
+
+    def test_retries_server_errors(self):
+        self.assertEqual(self.fetch('/flaky'), b'ok')
+        self.assertEqual(FetchHandler.hits['/flaky'], 3)
+
+    def test_concurrent_requests_per_host(self):
+        semaphore = self.client._host_semaphore('127.0.0.1')
+        with self.client.get(self.base_url + '/'):
+            with self.assertRaises(HostBusy):
+                self.fetch('/')
+        self.assertTrue(semaphore.acquire(blocking=False))
+        semaphore.release()
+
+
+@override_settings(
+    BOOKMARKS_FETCH_MAX_RESPONSE_BYTES=1024, BOOKMARKS_FETCH_MAX_REDIRECTS=3,
+    BOOKMARKS_FETCH_MAX_PER_HOST=1, BOOKMARKS_FETCH_HOST_WAIT_TIMEOUT=0.01,
+)
+class AsyncFetchClientTests(TestCase):
+    def setUp(self):
+        self.client = AsyncFetchClient()
+        self.client.transport = httpx.MockTransport(self.respond)
+        self.hits = Counter()
+
+    def respond(self, request):
+        self.hits[request.url.path] += 1
+        if request.url.path == '/loop':
+            return httpx.Response(302, headers={'Location': '/loop'})
+        if request.url.path == '/big':
+            return httpx.Response(200, content=b'x' * 2048)
+        if request.url.path == '/stream':
+            async def chunks():
+                for _ in range(4):
+                    yield b'x' * 512
+            return httpx.Response(200, content=chunks())
+        return httpx.Response(200, content=b'ok')
+
+    async def fetch(self, path):
+        async with self.client.get('https://example.com' + path) as response:
+            return b''.join([chunk async for chunk in self.client.aiter_content(response, 256)])
+
+    def test_rejects_large_responses(self):
+        async def run():
+            semaphore = self.client._host_semaphore('example.com')
+            with self.assertRaises(ResponseTooLarge):
+                async with self.client.get('https://example.com/big'):
+                    pass
+            with self.assertRaises(ResponseTooLarge):
+                await self.fetch('/stream')
+            self.assertFalse(semaphore.locked())
+
+        async_to_sync(run)()
+
+    def test_redirect_limit(self):
+        with self.assertRaisesMessage(AsyncFetchError, 'redirects'):
+            async_to_sync(self.fetch)('/loop')
+        self.assertEqual(self.hits['/loop'], 4)
+
+    def test_concurrent_requests_per_host(self):
+        async def run():
+            semaphore = self.client._host_semaphore('example.com')
+            async with self.client.get('https://example.com/'):
+                with self.assertRaises(HostBusy):
+                    await self.fetch('/')
+            self.assertFalse(semaphore.locked())
+
+        async_to_sync(run)()
+
+
+NETSCAPE_EXPORT = """<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<TITLE>Bookmarks</TITLE>
+<DL><p>
+    <DT><H3>Чтение</H3>
+    <DL><p>
+        <DT><A HREF="https://example.com/a">A</A>
+        <DD>Про A
+        <DT><A HREF="https://example.com/b">B</A>
+    </DL><p>
+    <DT><H3>Музыка</H3>
+    <DL><p>
+        <DT><A HREF="https://example.com/a">A again</A>
+    </DL><p>
+    <DT><A HREF="not a url">broken</A>
+</DL><p>
+"""
+
+
+def make_image(size, image_format='PNG'):
+    output = io.BytesIO()
+    Image.new('RGB', size, 'teal').save(output, image_format)
+    return output.getvalue()
+
+
+class PreviewTests(BookmarkTestCase):
+    def setUp(self):
+        super().setUp()
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        patcher = mock.patch.object(preview_storage, '_wrapped', FileSystemStorage(location=location))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bookmark = self.create_bookmark()
+        self.link = self.bookmark.link
+
+    def resolve(self, image='https://cdn.example.com/og.png'):
+        metadata_cache.set(self.link.url, dict(OG_DATA, image=image))
+
+    def process(self, body, content_type='image/png'):
+        with mock.patch('requests.Session.get', return_value=FakeResponse(body, content_type)) as get:
+            process_preview_jobs()
+        self.link.refresh_from_db()
+        return get
+
+    def test_worker_command_enqueues_missing(self):
+        Link.objects.filter(pk=self.link.pk).update(image='https://cdn.example.com/og.png')
+        out = io.StringIO()
+        with mock.patch('requests.Session.get', return_value=FakeResponse(make_image((800, 600)), 'image/png')), \
+                mock.patch('bookmarks.management.worker.close_old_connections'):
+            call_command('process_preview_jobs', once=True, enqueue_missing=True, stdout=out)
+
+        self.link.refresh_from_db()
+        self.assertTrue(self.link.preview_hash)
+        self.assertIn('Поставлено в очередь: 1', out.getvalue())
+        self.assertIn('Обработано задач: 1', out.getvalue())
+
+    def test_thumbnails_are_generated_once_per_image(self):
+        self.resolve()
+        self.resolve()
+        self.assertEqual(PreviewJob.objects.count(), 1)
+
+        get = self.process(make_image((1600, 800)))
+
+        get.assert_called_once()
+        self.assertEqual(get.call_args.args[0], 'https://cdn.example.com/og.png')
+        self.assertFalse(PreviewJob.objects.exists())
+        for width in (320, 640):
+            with preview_storage.open(thumbnail_name(self.link.preview_hash, width)) as file:
+                image = Image.open(file)
+                self.assertEqual((image.format, image.size), ('WEBP', (width, width // 2)))
+
+        self.resolve()
+        self.assertFalse(PreviewJob.objects.exists())
+
+    def test_preview_is_served_with_long_cache(self):
+        self.resolve()
+        self.process(make_image((200, 100), 'JPEG'), 'image/jpeg')
+        url = reverse('preview_image', kwargs={'digest': self.link.preview_hash, 'width': 320})
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        home = self.client.get(reverse('home')).content.decode()
+        self.assertIn(url, home)
+        self.assertNotIn('cdn.example.com', home)
+
+    def test_invalid_images_are_not_retried(self):
+        for body, content_type in ((b'not an image', 'image/png'), (make_image((10, 10)), 'text/html')):
+            with self.subTest(content_type):
+                self.resolve(f'https://cdn.example.com/{content_type}')
+                self.process(body, content_type)
+
+                self.assertFalse(PreviewJob.objects.exists())
+                self.assertEqual(self.link.preview_hash, '')
+                self.assertEqual(self.link.preview_source, f'https://cdn.example.com/{content_type}')
+
+    def test_huge_images_are_rejected_before_decoding(self):
+        self.resolve()
+        with self.settings(BOOKMARKS_PREVIEW_MAX_PIXELS=100 * 100):
+            self.process(make_image((101, 100)))
+
+        self.assertEqual(self.link.preview_hash, '')
+
+    def test_queue_is_bounded(self):
+        other = Link.objects.for_url('https://example.com/other')
+        with self.settings(BOOKMARKS_PREVIEW_QUEUE_MAX_SIZE=1):
+            self.resolve()
+            metadata_cache.set(other.url, OG_DATA)
+
+        self.assertEqual(list(PreviewJob.objects.values_list('link', flat=True)), [self.link.pk])
+
+
+class LinkTests(BookmarkTestCase):
+    def test_normalize_url(self):
+        self.assertEqual(
+            normalize_url('HTTPS://Example.com:443/page?b=2&utm_source=x&a=1&fbclid=y#top'),
+            'https://example.com/page?a=1&b=2',
+        )
+
+    def test_users_share_link(self):
+        other = User.objects.create_user(username='other@example.com', password='password')
+        for user, url in ((self.user, 'https://example.com/?utm_source=feed'), (other, 'https://EXAMPLE.com/')):
+            self.client.force_login(user)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('api_add_bookmark'), {'url': url, 'title': 'Mine' if user == other else ''})
+
+        process_pending_jobs()
+
+        self.assertEqual(self.fetch.call_count, 1)
+        link = Link.objects.get()
+        self.assertEqual(link.url, 'https://example.com/')
+        self.assertEqual(
+            sorted(bookmark.display_title for bookmark in link.bookmarks.all()), ['Example', 'Mine']
+        )
+
+
+class MetadataRefreshTests(BookmarkTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bookmark = self.create_bookmark()
+        self.refresher = MetadataRefresher(max_workers=2, host_interval=0)
+
+    def refresh(self, response):
+        with mock.patch('requests.Session.get', return_value=response) as get:
+            stats = refresh_stale_links(refresher=self.refresher)
+        return stats, get
+
+    def test_conditional_refresh(self):
+        response = FakeResponse(b'<html><head><title>Fresh</title></head>')
+        response.headers['ETag'] = '"v1"'
+        stats, _ = self.refresh(response)
+        self.assertEqual(stats['updated'], 1)
+        link = Link.objects.get()
+        self.assertEqual((link.title, link.etag), ('Fresh', '"v1"'))
+
+        self.assertEqual(sum(refresh_stale_links(refresher=self.refresher).values()), 0)
+
+        Link.objects.update(fetched_at=timezone.now() - timedelta(days=30))
+        response = FakeResponse(status_code=304)
+        stats, get = self.refresh(response)
+        self.assertEqual(stats['not_modified'], 1)
+        self.assertEqual(get.call_args.kwargs['headers'], {'If-None-Match': '"v1"'})
+        self.assertEqual(response.bytes_read, 0)
+        link.refresh_from_db()
+        self.assertEqual(link.title, 'Fresh')
+        self.assertGreater(link.fetched_at, timezone.now() - timedelta(minutes=1))
+
+    def test_orphan_links_are_skipped(self):
+        self.bookmark.delete()
+        self.assertEqual(stale_links(10), [])
+
+    def test_update_without_url_change_does_not_fetch(self):
+        collection = Collection.objects.create(user=self.user, title='Collection', description='')
+        response = self.client.put(
+            reverse('api_update_bookmark', kwargs={'pk': self.bookmark.pk}),
+            {'url': self.bookmark.url, 'collections': [collection.pk]},
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.fetch.call_count, 0)
+        self.assertEqual(list(self.bookmark.collections.all()), [collection])
+
+
+class BulkImportTests(BookmarkTestCase):
+    def test_json_import(self):
+        collection = Collection.objects.create(user=self.user, title='Work', description='')
+        self.create_bookmark('https://example.com/existing')
+        self.fetch.side_effect = lambda url: None if url.endswith('gone') else OG_DATA
+
+        response = self.client.post(reverse('api_bulk_bookmarks'), [
+            {'url': 'https://example.com/a', 'collections': [collection.pk, 'New']},
+            'https://EXAMPLE.com/a',
+            'https://example.com/existing',
+            'https://example.com/gone',
+            {'url': 'https://example.com/full', 'title': 'Full', 'bookmark_type': 'book'},
+            'ftp:/broken',
+        ], content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['created', 'duplicate', 'exists', 'created', 'created', 'invalid'],
+        )
+        self.assertEqual(self.fetch.call_count, 2)
+        bookmark = Bookmark.objects.get(url='https://example.com/a')
+        self.assertEqual(bookmark.display_title, 'Example')
+        self.assertEqual(sorted(bookmark.collections.values_list('title', flat=True)), ['New', 'Work'])
+        self.assertEqual(Bookmark.objects.get(url='https://example.com/gone').enrichment_status, 'failed')
+        self.assertEqual(Bookmark.objects.get(url='https://example.com/full').bookmark_type, 'book')
+
+    def test_invalid_items_are_reported(self):
+        response = self.client.post(reverse('api_bulk_bookmarks'), [
+            {'url': 'https://example.com/a', 'collections': 'Work'},
+            {'url': 'https://example.com/b', 'collections': [{'x': 1}]},
+            {'url': 'https://example.com/c', 'collections': [True, 2 ** 64]},
+            {'url': ['https://example.com/d']},
+            {'url': 'https://example.com/' + 'x' * 200},
+        ], content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual([result['status'] for result in response.data['results']], ['invalid'] * 5)
+        self.assertTrue(response.data['results'][0]['error'].startswith('collections:'))
+        self.assertFalse(Bookmark.objects.exists())
+        self.assertFalse(Collection.objects.exists())
+
+    def test_netscape_import_maps_folders_to_collections(self):
+        self.fetch.side_effect = requests.ConnectionError('down')
+
+        response = self.client.post(reverse('api_bulk_bookmarks'), NETSCAPE_EXPORT, content_type='text/html')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        bookmark = Bookmark.objects.get(url='https://example.com/a')
+        self.assertEqual(bookmark.title, 'A')
+        self.assertEqual(bookmark.enrichment_status, Bookmark.ENRICHMENT_PENDING)
+        self.assertEqual(sorted(bookmark.collections.values_list('title', flat=True)), ['Музыка', 'Чтение'])
+        self.assertEqual(MetadataJob.objects.count(), 2)
+
+
+class ExportTests(BookmarkTestCase):
+    def setUp(self):
+        super().setUp()
+        work = Collection.objects.create(user=self.user, title='Work, "main"', description='')
+        music = Collection.objects.create(user=self.user, title='Музыка', description='')
+        self.create_bookmark('https://example.com/a', title='A & B', description='Про <A>', bookmark_type='book')
+        self.create_bookmark('https://example.com/b', bookmark_type='video').collections.add(work, music)
+        self.create_bookmark('https://example.com/c', description='C').collections.add(work)
+
+    def export(self, export_format):
+        response = self.client.get(reverse('api_export_bookmarks'), {'format': export_format})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def snapshot(self, fields=('url', 'display_title', 'description', 'bookmark_type')):
+        return {
+            tuple(getattr(bookmark, field) for field in fields) + (
+                tuple(sorted(bookmark.collections.values_list('title', flat=True))),
+            )
+            for bookmark in Bookmark.objects.filter(user=self.user).select_related('link')
+        }
+
+    def reimport(self, body, content_type):
+        # Данные ссылок общие, поэтому удаляем и их: всё должно прийти из файла
+        Bookmark.objects.all().delete()
+        Collection.objects.all().delete()
+        Link.objects.all().delete()
+        response = self.client.post(reverse('api_bulk_bookmarks'), body, content_type=content_type)
+        self.assertEqual(response.data['created'], 3)
+
+    def test_round_trip(self):
+        expected = self.snapshot()
+        for export_format, content_type in (('jsonl', 'application/x-ndjson'), ('csv', 'text/csv')):
+            with self.subTest(export_format):
+                self.reimport(self.export(export_format), content_type)
+
+                self.assertEqual(self.snapshot(), expected)
+                self.fetch.assert_not_called()
+
+    def test_netscape_round_trip(self):
+        fields = ('url', 'display_title')
+        expected = self.snapshot(fields)
+        body = self.export('html')
+        self.reimport(body, 'text/html')
+
+        self.assertEqual(body.count('HREF="https://example.com/b"'), 2)
+        # Браузерный формат не хранит данные страницы, они загружаются заново
+        self.assertEqual(self.snapshot(fields), expected)
+        self.assertEqual(Bookmark.objects.get(url='https://example.com/c').description, 'Example page')
+
+    def test_queries_do_not_depend_on_bookmark_count(self):
+        counts = []
+        for index in range(2):
+            for number in range(10):
+                self.create_bookmark(f'https://example.com/{index}/{number}').collections.set(
+                    Collection.objects.filter(user=self.user)
+                )
+            with CaptureQueriesContext(connection) as queries:
+                self.export('jsonl')
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_unknown_format_returns_json_error(self):
+        response = self.client.get(reverse('api_export_bookmarks'), {'format': 'xml'})
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class QueryCountTests(BookmarkTestCase):
+    PAGE_SIZES = (1, 10, 40)
+
+    def assertConstantQueries(self, url_name, collection_url=False):
+        counts = []
+        collections = [
+            Collection.objects.create(user=self.user, title=f'Collection {index}', description='')
+            for index in range(3)
+        ]
+        for size in self.PAGE_SIZES:
+            while Bookmark.objects.count() < size:
+                bookmark = self.create_bookmark(f'https://example.com/{Bookmark.objects.count()}')
+                bookmark.collections.set(collections)
+
+            kwargs = {'collection_id': collections[0].pk} if collection_url else {}
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse(url_name, kwargs=kwargs))
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(context))
+
+        self.assertEqual(len(set(counts)), 1, f'{url_name}: {dict(zip(self.PAGE_SIZES, counts))}')
+
+    def test_bookmark_list(self):
+        self.assertConstantQueries('home')
+
+    def test_bookmark_list_api(self):
+        self.assertConstantQueries('api_bookmark')
+
+    def test_collection_bookmarks(self):
+        self.assertConstantQueries('collection_bookmarks', collection_url=True)
+
+    def test_collection_bookmarks_api(self):
+        self.assertConstantQueries('api_collection_bookmarks', collection_url=True)
+
+    def test_collection_list_with_counts(self):
+        for url_name in ('collections', 'api_collections'):
+            counts = []
+            for size in self.PAGE_SIZES:
+                while Collection.objects.count() < size:
+                    collection = Collection.objects.create(user=self.user, title='Collection', description='')
+                    bookmark = self.create_bookmark(f'https://example.com/{Bookmark.objects.count()}')
+                    bookmark.collections.add(collection)
+                metadata_cache.cache.clear()
+                with CaptureQueriesContext(connection) as context:
+                    self.assertEqual(self.client.get(reverse(url_name)).status_code, 200)
+                counts.append(len(context))
+            self.assertEqual(len(set(counts)), 1, f'{url_name}: {dict(zip(self.PAGE_SIZES, counts))}')
+
+    def test_collection_stats(self):
+        collection = Collection.objects.create(user=self.user, title='Collection', description='')
+        Collection.objects.create(user=self.user, title='Empty', description='')
+        for index in range(3):
+            self.create_bookmark(f'https://example.com/{index}').collections.add(collection)
+
+        bookmark = Bookmark.objects.last()
+        bookmark.title = 'Renamed'
+        bookmark.save()
+
+        results = self.client.get(reverse('api_collections')).data['results']
+        self.assertEqual([item['bookmarks_count'] for item in results], [0, 3])
+        self.assertEqual(results[1]['last_updated'], serializers.DateTimeField().to_representation(bookmark.updated_at))
+
+
+class BatchOperationTests(BookmarkTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user(username='other@example.com', password='password')
+        self.collection = Collection.objects.create(user=self.user, title='Reading', description='')
+        self.bookmarks = [self.create_bookmark(f'https://example.com/{index}') for index in range(30)]
+        self.foreign = Bookmark.objects.create(
+            user=self.other, url='https://example.com/0', link=self.bookmarks[0].link
+        )
+
+    def batch(self, url_name, ids, **data):
+        return self.client.post(reverse(url_name), {'ids': ids, **data}, content_type='application/json')
+
+    def assertConstantQueries(self, url_name, **data):
+        counts = []
+        for bookmarks in (self.bookmarks[:1], self.bookmarks[1:]):
+            with CaptureQueriesContext(connection) as context:
+                response = self.batch(url_name, [bookmark.pk for bookmark in bookmarks], **data)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, {'count': len(bookmarks)})
+            counts.append(len(context))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_add_and_remove_from_collection(self):
+        self.assertConstantQueries('api_batch_add_to_collection', collection=self.collection.pk)
+        self.assertEqual(self.collection.bookmarks.count(), 30)
+        # Уже добавленные закладки пропускаются
+        response = self.batch('api_batch_add_to_collection', [self.bookmarks[0].pk], collection=self.collection.pk)
+        self.assertEqual(response.data, {'count': 0})
+
+        self.assertConstantQueries('api_batch_remove_from_collection', collection=self.collection.pk)
+        self.assertFalse(self.collection.bookmarks.exists())
+
+    def test_delete(self):
+        self.bookmarks[5].collections.add(self.collection)
+        self.client.post(reverse('api_add_bookmark'), {'url': 'https://example.com/pending'})
+        self.bookmarks.append(Bookmark.objects.get(url='https://example.com/pending'))
+
+        self.assertConstantQueries('api_batch_delete_bookmarks')
+
+        self.assertEqual(list(Bookmark.objects.all()), [self.foreign])
+        self.assertFalse(MetadataJob.objects.exists())
+
+    def test_scoped_to_user(self):
+        foreign_collection = Collection.objects.create(user=self.other, title='Foreign', description='')
+
+        response = self.batch('api_batch_add_to_collection', [self.bookmarks[0].pk], collection=foreign_collection.pk)
+        self.assertEqual(response.status_code, 400)
+
+        response = self.batch('api_batch_add_to_collection', [self.foreign.pk], collection=self.collection.pk)
+        self.assertEqual(response.data, {'count': 0})
+        response = self.batch('api_batch_delete_bookmarks', [self.foreign.pk, self.bookmarks[0].pk])
+        self.assertEqual(response.data, {'count': 1})
+        self.assertTrue(Bookmark.objects.filter(pk=self.foreign.pk).exists())
+
+    def test_invalidates_cached_lists(self):
+        url = reverse('api_bookmark')
+        self.assertEqual(len(self.client.get(url).data['results']), 30)
+
+        self.batch('api_batch_delete_bookmarks', [bookmark.pk for bookmark in self.bookmarks[:10]])
+
+        self.assertEqual(len(self.client.get(url).data['results']), 20)
+
+    def test_delete_is_synced(self):
+        ids = [bookmark.pk for bookmark in self.bookmarks[:2]]
+        self.bookmarks[0].collections.add(self.collection)
+        url = reverse('api_bookmark')
+        etag = self.client.get(url)['ETag']
+        with self.settings(BOOKMARKS_SYNC_SETTLE_SECONDS=0):
+            token = self.client.get(reverse('api_sync')).json()['token']
+            self.batch('api_batch_delete_bookmarks', ids)
+            changes = self.client.get(reverse('api_sync'), {'since': token}).json()
+
+        self.assertEqual(sorted(changes['deleted']['bookmarks']), ids)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertFalse(Bookmark.collections.through.objects.filter(bookmark_id__in=ids).exists())
+
+
+@override_settings(BOOKMARKS_SYNC_SETTLE_SECONDS=0)
+class SyncTests(BookmarkTestCase):
+    def sync(self, token=None):
+        response = self.client.get(reverse('api_sync'), {} if token is None else {'since': token})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_returns_changes_after_token(self):
+        kept, updated, deleted = [self.create_bookmark(f'https://example.com/{index}') for index in range(3)]
+        collection = Collection.objects.create(user=self.user, title='Reading', description='')
+        removed_collection = Collection.objects.create(user=self.user, title='Old', description='')
+        token = self.sync()['token']
+
+        updated.title = 'Updated'
+        updated.save()
+        updated.collections.add(collection)
+        kept.collections.add(removed_collection)
+        self.client.delete(reverse('api_delete_bookmark', kwargs={'pk': deleted.pk}))
+        self.client.delete(reverse('api_delete_collection', kwargs={'pk': removed_collection.pk}))
+
+        changes = self.sync(token)
+
+        self.assertEqual([item['id'] for item in changes['bookmarks']], [updated.pk])
+        self.assertEqual(changes['bookmarks'][0]['title'], 'Updated')
+        self.assertEqual(changes['collections'], [])
+        self.assertEqual(changes['memberships'], [{'bookmark': updated.pk, 'collection': collection.pk}])
+        self.assertEqual(changes['deleted'], {
+            'bookmarks': [deleted.pk],
+            'collections': [removed_collection.pk],
+            # Связь с удалённой коллекцией удалена вместе с ней
+            'memberships': [],
+        })
+        self.assertFalse(changes['has_more'])
+        self.assertEqual(self.sync(changes['token'])['bookmarks'], [])
+
+    def test_work_does_not_depend_on_library_size(self):
+        counts = []
+        for size in (5, 50):
+            while Bookmark.objects.count() < size:
+                self.create_bookmark(f'https://example.com/{Bookmark.objects.count()}')
+            token = self.sync()['token']
+            bookmark = self.create_bookmark(f'https://example.org/{size}')
+
+            with CaptureQueriesContext(connection) as context:
+                changes = self.sync(token)
+            self.assertEqual([item['id'] for item in changes['bookmarks']], [bookmark.pk])
+            counts.append(len(context))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_pages_and_batch_operations(self):
+        bookmarks = [self.create_bookmark(f'https://example.com/{index}') for index in range(3)]
+        collection = Collection.objects.create(user=self.user, title='Reading', description='')
+        token = self.sync()['token']
+        ids = [bookmark.pk for bookmark in bookmarks]
+        self.client.post(
+            reverse('api_batch_add_to_collection'), {'ids': ids, 'collection': collection.pk},
+            content_type='application/json',
+        )
+        self.client.post(reverse('api_batch_delete_bookmarks'), {'ids': ids[:1]}, content_type='application/json')
+
+        with self.settings(BOOKMARKS_SYNC_PAGE_SIZE=2):
+            first = self.sync(token)
+            second = self.sync(first['token'])
+
+        self.assertTrue(first['has_more'])
+        self.assertFalse(second['has_more'])
+        memberships = [(item['bookmark'], item['collection']) for item in first['memberships'] + second['memberships']]
+        self.assertEqual(sorted(memberships), [(pk, collection.pk) for pk in ids[1:]])
+        self.assertEqual(second['deleted']['bookmarks'], ids[:1])
+
+    def test_unchanged_metadata_is_not_synced(self):
+        url = 'https://example.com/shared'
+        self.create_bookmark(url)
+        other = User.objects.create_user(username='other@example.com', password='password')
+        Bookmark.objects.create(user=other, url=url, link=Link.objects.for_url(url))
+        metadata_cache.set(url, OG_DATA)
+        self.client.force_login(other)
+        token = self.sync()['token']
+
+        metadata_cache.set(url, OG_DATA)
+        metadata_cache.set(url, OG_DATA)
+
+        changes = self.sync(token)
+        self.assertEqual(changes['bookmarks'], [])
+        self.assertEqual(changes['token'], token)
+
+    def test_recent_and_pruned_changes(self):
+        self.create_bookmark()
+        token = self.sync()['token']
+        self.create_bookmark('https://example.org/')
+        with self.settings(BOOKMARKS_SYNC_SETTLE_SECONDS=60):
+            # Транзакции с меньшими id могли ещё не зафиксироваться
+            self.assertEqual(self.sync(token)['bookmarks'], [])
+
+        self.create_bookmark('https://example.net/')
+        prune_change_log(days=0)
+
+        response = self.client.get(reverse('api_sync'), {'since': token})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(self.client.get(reverse('api_sync'), {'since': 'abc'}).status_code, 400)
+
+
+class KeysetPaginationTests(BookmarkTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bookmarks = [self.create_bookmark(f'https://example.com/{index}') for index in range(5)]
+        # Одинаковое время создания проверяет сравнение по id
+        Bookmark.objects.update(created_at=self.bookmarks[0].created_at)
+        self.expected = sorted(bookmark.pk for bookmark in self.bookmarks)[::-1]
+
+    def test_api_walks_forward_and_back(self):
+        url = reverse('api_bookmark') + '?page_size=2'
+        pages = []
+        while url:
+            response = self.client.get(url)
+            pages.append(response.data)
+            url = response.data['next']
+
+        self.assertEqual([[item['id'] for item in page['results']] for page in pages], [
+            self.expected[0:2], self.expected[2:4], self.expected[4:],
+        ])
+        self.assertIsNone(pages[0]['previous'])
+
+        previous = self.client.get(pages[2]['previous']).data
+        self.assertEqual([item['id'] for item in previous['results']], self.expected[2:4])
+        previous = self.client.get(previous['previous']).data
+        self.assertEqual([item['id'] for item in previous['results']], self.expected[0:2])
+        self.assertIsNone(previous['previous'])
+
+    def test_page_size_is_capped(self):
+        with self.settings(BOOKMARKS_MAX_PAGE_SIZE=3):
+            response = self.client.get(reverse('api_bookmark'), {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_html_list(self):
+        response = self.client.get(reverse('home'), {'page_size': 3})
+        self.assertEqual([bookmark.pk for bookmark in response.context['bookmarks']], self.expected[:3])
+
+        response = self.client.get(reverse('home'), {'cursor': response.context['page_obj'].next_cursor})
+        self.assertEqual([bookmark.pk for bookmark in response.context['bookmarks']], self.expected[3:])
+
+    def test_html_links_keep_query(self):
+        response = self.client.get(reverse('home'), {'page_size': 2})
+        next_url = f"?page_size=2&cursor={response.context['page_obj'].next_cursor}"
+        self.assertContains(response, f'href="{escape(next_url)}"')
+
+        response = self.client.get(reverse('home') + next_url)
+        self.assertEqual([bookmark.pk for bookmark in response.context['bookmarks']], self.expected[2:4])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(reverse('api_bookmark'), {'cursor': 'garbage'}).status_code, 404)
+        self.assertEqual(self.client.get(reverse('home'), {'cursor': 'garbage'}).status_code, 404)
+
+
+class IndexUsageTests(BookmarkTestCase):
+    def assertUsesIndex(self, queryset, index_name):
+        if connection.vendor == 'postgresql':
+            # На маленькой тестовой таблице планировщик иначе выберет seq scan
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        self.assertIn(index_name, queryset.explain())
+
+    def test_recent_bookmarks(self):
+        queryset = Bookmark.objects.filter(user=self.user).order_by('-created_at', '-id')[:100]
+        self.assertUsesIndex(queryset, 'bookmarks_user_created_idx')
+
+    def test_link_lookup(self):
+        queryset = Bookmark.objects.filter(link__url_hash=url_hash('https://example.com/')).values('user_id')
+        self.assertUsesIndex(queryset, 'bookmarks_link_id')
+
+    def test_user_link_lookup(self):
+        link = Link.objects.for_url('https://example.com/')
+        queryset = Bookmark.objects.filter(user=self.user, link=link).values('id')
+        self.assertUsesIndex(queryset, 'bookmarks_user_link_idx')
+
+    def test_collection_membership(self):
+        collection = Collection.objects.create(user=self.user, title='Collection', description='')
+        queryset = Bookmark.collections.through.objects.filter(collection=collection).values('bookmark_id')
+        self.assertUsesIndex(queryset, 'bookmarks_coll_bookmark_idx')
+
+    def test_recent_collections(self):
+        queryset = Collection.objects.filter(user=self.user).order_by('-created_at', '-id')[:100]
+        self.assertUsesIndex(queryset, 'collections_user_created_idx')
+
+
+class SearchTests(BookmarkTestCase):
+    def setUp(self):
+        super().setUp()
+        self.collection = Collection.objects.create(user=self.user, title='Чтение', description='')
+        self.in_title = self.create_bookmark(
+            'https://example.com/django', title='Django ORM guide', description='Databases', bookmark_type='article'
+        )
+        self.in_description = self.create_bookmark(
+            'https://example.com/orm', title='Notes', description='Tips about the Django ORM'
+        )
+        self.in_description.collections.add(self.collection)
+        self.create_bookmark('https://example.com/other', title='Other', description='Nothing here')
+
+    def search(self, **params):
+        response = self.client.get(reverse('api_search_bookmarks'), params)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data]
+
+    def test_ranks_title_matches_first(self):
+        self.assertEqual(self.search(q='django orm'), [self.in_title.pk, self.in_description.pk])
+
+    def test_filters(self):
+        self.assertEqual(self.search(q='django', bookmark_type='article'), [self.in_title.pk])
+        self.assertEqual(self.search(q='django', collection=self.collection.pk), [self.in_description.pk])
+
+    def test_index_sees_new_bookmarks(self):
+        self.assertEqual(self.search(q='postgres'), [])
+        bookmark = self.create_bookmark('https://example.com/pg', title='Postgres full text search')
+        self.assertEqual(self.search(q='postgres'), [bookmark.pk])
+
+    def test_link_refresh_reindexes_bookmarks(self):
+        self.assertEqual(self.search(q='kafka'), [])
+        metadata_cache.set('https://example.com/other', dict(OG_DATA, description='Kafka streams'))
+        self.assertEqual(len(self.search(q='kafka')), 1)
+
+    def test_link_title_reindexes_untitled_bookmarks(self):
+        untitled = self.create_bookmark('https://example.com/untitled', title='')
+        titled = self.create_bookmark('https://example.com/untitled?page=1', title='Own title')
+        Link.objects.filter(pk__in=[untitled.link_id, titled.link_id]).update(title='Kafka streams')
+        self.assertEqual(self.search(q='kafka'), [untitled.pk])
+
+    def test_html_view(self):
+        response = self.client.get(reverse('search'), {'q': 'django'})
+        self.assertEqual(list(response.context['bookmarks']), [self.in_title, self.in_description])
+
+
+class ResponseCacheTests(BookmarkTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bookmark = self.create_bookmark()
+        self.collection = Collection.objects.create(user=self.user, title='Чтение', description='')
+
+    def assertServedFromCache(self, url):
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # Остаются только запросы сессии и пользователя
+        self.assertFalse([query for query in context if 'bookmarks' in query['sql']])
+        return response
+
+    def test_api_list_is_cached_until_change(self):
+        url = reverse('api_bookmark')
+        response = self.assertServedFromCache(url)
+        self.assertEqual([item['id'] for item in response.data['results']], [self.bookmark.pk])
+
+        bookmark = self.create_bookmark('https://example.com/new')
+        response = self.client.get(url)
+        self.assertEqual([item['id'] for item in response.data['results']], [bookmark.pk, self.bookmark.pk])
+
+    def test_collection_changes_invalidate(self):
+        url = reverse('api_collections')
+        self.assertServedFromCache(url)
+        self.bookmark.collections.add(self.collection)
+        etag = self.client.get(url)['ETag']
+        self.collection.delete()
+        self.assertEqual(self.client.get(url).data['results'], [])
+        self.assertNotEqual(self.client.get(url)['ETag'], etag)
+
+    def test_html_list_is_cached(self):
+        # Первый ответ выставляет CSRF-cookie, кэшируются только страницы с ней
+        self.client.get(reverse('home'))
+        response = self.assertServedFromCache(reverse('home'))
+        self.assertContains(response, self.bookmark.url)
+
+    def test_conditional_requests(self):
+        for url in (reverse('api_bookmark'), reverse('home')):
+            self.client.get(url)
+            response = self.client.get(url)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(
+                self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 200
+            )
+
+        response = self.client.get(reverse('api_bookmark'))
+        self.bookmark.delete()
+        # Изменение в ту же секунду: дата та же, ETag другой
+        self.assertEqual(
+            self.client.get(
+                reverse('api_bookmark'),
+                HTTP_IF_NONE_MATCH=response['ETag'], HTTP_IF_MODIFIED_SINCE=response['Last-Modified'],
+            ).status_code,
+            200,
+        )
+
+    def test_version_is_shared_through_database(self):
+        url = reverse('api_bookmark')
+        etag = self.client.get(url)['ETag']
+
+        # Другой процесс не видит кэш этого, но видит версию в базе
+        get_cache().clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        version = get_user_version(self.user.pk)
+        Bookmark.objects.filter(pk=self.bookmark.pk).update(title='Изменено воркером')
+        bump_user_version(self.user.pk)
+        self.assertGreater(UserDataVersion.objects.get(user=self.user).version, version)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cache_is_per_user(self):
+        self.client.get(reverse('api_bookmark'))
+        other = User.objects.create_user(username='other@example.com', password='password')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('api_bookmark')).data['results'], [])
+
+    def test_import_invalidates(self):
+        url = reverse('api_bookmark')
+        self.client.get(url)
+        self.client.post(reverse('api_bulk_bookmarks'), ['https://example.com/imported'], content_type='application/json')
+        self.assertEqual(len(self.client.get(url).data['results']), 2)
+
+
+class HealthCheckTests(TestCase):
+    def test_liveness_does_not_touch_database(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/healthz')
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_readiness_ignores_allowed_hosts(self):
+        with self.settings(ALLOWED_HOSTS=['localhost']):
+            with self.assertNumQueries(1):
+                response = self.client.get('/readyz', HTTP_HOST='10.0.0.7')
+            self.assertEqual(self.client.get('/login/', HTTP_HOST='10.0.0.7').status_code, 400)
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_readiness_reports_database_failure(self):
+        with mock.patch('bookmarks.health.check_database', side_effect=DatabaseError('connection refused')):
+            with self.assertLogs('bookmarks.health', 'WARNING'):
+                response = self.client.get('/readyz')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {'status': 'unavailable'})
+
+
+def server_timing(response):
+    """Заголовок Server-Timing в виде {метрика: (длительность, описание)}."""
+    metrics = {}
+    for entry in response['Server-Timing'].split(', '):
+        name, *params = entry.split(';')
+        params = dict(param.split('=', 1) for param in params)
+        metrics[name] = (float(params['dur']), params.get('desc', '').strip('"'))
+    return metrics
+
+
+class InstrumentationTests(BookmarkTestCase):
+    def test_server_timing_counts_queries_and_render(self):
+        self.create_bookmark()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'))
+
+        timing = server_timing(response)
+        self.assertEqual(timing['db'][1], f'{len(queries)} queries')
+        self.assertEqual(timing['fetch'], (0.0, '0 requests'))
+        self.assertGreater(timing['render'][0], 0)
+        self.assertGreaterEqual(timing['total'][0], timing['db'][0] + timing['render'][0])
+
+    def test_server_timing_counts_fetches(self):
+        bookmark = self.create_bookmark()
+        self.fetch.side_effect = get_open_graph_data
+
+        with mock.patch('requests.Session.get', return_value=FakeResponse(b'<html><head><title>Page</title></head>')):
+            response = self.client.put(
+                reverse('api_update_bookmark', kwargs={'pk': bookmark.pk}),
+                {'url': 'https://example.org/'},
+                content_type='application/json',
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(server_timing(response)['fetch'][1], '1 requests')
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('home'))
+
+        with self.settings(BOOKMARKS_METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn('bookmarks_http_requests_total{method="GET",status="200",view="home"}', metrics)
+        self.assertIn('bookmarks_db_queries_per_request_bucket{le="5.0",view="home"}', metrics)
+        self.assertIn('bookmarks_render_duration_seconds_count{view="home"}', metrics)
+
+    def test_slow_request_log_includes_sql(self):
+        with self.settings(BOOKMARKS_SLOW_REQUEST_SECONDS=0.000001, BOOKMARKS_SLOW_REQUEST_SAMPLE_RATE=1):
+            with self.assertLogs('bookmarks.instrumentation', 'WARNING') as logs:
+                self.client.get(reverse('home'))
+
+        self.assertIn('Slow request GET / (home)', logs.output[0])
+        self.assertIn('FROM "bookmarks"', logs.output[0])
+
+        with self.settings(BOOKMARKS_SLOW_REQUEST_SECONDS=0.000001, BOOKMARKS_SLOW_REQUEST_SAMPLE_RATE=0):
+            with self.assertNoLogs('bookmarks.instrumentation', 'WARNING'):
+                self.client.get(reverse('home'))
+
+
+class OpenAPISchemaTests(TestCase):
+    def setUp(self):
+        for cached in (cached_schema, cached_yaml_schema):
+            cached.cache_clear()
+            self.addCleanup(cached.cache_clear)
+
+    def get_schema(self, **headers):
+        return self.client.get(reverse('schema-swagger-ui'), {'format': 'openapi'}, **headers)
+
+    def test_cached_schema_matches_generated_per_request(self):
+        with mock.patch('bookmarks.schema.generate_schema', wraps=generate_schema) as generate:
+            response = self.get_schema()
+            self.get_schema()
+
+        generate.assert_called_once()
+        fresh = schema_view.without_ui()(RequestFactory().get('/swagger/', {'format': 'openapi'})).render()
+        expected = json.loads(fresh.content)
+        # Адрес в схеме, построенной на запрос, берётся из запроса; в кэшированной его нет
+        del expected['host'], expected['schemes']
+        self.assertEqual(json.loads(response.content), expected)
+        self.assertEqual(self.client.get(reverse('schema-swagger-ui')).status_code, 200)
+
+    def test_all_formats_share_cached_schema(self):
+        url = reverse('schema-swagger-ui')
+        with mock.patch.object(
+            OpenAPISchemaGenerator, 'get_schema', autospec=True, side_effect=OpenAPISchemaGenerator.get_schema
+        ) as get_schema:
+            page = self.client.get(url)
+            self.assertEqual(get_schema.call_count, 0)
+            by_accept = self.client.get(url, HTTP_ACCEPT='application/json')
+            as_yaml = self.client.get(url, {'format': '.yaml'})
+
+        get_schema.assert_called_once()
+        self.assertContains(page, '"url": "/swagger/?format=openapi"')
+        self.assertEqual(by_accept.content, self.get_schema().content)
+        self.assertEqual(yaml_sane_load(as_yaml.content), json.loads(by_accept.content))
+
+    def test_not_modified_by_etag(self):
+        etag = self.get_schema()['ETag']
+
+        response = self.get_schema(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_serves_schema_file_from_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = f'{directory}/openapi.json'
+        call_command('generate_openapi_schema', output=path, stdout=io.StringIO())
+
+        with override_settings(BOOKMARKS_OPENAPI_SCHEMA_FILE=path), \
+                mock.patch('bookmarks.schema.generate_schema') as generate:
+            response = self.get_schema()
+
+        generate.assert_not_called()
+        with open(path, 'rb') as file:
+            self.assertEqual(response.content, file.read())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Проверка соединений реализована в бэкенде PostgreSQL')
+class ConnectionHealthCheckTests(TestCase):
+    def setUp(self):
+        self.connection = connections['default']
+        self.connection.ensure_connection()
+        # Как после close_old_connections() в начале запроса
+        self.connection.health_check_done = False
+
+    def test_reused_connection_is_checked_once_per_request(self):
+        with mock.patch.object(self.connection, 'is_usable', return_value=True) as is_usable:
+            for _ in range(3):
+                with self.connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+
+        is_usable.assert_called_once_with()
+
+    def test_broken_connection_is_closed_before_use(self):
+        with mock.patch.object(self.connection, 'is_usable', return_value=False):
+            with mock.patch.object(self.connection, 'close') as close:
+                self.connection.cursor().close()
+
+        close.assert_called_once_with()
+
+
+def set_user_version(user, version):
+    UserDataVersion.objects.update_or_create(user=user, defaults={'version': version})
+
+
+@override_settings(BOOKMARKS_READ_REPLICAS=['replica1'], BOOKMARKS_REPLICA_PIN_SECONDS=5)
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user@example.com', password='password')
+        self.router = ReplicaRouter()
+        get_cache().clear()
+
+    def get_request(self, **kwargs):
+        request = RequestFactory().get('/', **kwargs)
+        request.user = self.user
+        return request
+
+    def make_stale(self):
+        # Последнее изменение данных пользователя было давно
+        set_user_version(self.user, 1)
+
+    def test_reads_go_to_replica_only_inside_view(self):
+        self.make_stale()
+        self.assertIsNone(self.router.db_for_read(Bookmark))
+        with replica_reads(self.get_request()):
+            self.assertEqual(self.router.db_for_read(Bookmark), 'replica1')
+            self.assertIsNone(self.router.db_for_read(User))
+            bookmark = Bookmark(user=self.user, url='https://example.com/')
+            bookmark._state.db = 'replica1'
+            self.assertEqual(self.router.db_for_write(Bookmark, instance=bookmark), 'default')
+
+    def test_recent_write_pins_to_primary(self):
+        set_user_version(self.user, int(time.time() * 1000))
+        with replica_reads(self.get_request()):
+            self.assertIsNone(self.router.db_for_read(Bookmark))
+
+    def test_pin_cookie_pins_to_primary(self):
+        self.make_stale()
+        request = self.get_request()
+        request.COOKIES[PIN_COOKIE] = str(int(time.time()) + 5)
+        with replica_reads(request):
+            self.assertIsNone(self.router.db_for_read(Bookmark))
+
+    def test_middleware_sets_pin_cookie_after_write(self):
+        middleware = ReplicaPinMiddleware(lambda request: HttpResponse(status=201))
+        request = RequestFactory().post('/')
+
+        cookie = middleware(request).cookies[PIN_COOKIE]
+
+        self.assertEqual(cookie['max-age'], 5)
+        self.assertNotIn(PIN_COOKIE, middleware(self.get_request()).cookies)
+
+
+# Тестовая реплика-зеркало видит только закоммиченные данные, для проверки нужна отдельная база
+HAS_TEST_REPLICA = 'replica1' in settings.DATABASES and not settings.DATABASES['replica1'].get('TEST', {}).get('MIRROR')
+
+
+@skipUnless(HAS_TEST_REPLICA, 'Нужна отдельная тестовая база replica1')
+@override_settings(BOOKMARKS_READ_REPLICAS=['replica1'])
+class ReplicaReadTests(BookmarkTestCase):
+    databases = {'default', 'replica1'} if HAS_TEST_REPLICA else {'default'}
+
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        User.objects.using('replica1').create(pk=self.user.pk, username=self.user.username)
+        url = 'https://example.com/replica'
+        Bookmark.objects.using('replica1').create(
+            user_id=self.user.pk, url=url, link=Link.objects.db_manager('replica1').for_url(url)
+        )
+        set_user_version(self.user, 1)
+
+    def test_list_reads_from_replica(self):
+        response = self.client.get(reverse('api_bookmark'))
+
+        self.assertEqual([item['url'] for item in response.data['results']], ['https://example.com/replica'])
+
+    def test_client_reads_own_writes(self):
+        self.client.post(reverse('api_add_bookmark'), {'url': 'https://example.com/primary'})
+        response = self.client.get(reverse('api_bookmark'))
+
+        self.assertEqual([item['url'] for item in response.data['results']], ['https://example.com/primary'])
+
+    def test_export_reads_from_replica(self):
+        response = self.client.get(reverse('api_export_bookmarks'), {'format': 'jsonl'})
+
+        self.assertIn('https://example.com/replica', b''.join(response.streaming_content).decode())
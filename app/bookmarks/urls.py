@@ -1,34 +1,42 @@
-from django.urls import path
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
-from rest_framework import permissions
-from .views import *
+from django.urls import path, re_path
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="API for Bookmarks",
-        default_version='v.0.1',
-        description="API for Bookmarks for test Fruktorum",
-        terms_of_service="https://t.me/mikholand",
-        contact=openapi.Contact(email="mikholand@gmail.com"),
-        license=openapi.License(name="Oleg Mikhno"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+from . import async_views
+from .schema import swagger
+from .views import *
 
 urlpatterns = [
     path('', BookmarkHome.as_view(), name='home'),
 
+    path('search/', BookmarkSearchView.as_view(), name='search'),
     path('bookmarks/add/', BookmarkCreateView.as_view(), name='add_bookmark'),
     path('bookmarks/<int:pk>/update/', BookmarkUpdateView.as_view(), name='update_bookmark'),
     path('bookmarks/<int:pk>/delete/', BookmarkDeleteView.as_view(), name='delete_bookmark'),
 
     path('api/bookmarks/', BookmarkHomeAPI.as_view(), name='api_bookmark'),
     path('api/bookmarks/add/', BookmarkCreateAPIView.as_view(), name='api_add_bookmark'),
+    path('api/bookmarks/bulk/', BookmarkBulkImportAPIView.as_view(), name='api_bulk_bookmarks'),
+    path('api/bookmarks/export/', BookmarkExportAPIView.as_view(), name='api_export_bookmarks'),
+    path('api/bookmarks/search/', BookmarkSearchAPIView.as_view(), name='api_search_bookmarks'),
+    path('api/bookmarks/batch/delete/', BookmarkBatchDeleteAPIView.as_view(), name='api_batch_delete_bookmarks'),
+    path(
+        'api/bookmarks/batch/add-to-collection/',
+        BookmarkBatchAddToCollectionAPIView.as_view(),
+        name='api_batch_add_to_collection',
+    ),
+    path(
+        'api/bookmarks/batch/remove-from-collection/',
+        BookmarkBatchRemoveFromCollectionAPIView.as_view(),
+        name='api_batch_remove_from_collection',
+    ),
     path('api/bookmarks/<int:pk>/update/', BookmarkUpdateAPIView.as_view(), name='api_update_bookmark'),
     path('api/bookmarks/<int:pk>/delete/', BookmarkDeleteAPIView.as_view(), name='api_delete_bookmark'),
 
+    path('api/sync/', SyncAPIView.as_view(), name='api_sync'),
+
+    path('api/async/bookmarks/add/', async_views.bookmark_create, name='api_async_add_bookmark'),
+    path('api/async/bookmarks/bulk/', async_views.bookmark_bulk_import, name='api_async_bulk_bookmarks'),
+    path('api/async/bookmarks/<int:pk>/update/', async_views.bookmark_update, name='api_async_update_bookmark'),
+
     path('collections/', CollectionListView.as_view(), name='collections'),
     path('collections/<int:collection_id>/', CollectionBookmarksView.as_view(), name='collection_bookmarks'),
     path('collections/add/', CollectionCreateView.as_view(), name='add_collection'),
@@ -41,9 +49,11 @@ urlpatterns = [
     path('api/collections/<int:pk>/update/', CollectionUpdateAPIView.as_view(), name='api_update_collection'),
     path('api/collections/<int:pk>/delete/', CollectionDeleteAPIView.as_view(), name='api_delete_collection'),
 
+    re_path(r'^previews/(?P<digest>[0-9a-f]{64})/(?P<width>[0-9]{1,4})\.webp$', preview_image, name='preview_image'),
+
     path('register/', RegisterUser.as_view(), name='register'),
     path('login/', LoginUser.as_view(), name='login'),
     path('logout/', logout_user, name='logout'),
 
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+    path('swagger/', swagger, name='schema-swagger-ui'),
 ]
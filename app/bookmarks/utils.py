@@ -1,13 +1,93 @@
+import hashlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.conf import settings
+from django.db import connections, models, router
+
 menu = [{'title': "Добавить закладку", 'url_name': 'add_bookmark'},
         {'title': "Мои коллекции", 'url_name': 'collections'},
+        {'title': "Поиск", 'url_name': 'search'},
         ]
 
 
 class DataMixin:
-    paginate_by = 100
+    paginate_by = settings.BOOKMARKS_PAGE_SIZE
 
     def get_user_context(self, **kwargs):
         context = kwargs
         context['menu'] = menu
 
         return context
+
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+TRACKING_PARAMS = frozenset(['fbclid', 'gclid', 'yclid', 'mc_cid', 'mc_eid', '_openstat'])
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name.startswith('utm_') or name in TRACKING_PARAMS
+
+
+def normalize_url(url):
+    """Канонический вид ссылки: одна страница — одна запись Link."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{parts.port}'
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not is_tracking_param(name)
+    )
+    return urlunsplit((scheme, host, parts.path or '/', urlencode(query), ''))
+
+
+def url_hash(url):
+    return hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
+
+
+def insert_from_select(model, queryset, values, ignore_conflicts=False):
+    """INSERT INTO model ... SELECT ... FROM queryset одним запросом.
+
+    values — {поле model: выражение над строкой queryset}. Возвращает число добавленных строк.
+    """
+    # Столбцы SELECT идут в порядке аннотаций, только если в нём нет обычных полей
+    columns = {f'insert_{field}': expression for field, expression in values.items()}
+    rows = queryset.order_by().annotate(**columns).values_list(*columns)
+    using = router.db_for_write(model)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    select_sql, params = rows.query.get_compiler(using).as_sql()
+    names = ', '.join(quote(model._meta.get_field(field).column) for field in values)
+    sql = f'INSERT INTO {quote(model._meta.db_table)} ({names}) {select_sql}'
+    if ignore_conflicts:
+        # SELECT всегда с WHERE: без него SQLite не разберёт ON CONFLICT
+        sql += ' ON CONFLICT DO NOTHING'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def delete_selected(queryset):
+    """DELETE ... WHERE pk IN (SELECT ...) одним запросом, без загрузки строк и сигналов.
+
+    Строки, ссылающиеся на удаляемые с on_delete=CASCADE, удаляются раньше,
+    обычным delete() по подзапросу. Возвращает число удалённых строк.
+    """
+    model = queryset.model
+    for relation in model._meta.get_fields(include_hidden=True):
+        if not (relation.auto_created and not relation.concrete and (relation.one_to_many or relation.one_to_one)):
+            continue
+        if relation.on_delete is models.CASCADE:
+            relation.related_model._base_manager.filter(**{f'{relation.field.name}__in': queryset}).delete()
+        elif relation.on_delete is not models.DO_NOTHING:
+            raise ValueError(f'{relation.related_model.__name__}.{relation.field.name}: удаляются только CASCADE-связи')
+    using = router.db_for_write(model)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    select_sql, params = queryset.order_by().values('pk').query.get_compiler(using).as_sql()
+    sql = f'DELETE FROM {quote(model._meta.db_table)} WHERE {quote(model._meta.pk.column)} IN ({select_sql})'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
@@ -1,90 +1,74 @@
-import requests
-from bs4 import BeautifulSoup
+from django.conf import settings
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import LoginView
-from django.http import HttpResponseNotFound
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import router
+from django.http import FileResponse, Http404, HttpResponseNotFound, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
+from django.views.decorators.http import etag, require_safe
 from django.views.generic import CreateView, DeleteView, ListView, UpdateView
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-from rest_framework import permissions
+from rest_framework import permissions, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import (
     CreateAPIView,
     DestroyAPIView,
     ListAPIView,
     UpdateAPIView,
 )
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from .batch import add_to_collection, delete_bookmarks, remove_from_collection
+from .caching import CachedListAPIMixin, CachedListMixin
+from .changes import TokenExpired, changes_since, current_token
 from .forms import (
     AddBookmarkForm,
     AddCollectionForm,
+    BookmarkSearchForm,
     LoginUserForm,
     RegisterUserForm,
 )
+from .exporters import CSVExportRenderer, JSONLinesExportRenderer, NetscapeHTMLExportRenderer
+from .importers import (
+    BookmarkImporter,
+    CSVRequestParser,
+    JSONLinesRequestParser,
+    NetscapeHTMLRequestParser,
+    normalize_items,
+    parse_netscape_html,
+    parse_upload,
+)
+from .jobs import enqueue_metadata_job
+from .metadata import MetadataResolver
 from .models import Bookmark, Collection
+from .pagination import KeysetPagination, KeysetPaginationMixin, get_page_size
+from .previews import preview_storage, thumbnail_name
+from .routers import ReplicaReadMixin
+from .search import search_bookmarks
 from .serializers import (
+    BookmarkBatchResponseSerializer,
+    BookmarkBatchSerializer,
+    BookmarkCollectionBatchSerializer,
+    BookmarkImportItemSerializer,
+    BookmarkImportResponseSerializer,
     BookmarkRequestSerializer,
     BookmarkSerializer,
     CollectionRequestSerializer,
     CollectionSerializer,
+    SyncResponseSerializer,
 )
 from .utils import DataMixin
 
 
-def check_og_type(og_type):
-    if 'article' in og_type:
-        return 'article'
-    elif 'book' in og_type:
-        return 'book'
-    elif 'music' in og_type:
-        return 'music'
-    elif 'video' in og_type:
-        return 'video'
-    else:
-        return 'website'
-
-
-def find_meta_content(soup, og_name):
-    prop_meta = soup.find('meta', property=f'og:{og_name}')
-    if prop_meta:
-        return prop_meta.get('content', '')
-
-    name_meta = soup.find('meta', attrs={'name': f'og:{og_name}'})
-    if name_meta:
-        return name_meta.get('content', '')
-
-    if og_name == 'title':
-        return soup.title.string if soup.title else ''
-
-    if og_name == 'description':
-        description = soup.find('meta', attrs={'name': og_name})
-        if description:
-            return description.get('content', '')
-
-    return ''
-
-
-def get_open_graph_data(url):
-    response = requests.get(url)
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        og_data = {
-            'title': find_meta_content(soup, 'title'),
-            'description': find_meta_content(soup, 'description'),
-            'image': find_meta_content(soup, 'image'),
-            'type': find_meta_content(soup, 'type'),
-        }
-
-        return og_data
-    else:
-        return None
-
-
 def is_not_authenticated(user):
     return not user.is_authenticated
 
@@ -94,7 +78,7 @@ def pageNotFound(request, exception):
 
 
 @method_decorator(login_required, name='dispatch')
-class BookmarkHome(DataMixin, ListView):
+class BookmarkHome(ReplicaReadMixin, CachedListMixin, KeysetPaginationMixin, DataMixin, ListView):
     model = Bookmark
     template_name = 'bookmarks/bookmarks.html'
     context_object_name = 'bookmarks'
@@ -105,15 +89,66 @@ class BookmarkHome(DataMixin, ListView):
         return dict(list(context.items()) + list(c_def.items()))
 
     def get_queryset(self):
-        return Bookmark.objects.filter(user=self.request.user)
+        return Bookmark.objects.filter(user=self.request.user).for_list()
+
+
+class BookmarkHomeAPI(ReplicaReadMixin, CachedListAPIMixin, DataMixin, ListAPIView):
+    serializer_class = BookmarkSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return Bookmark.objects.filter(user=self.request.user).for_list()
+
+
+def search_form_results(form, user, limit):
+    if not form.is_valid() or not form.cleaned_data['q']:
+        return []
+    collection = form.cleaned_data['collection']
+    return search_bookmarks(
+        user,
+        form.cleaned_data['q'],
+        bookmark_type=form.cleaned_data['bookmark_type'],
+        collection_id=collection.pk if collection else None,
+        limit=limit,
+    )
+
+
+@method_decorator(login_required, name='dispatch')
+class BookmarkSearchView(ReplicaReadMixin, DataMixin, ListView):
+    template_name = 'bookmarks/search.html'
+    context_object_name = 'bookmarks'
+    paginate_by = None
+
+    def get_queryset(self):
+        self.form = BookmarkSearchForm(self.request.GET, user=self.request.user)
+        return search_form_results(self.form, self.request.user, get_page_size(self.request.GET))
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data(**kwargs)
+        c_def = self.get_user_context(title="Поиск закладок", form=self.form)
+        return dict(list(context.items()) + list(c_def.items()))
 
 
-class BookmarkHomeAPI(DataMixin, ListAPIView):
+class BookmarkSearchAPIView(ReplicaReadMixin, LoginRequiredMixin, ListAPIView):
     serializer_class = BookmarkSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = None
+
+    @swagger_auto_schema(manual_parameters=[
+        openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True),
+        openapi.Parameter('bookmark_type', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+        openapi.Parameter('collection', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        openapi.Parameter('page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+    ])
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
 
     def get_queryset(self):
-        return Bookmark.objects.filter(user=self.request.user)
+        form = BookmarkSearchForm(self.request.query_params, user=self.request.user)
+        if not form.is_valid():
+            raise ValidationError(form.errors)
+        return search_form_results(form, self.request.user, get_page_size(self.request.query_params))
 
 
 class BookmarkCreateView(LoginRequiredMixin, DataMixin, CreateView):
@@ -124,21 +159,15 @@ class BookmarkCreateView(LoginRequiredMixin, DataMixin, CreateView):
     raise_exception = True
 
     def form_valid(self, form):
-        url = form.cleaned_data.get('url')
-        og_data = get_open_graph_data(url)
         form.instance.user = self.request.user
-
-        if og_data:
-            form.instance.title = og_data.get('title', '')
-            form.instance.description = og_data.get('description', '')
-            form.instance.preview_image = og_data.get('image', '')
-            form.instance.bookmark_type = check_og_type(og_data.get('type', ''))
-            form.instance.url = url
+        # Данные Open Graph загружает воркер, пока вместо заголовка показываем ссылку
+        form.instance.set_url(form.cleaned_data['url'])
 
         bookmark = form.save()
         collections = form.cleaned_data.get('collections')
         if collections:
             bookmark.collections.set(collections)
+        enqueue_metadata_job(bookmark)
 
         return redirect(self.success_url)
 
@@ -158,17 +187,7 @@ class BookmarkCreateAPIView(LoginRequiredMixin, DataMixin, CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def perform_create(self, serializer):
-        url = serializer.validated_data.get('url')
-        og_data = get_open_graph_data(url)
         user = self.request.user
-
-        if og_data:
-            serializer.validated_data['title'] = og_data.get('title', '')
-            serializer.validated_data['description'] = og_data.get('description', '')
-            serializer.validated_data['preview_image'] = og_data.get('image', '')
-            serializer.validated_data['bookmark_type'] = check_og_type(og_data.get('type', ''))
-            serializer.validated_data['url'] = url
-
         serializer.save(user=user)
 
     def get_user_context(self, **kwargs):
@@ -185,6 +204,60 @@ class BookmarkCreateAPIView(LoginRequiredMixin, DataMixin, CreateAPIView):
         return self.create(request, *args, **kwargs)
 
 
+class BookmarkBulkImportAPIView(LoginRequiredMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, JSONLinesRequestParser, CSVRequestParser, NetscapeHTMLRequestParser, MultiPartParser]
+
+    @swagger_auto_schema(
+        request_body=BookmarkImportItemSerializer(many=True),
+        responses={201: BookmarkImportResponseSerializer()}
+    )
+    def post(self, request, *args, **kwargs):
+        try:
+            if isinstance(request.data, str):
+                items = parse_netscape_html(request.data)
+            elif 'file' in request.FILES:
+                items = parse_upload(request.FILES['file'])
+            else:
+                items = normalize_items(request.data)
+            results = BookmarkImporter(request.user).run(items)
+        except DjangoValidationError as exc:
+            raise ValidationError(exc.messages)
+
+        created = sum(1 for result in results if result['status'] == 'created')
+        return Response({'created': created, 'results': results}, status=status.HTTP_201_CREATED)
+
+
+class BookmarkExportAPIView(ReplicaReadMixin, LoginRequiredMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    # Формат выбирается параметром ?format= или заголовком Accept
+    renderer_classes = [JSONLinesExportRenderer, CSVExportRenderer, NetscapeHTMLExportRenderer]
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'format', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['jsonl', 'csv', 'html'], default='jsonl'
+            ),
+        ],
+        responses={200: 'Файл со всеми закладками пользователя, принимается массовым импортом'},
+    )
+    def get(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        # Строки читаются уже после выхода из dispatch, поэтому базу для чтения выбираем сейчас
+        using = router.db_for_read(Bookmark)
+        response = StreamingHttpResponse(
+            renderer.stream(request.user, using), content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = f'attachment; filename="bookmarks.{renderer.format}"'
+        return response
+
+    def handle_exception(self, exc):
+        # Ошибки отдаём в JSON, а не в формате выгрузки
+        self.request.accepted_renderer = JSONRenderer()
+        self.request.accepted_media_type = JSONRenderer.media_type
+        return super().handle_exception(exc)
+
+
 class BookmarkUpdateView(LoginRequiredMixin, DataMixin, UpdateView):
     model = Bookmark
     form_class = AddBookmarkForm
@@ -195,7 +268,14 @@ class BookmarkUpdateView(LoginRequiredMixin, DataMixin, UpdateView):
 
     def form_valid(self, form):
         form.instance.user = self.request.user
-        return super().form_valid(form)
+        url_changed = 'url' in form.changed_data
+        if url_changed:
+            form.instance.set_url(form.cleaned_data['url'])
+            form.instance.enrichment_status = Bookmark.ENRICHMENT_PENDING
+        response = super().form_valid(form)
+        if url_changed:
+            enqueue_metadata_job(self.object)
+        return response
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
@@ -213,21 +293,11 @@ class BookmarkUpdateAPIView(LoginRequiredMixin, DataMixin, UpdateAPIView):
     queryset = Bookmark.objects.all()
 
     def perform_update(self, serializer):
-        url = serializer.validated_data.get('url')
-        og_data = get_open_graph_data(url)
         user = self.request.user
-
-        if og_data:
-            serializer.validated_data['title'] = og_data.get('title', '')
-            serializer.validated_data['description'] = og_data.get('description', '')
-            serializer.validated_data['preview_image'] = og_data.get('image', '')
-            serializer.validated_data['bookmark_type'] = check_og_type(og_data.get('type', ''))
-            serializer.validated_data['url'] = url
-
         serializer.save(user=user)
 
     def get_serializer_context(self):
-        return {'request': self.request}
+        return {'request': self.request, 'metadata_resolver': MetadataResolver()}
 
     def get_user_context(self, **kwargs):
         context = kwargs
@@ -264,8 +334,77 @@ class BookmarkDeleteAPIView(LoginRequiredMixin, DataMixin, DestroyAPIView):
         return context
 
 
+class BookmarkBatchAPIView(LoginRequiredMixin, APIView):
+    """Операция над списком закладок пользователя; чужие и несуществующие id пропускаются.
+
+    operation — функция из batch.py, которая получает пользователя и проверенные данные запроса.
+    """
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = BookmarkBatchSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        count = self.operation(request.user, **serializer.validated_data)
+        return Response({'count': count})
+
+
+class BookmarkBatchDeleteAPIView(BookmarkBatchAPIView):
+    operation = staticmethod(delete_bookmarks)
+
+    @swagger_auto_schema(request_body=BookmarkBatchSerializer, responses={200: BookmarkBatchResponseSerializer()})
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
+
+class BookmarkBatchAddToCollectionAPIView(BookmarkBatchAPIView):
+    serializer_class = BookmarkCollectionBatchSerializer
+    operation = staticmethod(add_to_collection)
+
+    @swagger_auto_schema(
+        request_body=BookmarkCollectionBatchSerializer, responses={200: BookmarkBatchResponseSerializer()}
+    )
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
+
+class BookmarkBatchRemoveFromCollectionAPIView(BookmarkBatchAddToCollectionAPIView):
+    operation = staticmethod(remove_from_collection)
+
+
+class SyncAPIView(LoginRequiredMixin, APIView):
+    """Изменения закладок, коллекций и их связей после токена since.
+
+    Без since возвращает только текущий токен: клиент запоминает его, затем
+    загружает полные списки и дальше запрашивает изменения после токена.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('since', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Токен прошлого ответа'),
+        ],
+        responses={200: SyncResponseSerializer(), 410: 'Токен устарел, нужна полная загрузка списков'},
+    )
+    def get(self, request, *args, **kwargs):
+        since = request.query_params.get('since')
+        if since is None:
+            return Response({'token': str(current_token())})
+        if not since.isdigit():
+            raise ValidationError({'since': 'Некорректный токен'})
+        since = int(since)
+        try:
+            changes = changes_since(request.user, since)
+        except TokenExpired:
+            return Response({'detail': 'Токен устарел, загрузите списки заново'}, status=status.HTTP_410_GONE)
+        changes['token'] = str(changes['token'])
+        return Response(SyncResponseSerializer(changes).data)
+
+
 @method_decorator(login_required, name='dispatch')
-class CollectionListView(DataMixin, ListView):
+class CollectionListView(ReplicaReadMixin, CachedListMixin, KeysetPaginationMixin, DataMixin, ListView):
     model = Collection
     template_name = 'bookmarks/collections.html'
     context_object_name = 'collections'
@@ -276,18 +415,19 @@ class CollectionListView(DataMixin, ListView):
         return dict(list(context.items()) + list(c_def.items()))
 
     def get_queryset(self):
-        return Collection.objects.filter(user=self.request.user)
+        return Collection.objects.filter(user=self.request.user).for_list()
 
 
-class CollectionListAPIView(LoginRequiredMixin, ListAPIView):
+class CollectionListAPIView(ReplicaReadMixin, CachedListAPIMixin, LoginRequiredMixin, ListAPIView):
     serializer_class = CollectionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return Collection.objects.filter(user=self.request.user)
+        return Collection.objects.filter(user=self.request.user).for_list()
 
 
-class CollectionBookmarksView(DataMixin, ListView):
+class CollectionBookmarksView(ReplicaReadMixin, KeysetPaginationMixin, DataMixin, ListView):
     model = Bookmark
     template_name = 'bookmarks/collection_bookmarks.html'
     context_object_name = 'bookmarks'
@@ -303,17 +443,18 @@ class CollectionBookmarksView(DataMixin, ListView):
 
     def get_queryset(self):
         collection_id = self.kwargs.get('collection_id')
-        return Bookmark.objects.filter(user=self.request.user, collections__id=collection_id)
+        return Bookmark.objects.filter(user=self.request.user, collections__id=collection_id).for_list()
 
 
-class CollectionBookmarksAPIView(LoginRequiredMixin, ListAPIView):
+class CollectionBookmarksAPIView(ReplicaReadMixin, LoginRequiredMixin, ListAPIView):
     serializer_class = BookmarkSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         collection_id = self.kwargs.get('collection_id')
         collection = get_object_or_404(Collection, id=collection_id, user=self.request.user)
-        return collection.bookmarks.all()
+        return collection.bookmarks.for_list()
 
 
 class CollectionCreateView(LoginRequiredMixin, CreateView):
@@ -440,3 +581,22 @@ class LoginUser(DataMixin, LoginView):
 def logout_user(request):
     logout(request)
     return redirect('login')
+
+
+PREVIEW_MAX_AGE = 60 * 60 * 24 * 365
+
+
+@require_safe
+@etag(lambda request, digest, width: f'{digest}-{width}')
+def preview_image(request, digest, width):
+    """Миниатюра превью из хранилища: адрес зависит от содержимого, поэтому ответ кэшируется навсегда."""
+    width = int(width)
+    if width not in settings.BOOKMARKS_PREVIEW_WIDTHS:
+        raise Http404
+    try:
+        image = preview_storage.open(thumbnail_name(digest, width))
+    except FileNotFoundError:
+        raise Http404
+    response = FileResponse(image, content_type='image/webp')
+    response['Cache-Control'] = f'public, max-age={PREVIEW_MAX_AGE}, immutable'
+    return response
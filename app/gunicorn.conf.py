@@ -0,0 +1,54 @@
+"""Настройки gunicorn для production: запуск из каталога app командой `gunicorn`.
+
+GUNICORN_MODE=wsgi — синхронные воркеры с потоками (gthread),
+GUNICORN_MODE=asgi — воркеры uvicorn для асинхронных API (/api/async/...).
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+mode = os.environ.get('GUNICORN_MODE', 'wsgi')
+if mode == 'asgi':
+    wsgi_app = 'app.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'app.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# Перезапуск воркеров ограничивает рост памяти; разброс не даёт им перезапуститься одновременно
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+# Файлы heartbeat воркеров в памяти: overlay-файловая система Docker может подвешивать их
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+# Метрики Prometheus воркеры пишут в файлы общего каталога, /metrics собирает их вместе
+metrics_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(worker_tmp_dir or tempfile.gettempdir(), 'bookmarks-metrics')
+)
+accesslog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_worker_init(worker):
+    # URL-конфигурация загружается до первого запроса: готовый воркер не отвечает медленно
+    from django.urls import get_resolver
+
+    get_resolver().url_patterns
+
+
+def on_starting(server):
+    # Счётчики прошлого запуска не должны попасть в новые
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,159 @@
+"""Пропускная способность изменения закладок под WSGI и ASGI, когда сайты отвечают медленно.
+
+Поднимает локальный сайт-заглушку, который отвечает с задержкой, и запускает приложение
+дважды: gunicorn с синхронным API (/api/bookmarks/<pk>/update/) и uvicorn с асинхронным
+(/api/async/bookmarks/<pk>/update/). Каждый запрос меняет ссылку закладки, поэтому
+сервер ждёт загрузку страницы. Запросы распределены по адресам 127.0.0.1-127.0.0.N,
+чтобы не упираться в лимит BOOKMARKS_FETCH_MAX_PER_HOST.
+
+База создаётся заново при каждом запуске: PostgreSQL, если задан POSTGRES_HOST
+(и при необходимости POSTGRES_PORT, POSTGRES_USER, POSTGRES_PASSWORD, BENCHMARK_POSTGRES_DB),
+иначе SQLite, которая годится только для режима asgi.
+
+    POSTGRES_HOST=localhost python benchmarks/asgi_vs_wsgi.py --requests 400 --concurrency 200 --delay 1
+"""
+import argparse
+import asyncio
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+from common import APP_DIR, free_port, reset_database, setup_environment, start_stub_site
+
+
+def setup_database(count):
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    reset_database()
+    call_command('migrate', verbosity=0)
+
+    from django.contrib.auth import get_user_model
+    from django.middleware.csrf import _get_new_csrf_token
+    from django.test import Client
+
+    from bookmarks.models import Bookmark, Link
+
+    user = get_user_model().objects.create_user(username='bench@example.com', password='bench')
+    bookmarks = []
+    for index in range(count):
+        url = f'https://example.com/{index}'
+        bookmarks.append(Bookmark.objects.create(user=user, url=url, link=Link.objects.for_url(url)))
+
+    client = Client()
+    client.force_login(user)
+    csrf_token = _get_new_csrf_token()
+    cookies = {'sessionid': client.cookies['sessionid'].value, 'csrftoken': csrf_token}
+    return [bookmark.pk for bookmark in bookmarks], cookies, csrf_token
+
+
+def start_server(mode, port, args, env):
+    if mode == 'wsgi':
+        command = [
+            sys.executable, '-m', 'gunicorn', 'app.wsgi:application',
+            '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers), '--threads', str(args.threads),
+            '--timeout', '120', '--log-level', 'warning',
+        ]
+    else:
+        command = [
+            sys.executable, '-m', 'uvicorn', 'app.asgi:application',
+            '--port', str(port), '--workers', str(args.workers), '--log-level', 'warning', '--no-access-log',
+        ]
+    process = subprocess.Popen(command, cwd=APP_DIR, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f'http://127.0.0.1:{port}/login/', timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+async def run_load(mode, port, pks, cookies, csrf_token, args, stub_port):
+    path = '/api/bookmarks/{}/update/' if mode == 'wsgi' else '/api/async/bookmarks/{}/update/'
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    statuses = Counter()
+
+    async with httpx.AsyncClient(
+        base_url=f'http://127.0.0.1:{port}',
+        cookies=cookies,
+        headers={'X-CSRFToken': csrf_token},
+        timeout=120,
+        limits=httpx.Limits(max_connections=args.concurrency),
+    ) as client:
+        async def update(index):
+            pk = pks[index % len(pks)]
+            host = f'127.0.0.{index % args.hosts + 1}'
+            body = {'url': f'http://{host}:{stub_port}/{mode}/{index}'}
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.put(path.format(pk), json=body)
+                    statuses[response.status_code] += 1
+                except httpx.HTTPError as exc:
+                    statuses[exc.__class__.__name__] += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(update(index) for index in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'mode': mode,
+        'requests': args.requests,
+        'errors': args.requests - statuses[200],
+        'statuses': dict(statuses),
+        'elapsed': elapsed,
+        'rps': args.requests / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--delay', type=float, default=0.5, help='задержка ответа сайта-заглушки, секунды')
+    parser.add_argument('--hosts', type=int, default=50, help='число адресов 127.0.0.x для заглушки')
+    parser.add_argument('--workers', type=int, default=1, help='процессов сервера в обоих режимах')
+    parser.add_argument('--threads', type=int, default=8, help='потоков на процесс gunicorn')
+    parser.add_argument('--modes', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+    args = parser.parse_args()
+
+    env = setup_environment()
+    stub = start_stub_site(args.delay)
+    pks, cookies, csrf_token = setup_database(min(args.requests, args.concurrency))
+
+    results = []
+    for mode in args.modes:
+        port = free_port()
+        process = start_server(mode, port, args, env)
+        try:
+            results.append(asyncio.run(
+                run_load(mode, port, pks, cookies, csrf_token, args, stub.server_address[1])
+            ))
+        finally:
+            process.terminate()
+            process.wait()
+    stub.shutdown()
+
+    print(f'{"mode":<6}{"requests":>10}{"errors":>8}{"time, s":>10}{"req/s":>9}{"p50, s":>9}{"p95, s":>9}')
+    for row in results:
+        print(
+            f'{row["mode"]:<6}{row["requests"]:>10}{row["errors"]:>8}{row["elapsed"]:>10.2f}'
+            f'{row["rps"]:>9.1f}{row["p50"]:>9.2f}{row["p95"]:>9.2f}  {row["statuses"]}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Общие части бенчмарков: окружение Django, сайт-заглушка и пересоздание базы."""
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+APP_DIR = ROOT / 'app'
+
+PAGE_KINDS = ('og', 'huge', 'binary')
+
+
+def setup_environment():
+    """Переменные окружения для процессов бенчмарка и путь импорта для текущего."""
+    env = dict(os.environ)
+    # База в памяти (tmpfs): замеряем приложение, а не fsync при коммитах SQLite
+    tmp = '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp'
+    env.setdefault('BENCHMARK_DATABASE', os.path.join(tmp, 'bookmarks-benchmark.sqlite3'))
+    env['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+    env['PYTHONPATH'] = os.pathsep.join([str(ROOT), str(APP_DIR), env.get('PYTHONPATH', '')])
+    os.environ.update(env)
+    sys.path[:0] = [str(ROOT), str(APP_DIR)]
+    return env
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_stub_site(delay, huge_bytes=20 * 1024 * 1024, binary_bytes=1024 * 1024):
+    """Сайт-заглушка на всех адресах 127.0.0.0/8, отвечает через delay секунд.
+
+    /huge/... — страница Open Graph с телом huge_bytes, /binary/... — не HTML
+    размером binary_bytes, остальные адреса — обычная страница Open Graph.
+    """
+    class StubPage(BaseHTTPRequestHandler):
+        # Заголовки и тело уходят отдельными пакетами: без этого Nagle добавляет к ответу ~40 мс
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            time.sleep(delay)
+            kind = self.path.strip('/').split('/', 1)[0]
+            if kind == 'binary':
+                self.send_body(b'\0' * binary_bytes, 'application/octet-stream')
+            else:
+                head = (
+                    f'<html><head><title>Page {self.path}</title>'
+                    f'<meta property="og:title" content="Page {self.path}">'
+                    f'<meta property="og:description" content="Stub page">'
+                    f'<meta property="og:type" content="article"></head><body>'
+                ).encode()
+                padding = huge_bytes if kind == 'huge' else 0
+                self.send_body(head + b'</body></html>', 'text/html; charset=utf-8', padding)
+
+        def send_body(self, body, content_type, padding=0):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body) + padding))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+                chunk = b' ' * 64 * 1024
+                for _ in range(padding // len(chunk)):
+                    self.wfile.write(chunk)
+                self.wfile.write(b' ' * (padding % len(chunk)))
+            except (BrokenPipeError, ConnectionResetError):
+                # Клиент дочитал <head> и закрыл соединение
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    # Слушаем все адреса 127.0.0.0/8, чтобы у каждой ссылки мог быть свой хост
+    server = ThreadingHTTPServer(('', 0), StubPage)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def reset_database():
+    from django.conf import settings
+
+    database = settings.DATABASES['default']
+    if database['ENGINE'].endswith('sqlite3'):
+        Path(database['NAME']).unlink(missing_ok=True)
+        return
+
+    import psycopg2
+
+    connection = psycopg2.connect(
+        dbname='postgres', user=database['USER'], password=database['PASSWORD'],
+        host=database['HOST'], port=database['PORT'] or None,
+    )
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS "{database["NAME"]}"')
+        cursor.execute(f'CREATE DATABASE "{database["NAME"]}"')
+    connection.close()
@@ -0,0 +1,30 @@
+"""Настройки для бенчмарков: отдельная база и быстрый хэш паролей."""
+import os
+
+from app.settings import *  # noqa: F401,F403
+
+DEBUG = False
+ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
+
+if os.environ.get('POSTGRES_HOST'):
+    # Подключение из app.settings (переменные POSTGRES_*), но своя база: бенчмарк пересоздаёт её
+    DATABASES['default']['NAME'] = os.environ.get('BENCHMARK_POSTGRES_DB', 'bookmarks_benchmark')
+else:
+    # SQLite не выдерживает параллельной записи из потоков gunicorn: для сравнения с WSGI нужен PostgreSQL
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ['BENCHMARK_DATABASE'],
+            'OPTIONS': {'timeout': 30},
+        }
+    }
+    BOOKMARKS_READ_REPLICAS = []
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {'django.request': {'handlers': ['console'], 'level': 'ERROR'}},
+}
@@ -0,0 +1,316 @@
+"""Задержки, пропускная способность и число запросов к базе для основных страниц и API.
+
+Создаёт пользователя с коллекциями и наполняет его закладками до каждого размера
+из --sizes (база растёт между прогонами, не пересоздаётся). На каждом размере
+последовательно выполняет сценарии create, list, collection, update и delete
+через HTML-страницы и /api/. Запросы идут через тестовый клиент Django внутри
+процесса: замеряется приложение без сетевого сервера (параллельную обработку
+сравнивает asgi_vs_wsgi.py). Ответы списков не берутся из кэша: версия данных
+пользователя сбрасывается перед каждым запросом.
+
+Новые ссылки ведут на локальный сайт-заглушку с задержкой --delay; среди них
+каждая --huge-every — страница на несколько мегабайт, каждая --binary-every —
+не HTML. Загрузку страницы внутри запроса делает только изменение ссылки через API.
+
+Результат записывается в JSON (--output) вместе с коммитом; --compare сравнивает
+его с прошлым результатом и завершается с кодом 1 при ухудшении больше --threshold.
+
+    python benchmarks/suite.py --sizes 10000 100000
+    POSTGRES_HOST=localhost python benchmarks/suite.py --sizes 10000 100000 1000000 --compare old.json
+"""
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from django.urls import reverse
+
+from common import ROOT, reset_database, setup_environment, start_stub_site
+
+RESULTS_DIR = ROOT / 'benchmarks' / 'results'
+SEED_BATCH_SIZE = 5000
+SCENARIOS = ('create', 'list', 'collection', 'update', 'delete')
+ROUTES = ('html', 'api')
+# Метрики, рост которых считается ухудшением
+COMPARED_METRICS = ('p50_ms', 'p99_ms', 'queries_max')
+
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+
+    return {'commit': git('rev-parse', 'HEAD'), 'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+
+class Benchmark:
+    def __init__(self, args, stub_port):
+        from django.contrib.auth import get_user_model
+        from django.test import Client
+
+        from bookmarks.models import Collection
+
+        self.args = args
+        self.stub_port = stub_port
+        self.random = random.Random(args.seed)
+        self.user = get_user_model().objects.create_user(username='bench@example.com', password='bench')
+        Collection.objects.bulk_create([
+            Collection(user=self.user, title=f'Collection {index}', description='')
+            for index in range(args.collections)
+        ])
+        self.collection_ids = list(Collection.objects.filter(user=self.user).values_list('id', flat=True))
+        self.size = 0
+        self.counter = 0
+        self.client = Client(HTTP_HOST='localhost')
+        self.client.force_login(self.user)
+
+    def seed(self, size):
+        """Добавляет закладки до size пакетами; каждая вторая закладка лежит в коллекции."""
+        from bookmarks.models import Bookmark, BookmarkCollection, Link
+        from bookmarks.utils import url_hash
+
+        for start in range(self.size, size, SEED_BATCH_SIZE):
+            numbers = range(start, min(size, start + SEED_BATCH_SIZE))
+            urls = {number: f'https://site{number % 997}.example.com/page/{number}' for number in numbers}
+            links = Link.objects.for_urls(list(urls.values()))
+            Bookmark.objects.bulk_create([
+                Bookmark(
+                    user=self.user, url=url, link=links[url_hash(url)], title=f'Bookmark {number}',
+                    enrichment_status=Bookmark.ENRICHMENT_DONE,
+                )
+                for number, url in urls.items()
+            ], batch_size=SEED_BATCH_SIZE)
+            ids = Bookmark.objects.filter(
+                user=self.user, link__in=list(links.values())
+            ).order_by('id').values_list('id', flat=True)
+            BookmarkCollection.objects.bulk_create([
+                BookmarkCollection(bookmark_id=pk, collection_id=self.collection_ids[pk % len(self.collection_ids)])
+                for pk in ids if pk % 2
+            ], batch_size=SEED_BATCH_SIZE)
+        self.size = size
+
+    def stub_url(self):
+        """Новая ссылка на сайт-заглушку: каждый раз другая, чтобы не попадать в кэш данных страниц."""
+        self.counter += 1
+        if self.counter % self.args.binary_every == 0:
+            kind = 'binary'
+        elif self.counter % self.args.huge_every == 0:
+            kind = 'huge'
+        else:
+            kind = 'og'
+        host = f'127.0.0.{self.counter % self.args.hosts + 1}'
+        return f'http://{host}:{self.stub_port}/{kind}/{self.size}/{self.counter}'
+
+    def random_bookmark(self):
+        from bookmarks.models import Bookmark
+
+        # Случайная закладка по индексу без ORDER BY random(): смещение по первичному ключу
+        queryset = Bookmark.objects.filter(user=self.user).order_by('id')
+        return queryset.values_list('id', flat=True)[self.random.randrange(queryset.count())]
+
+    def bookmark_url(self, name):
+        return reverse(name, args=[self.random_bookmark()])
+
+    def collection_url(self, name):
+        from bookmarks.caching import bump_user_version
+
+        # Ответ не должен браться из кэша списков
+        bump_user_version(self.user.pk)
+        return reverse(name, args=[self.random.choice(self.collection_ids)])
+
+    def list_url(self, name):
+        from bookmarks.caching import bump_user_version
+
+        bump_user_version(self.user.pk)
+        return reverse(name)
+
+    # Каждый сценарий готовит запрос вне замера и возвращает функцию, которая его выполняет
+
+    def create_html(self):
+        url = reverse('add_bookmark')
+        return lambda: self.client.post(url, {'url': self.stub_url()})
+
+    def create_api(self):
+        url = reverse('api_add_bookmark')
+        return lambda: self.client.post(url, {'url': self.stub_url()}, content_type='application/json')
+
+    def list_html(self):
+        url = self.list_url('home')
+        return lambda: self.client.get(url)
+
+    def list_api(self):
+        url = self.list_url('api_bookmark')
+        return lambda: self.client.get(url)
+
+    def collection_html(self):
+        url = self.collection_url('collection_bookmarks')
+        return lambda: self.client.get(url)
+
+    def collection_api(self):
+        url = self.collection_url('api_collection_bookmarks')
+        return lambda: self.client.get(url)
+
+    def update_html(self):
+        url = self.bookmark_url('update_bookmark')
+        return lambda: self.client.post(url, {'url': self.stub_url(), 'title': 'Updated'})
+
+    def update_api(self):
+        url = self.bookmark_url('api_update_bookmark')
+        return lambda: self.client.put(url, {'url': self.stub_url()}, content_type='application/json')
+
+    def delete_html(self):
+        url = self.bookmark_url('delete_bookmark')
+        return lambda: self.client.post(url)
+
+    def delete_api(self):
+        url = self.bookmark_url('api_delete_bookmark')
+        return lambda: self.client.delete(url)
+
+    def run(self):
+        results = []
+        for scenario in self.args.only or SCENARIOS:
+            for route in ROUTES:
+                results.append(self.measure(scenario, route))
+                print_row(results[-1])
+        return results
+
+    def measure(self, scenario, route):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        prepare = getattr(self, f'{scenario}_{route}')
+        for _ in range(self.args.warmup):
+            prepare()()
+        latencies, queries, statuses = [], [], Counter()
+        for _ in range(self.args.requests):
+            request = prepare()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = request()
+                latencies.append(time.perf_counter() - started)
+            queries.append(len(captured))
+            statuses[response.status_code] += 1
+        return summarize(scenario, route, self.size, latencies, queries, statuses)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(scenario, route, size, latencies, queries, statuses):
+    return {
+        'scenario': scenario,
+        'route': route,
+        'bookmarks': size,
+        'requests': len(latencies),
+        'errors': sum(count for status, count in statuses.items() if status >= 400),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        # Запросы идут подряд: пропускная способность одного клиента
+        'throughput_rps': round(len(latencies) / sum(latencies), 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'queries_p50': statistics.median(queries),
+        'queries_max': max(queries),
+    }
+
+
+HEADER = f'{"bookmarks":>10} {"scenario":<11}{"route":<6}{"req/s":>9}{"p50, ms":>10}{"p99, ms":>10}{"queries":>9}  statuses'
+
+
+def print_row(row):
+    print(
+        f'{row["bookmarks"]:>10} {row["scenario"]:<11}{row["route"]:<6}{row["throughput_rps"]:>9.1f}'
+        f'{row["p50_ms"]:>10.2f}{row["p99_ms"]:>10.2f}{row["queries_max"]:>9}  {row["statuses"]}',
+        flush=True,
+    )
+
+
+def compare(results, baseline, threshold):
+    """Печатает изменения относительно прошлого результата и возвращает число ухудшений."""
+    previous = {(row['bookmarks'], row['scenario'], row['route']): row for row in baseline['results']}
+    regressions = 0
+    print(f'\nСравнение с {baseline["revision"]["commit"][:12]}:')
+    for row in results:
+        old = previous.get((row['bookmarks'], row['scenario'], row['route']))
+        if old is None:
+            continue
+        changes = []
+        for metric in COMPARED_METRICS:
+            change = (row[metric] - old[metric]) / old[metric] if old[metric] else 0
+            worse = change > threshold
+            regressions += worse
+            changes.append(f'{metric} {old[metric]} -> {row[metric]} ({change:+.0%}){" !" if worse else ""}')
+        print(f'{row["bookmarks"]:>10} {row["scenario"]:<11}{row["route"]:<6}' + ', '.join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000], help='число закладок пользователя')
+    parser.add_argument('--collections', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=100, help='запросов на сценарий')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--only', nargs='+', choices=SCENARIOS)
+    parser.add_argument('--delay', type=float, default=0.05, help='задержка ответа сайта-заглушки, секунды')
+    parser.add_argument('--hosts', type=int, default=50, help='число адресов 127.0.0.x для заглушки')
+    parser.add_argument('--huge-every', type=int, default=10)
+    parser.add_argument('--binary-every', type=int, default=10)
+    parser.add_argument('--huge-bytes', type=int, default=20 * 1024 * 1024)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='файл результата (по умолчанию benchmarks/results/<время>-<коммит>.json)')
+    parser.add_argument('--compare', help='прошлый результат для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимое ухудшение, доля')
+    args = parser.parse_args()
+
+    setup_environment()
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    reset_database()
+    call_command('migrate', verbosity=0)
+
+    from django.db import connection
+
+    stub = start_stub_site(args.delay, huge_bytes=args.huge_bytes)
+    benchmark = Benchmark(args, stub.server_address[1])
+    results = []
+    print(HEADER)
+    for size in sorted(args.sizes):
+        started = time.perf_counter()
+        benchmark.seed(size)
+        print(f'{size:>10} seeded in {time.perf_counter() - started:.1f} s', flush=True)
+        results.extend(benchmark.run())
+    stub.shutdown()
+
+    revision = git_revision()
+    report = {
+        'revision': revision,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'database': connection.vendor,
+        'python': sys.version.split()[0],
+        'arguments': vars(args),
+        'results': results,
+    }
+    if args.output:
+        output = args.output
+    else:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f'{datetime.now():%Y%m%d-%H%M%S}-{revision["commit"][:12] or "unknown"}.json'
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'\nРезультат: {output}')
+
+    if args.compare:
+        with open(args.compare) as file:
+            if compare(results, json.load(file), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()